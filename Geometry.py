@@ -1,10 +1,12 @@
-import legendhpges as hpges
 import legendoptics.pen as pen_module  # or correct import path
 import pyg4ometry as pg4
 from numpy import pi
 
 import pygeomtools
 
+from detector_metadata import bege_meta, coax_meta
+from geometry_tools import cached_hpge, show_geometry
+
 
 # If you don’t have pygeomtools.detector_origins, define your own:
 def add_detector_origin(name, pv, registry):
@@ -19,50 +21,9 @@ def add_detector_origin(name, pv, registry):
 
 reg = pg4.geant4.Registry()
 
-bege_meta = {
-    "name": "B00000B",
-    "type": "bege",
-    "production": {
-        "enrichment": {"val": 0.874, "unc": 0.003},
-        "mass_in_g": 697.0,
-    },
-    "geometry": {
-        "height_in_mm": 29.46,
-        "radius_in_mm": 36.98,
-        "groove": {"depth_in_mm": 2.0, "radius_in_mm": {"outer": 10.5, "inner": 7.5}},
-        "pp_contact": {"radius_in_mm": 7.5, "depth_in_mm": 0},
-        "taper": {
-            "top": {"angle_in_deg": 0.0, "height_in_mm": 0.0},
-            "bottom": {"angle_in_deg": 0.0, "height_in_mm": 0.0},
-        },
-    },
-}
-
-coax_meta = {
-    "name": "C000RG1",
-    "type": "coax",
-    "production": {
-        "enrichment": {"val": 0.855, "unc": 0.015},
-    },
-    "geometry": {
-        "height_in_mm": 40,
-        "radius_in_mm": 38.25,
-        "borehole": {"radius_in_mm": 6.75, "depth_in_mm": 40},
-        "groove": {"depth_in_mm": 2, "radius_in_mm": {"outer": 20, "inner": 17}},
-        "pp_contact": {"radius_in_mm": 17, "depth_in_mm": 0},
-        "taper": {
-            "top": {"angle_in_deg": 45, "height_in_mm": 5},
-            "bottom": {"angle_in_deg": 45, "height_in_mm": 2},
-            "borehole": {"angle_in_deg": 0, "height_in_mm": 0},
-        },
-    },
-}
-
-
-
 # create logical volumes for the two HPGe detectors
-bege_l = hpges.make_hpge(bege_meta, name="BEGe_L", registry=reg)
-coax_l = hpges.make_hpge(coax_meta, name="Coax_L", registry=reg)
+bege_l = cached_hpge(bege_meta, reg, "BEGe_L")
+coax_l = cached_hpge(coax_meta, reg, "Coax_L")
 
 # create a world volume
 world_s = pg4.geant4.solid.Orb("World_s", 20, registry=reg, lunit="cm")
@@ -150,17 +111,11 @@ pg4.geant4.PhysicalVolume(
 )
 
 
-# start an interactive VTK viewer instance
-viewer = pg4.visualisation.VtkViewerColoured(
-    materialVisOptions={
-        "G4_lAr": [0, 0, 1, 0.1]
-    }
-)
-
-
-viewer.addLogicalVolume(reg.getWorldVolume())
-viewer.view()
 pygeomtools.write_pygeom(reg, "geometry.gdml")
 
+# start a VTK viewer instance (interactive, offscreen snapshots or none,
+# see PYG4_VIEW) once the GDML is on disk
+show_geometry(reg, {"G4_lAr": [0, 0, 1, 0.1]}, snapshot_prefix="geometry")
+
 
 print("PlasticScint origin:", plastic_pv.position)
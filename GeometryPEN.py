@@ -1,8 +1,6 @@
 import math
 import pyg4ometry.geant4 as g4
 import pyg4ometry.geant4.solid as solid
-import pyg4ometry.visualisation as vis
-from legendhpges import make_hpge
 from legendoptics.pen import (
     pyg4_pen_attach_rindex,
     pyg4_pen_attach_attenuation,
@@ -12,6 +10,9 @@ from legendoptics.pen import (
 from pygeomtools import RemageDetectorInfo, write_pygeom
 from numpy import pi
 
+from detector_metadata import bege_meta, coax_meta
+from geometry_tools import cached_hpge, show_geometry
+
 # -----------------------------
 # Helper to register detector origins
 # -----------------------------
@@ -56,40 +57,6 @@ pyg4_pen_attach_attenuation(pen, reg)
 pyg4_pen_attach_wls(pen, reg)
 pyg4_pen_attach_scintillation(pen, reg)
 
-# -----------------------------
-# HPGe detector metadata
-# -----------------------------
-bege_meta = {
-    "name": "B00000B",
-    "type": "bege",
-    "production": {"enrichment": {"val": 0.874, "unc": 0.003}, "mass_in_g": 697.0},
-    "geometry": {
-        "height_in_mm": 29.46,
-        "radius_in_mm": 36.98,
-        "groove": {"depth_in_mm": 2.0, "radius_in_mm": {"outer": 10.5, "inner": 7.5}},
-        "pp_contact": {"radius_in_mm": 7.5, "depth_in_mm": 0},
-        "taper": {"top": {"angle_in_deg": 0.0, "height_in_mm": 0.0}, "bottom": {"angle_in_deg": 0.0, "height_in_mm": 0.0}},
-    },
-}
-
-coax_meta = {
-    "name": "C000RG1",
-    "type": "coax",
-    "production": {"enrichment": {"val": 0.855, "unc": 0.015}},
-    "geometry": {
-        "height_in_mm": 40,
-        "radius_in_mm": 38.25,
-        "borehole": {"radius_in_mm": 6.75, "depth_in_mm": 40},
-        "groove": {"depth_in_mm": 2, "radius_in_mm": {"outer": 20, "inner": 17}},
-        "pp_contact": {"radius_in_mm": 17, "depth_in_mm": 0},
-        "taper": {
-            "top": {"angle_in_deg": 45, "height_in_mm": 5},
-            "bottom": {"angle_in_deg": 45, "height_in_mm": 2},
-            "borehole": {"angle_in_deg": 0, "height_in_mm": 0},
-        },
-    },
-}
-
 # -----------------------------
 # Create world volume (20 cm radius sphere)
 # -----------------------------
@@ -107,8 +74,8 @@ g4.PhysicalVolume([0, 0, 0], [0, 0, 0, "rad"], lar_l, "LAr", world_l, registry=r
 # -----------------------------
 # Create HPGe logical volumes
 # -----------------------------
-bege_l = make_hpge(bege_meta, name="BEGe_L", registry=reg)
-coax_l = make_hpge(coax_meta, name="Coax_L", registry=reg)
+bege_l = cached_hpge(bege_meta, reg, "BEGe_L")
+coax_l = cached_hpge(coax_meta, reg, "Coax_L")
 
 # Place HPGe detectors inside LAr
 bege_pv = g4.PhysicalVolume([0, 0, 0], [8, 0, -3, "cm"], bege_l, "BEGe", lar_l, registry=reg)
@@ -163,17 +130,17 @@ source_l = g4.LogicalVolume(source_s, "G4_BRAIN_ICRP", "Source_L", registry=reg)
 g4.PhysicalVolume([0, 0, 0], [0, 5, 0, "cm"], source_l, "Source", lar_l, registry=reg)
 
 # -----------------------------
-# Visualization
+# Export geometry
 # -----------------------------
-viewer = vis.VtkViewerColoured(materialVisOptions={"G4_lAr": [0, 0, 1, 0.1]})
-viewer.addLogicalVolume(reg.getWorldVolume())
-viewer.renWin.SetMultiSamples(8)  # anti-aliasing
-viewer.view()
+write_pygeom(reg, "geometry_with_pen.gdml")
 
 # -----------------------------
-# Export geometry
+# Visualization (mode set by PYG4_VIEW)
 # -----------------------------
-write_pygeom(reg, "geometry_with_pen.gdml")
+show_geometry(
+    reg, {"G4_lAr": [0, 0, 1, 0.1]}, snapshot_prefix="geometry_with_pen",
+    multisamples=8,  # anti-aliasing
+)
 
 # Print detector origins
 print("Detector origins:")
@@ -1,11 +1,69 @@
 #!/Users/maninder/Desktop/Programs/remage/build/python_venv/bin/python
-from lgdo import lh5
+"""
+Energy spectra, step-position maps and optical-photon plots for remage output.
+
+Interactive:   ./Histogram.py [output.lh5 ...]
+Batch report:  ./Histogram.py --batch --outdir plots output_*.lh5
+Reduce only:   ./Histogram.py --reduce-only output_*.lh5   (fills the cache)
+Flat cache:    ./Histogram.py --to-flat .stp_flat output.lh5, then
+               ./Histogram.py .stp_flat  (memory-mapped, uncompressed reads)
+
+matplotlib is only imported once a plot is actually drawn, so the reduction
+path (and the process-pool workers) start without it.
+"""
+import argparse
+import concurrent.futures
+import contextlib
+import os
+
 import awkward as ak
 import hist
-import matplotlib.pyplot as plt
-from mpl_toolkits.mplot3d import Axes3D  # for 3D plotting
+import numpy as np
+
+from histogram_tools import (
+    HIST_CACHE_DIR,
+    apply_response,
+    convert_to_flat,
+    file_seed,
+    fill_anticoincidence,
+    fill_density,
+    fill_edep_parallel,
+    fill_edep_streaming,
+    fill_optical_streaming,
+    merge_partials,
+    open_lh5,
+    position_range,
+    read_columns,
+    response_rng,
+    veto_event_ids,
+)
+
+# ---------------------------
+# Input files
+# ---------------------------
+# One entry per remage output file (e.g. from a job array); spectra, veto,
+# density and optical histograms are summed over all of them.
+OUTPUT_FILES = ["output.lh5"]
+
+# Where --batch writes the report plots
+REPORT_DIR = "plots"
+
+# ---------------------------
+# Streaming options
+# ---------------------------
+# Read the stp tables in chunks of CHUNK_SIZE events instead of loading
+# them whole; keeps memory bounded for large production files.
+STREAMING = True
+CHUNK_SIZE = 100_000
+
+# Reuse filled histograms from HIST_CACHE_DIR while output.lh5 is unchanged
+# (set to None to always rebuild from the raw steps)
+CACHE_DIR = HIST_CACHE_DIR
 
-plt.rcParams["figure.figsize"] = (10, 3)
+# Fill spectra in a process pool, one task per (file, detector) pair.
+# N_WORKERS = None uses all cores.
+PARALLEL = True
+N_WORKERS = None
 
 # ---------------------------
 # Detector mapping
@@ -20,109 +78,332 @@ det_map = {
 }
 
 # ---------------------------
-# Function to plot energy deposition per event
+# Detector response
+# ---------------------------
+# Energy resolution sigma(E) = sqrt(a^2 + b^2 E + c^2 E^2) in keV and
+# threshold in keV per det_map group, applied before filling the spectra.
+# HPGe: ~1 keV sigma at 2.6 MeV; PEN: ~10% sigma/E at 1 MeV.
+APPLY_RESPONSE = True
+RESPONSE_SEED = 42
+detector_response = {
+    "BEGe": {"a": 0.4, "b": 0.020, "threshold": 5.0},
+    "Coax": {"a": 0.5, "b": 0.025, "threshold": 5.0},
+    "PEN_BEGe": {"b": 3.2, "threshold": 20.0},
+    "PEN_Coax": {"b": 3.2, "threshold": 20.0},
+}
+
+# ---------------------------
+# Combined detector mapping for scatter plots
+# ---------------------------
+scatter_groups = {
+    "BEGe": ["det001"],                  # single detector
+    "Coax": ["det002"],                  # single detector
+    "PEN_BEGe + PMT_BEGe": ["det003", "det004"],  # combine detectors
+    "PEN_Coax + PMT_Coax": ["det009"],  # combine detectors
+}
+
+# Bin all step positions into DENSITY_BINS instead of scattering the first
+# 20k events; DENSITY_WEIGHT = "edep" weights each step by its energy.
+DENSITY_MAP = True
+DENSITY_BINS = (300, 300)
+DENSITY_WEIGHT = None
+
+# Detector IDs for optical PMTs
+optical_detids = ["det007", "det008"]
+
+# ---------------------------
+# Anti-coincidence veto
+# ---------------------------
+# PEN walls/bottoms and PMTs around the HPGe detectors act as an active veto
+veto_pen_detids = ["det003", "det004", "det005", "det006"]
+veto_pmt_detids = ["det007", "det008"]
+PEN_THRESHOLD = 20.0  # keV, summed over all PEN volumes
+PMT_THRESHOLD = 1     # photons, summed over all PMTs
+
+# Fixed binning so the optical histograms can be filled in one streaming
+# pass and cached
+wavelength_axis = hist.axis.Regular(120, 100, 700, name="wavelength [nm]")
+time_axis = hist.axis.Regular(200, 0, 1000, name="time [ns]")
+photon_axis = hist.axis.Integer(0, 100, name="photons / event")
+
+
+# ---------------------------
+# Reductions
 # ---------------------------
-def plot_edep(detid_label):
+def reduce_edep(detid_label, output_files, pool=None):
+    """Per-event energy spectrum of a det_map group (`pool`: shared process pool for PARALLEL)."""
     detids = det_map[detid_label]
+    response = detector_response.get(detid_label) if APPLY_RESPONSE else None
+
+    if PARALLEL:
+        return fill_edep_parallel(
+            output_files, detids, max_workers=N_WORKERS, pool=pool, chunk_size=CHUNK_SIZE,
+            cache_dir=CACHE_DIR, response=response, seed=RESPONSE_SEED,
+        )
+
+    if STREAMING:
+        return merge_partials([
+            fill_edep_streaming(
+                detids, output, chunk_size=CHUNK_SIZE, cache_dir=CACHE_DIR,
+                response=response, seed=RESPONSE_SEED,
+            )
+            for output in output_files
+        ])
 
     # Sum energy per event for each detector
     total_edep_arrays = []
-    for detid in detids:
-        arr = lh5.read_as(f"stp/{detid}/edep", "output.lh5", "ak")
-        # Sum over particles per event
-        total_edep_arrays.append(ak.sum(arr, axis=-1))
+    for output in output_files:
+        columns = read_columns(output, {detid: ["edep"] for detid in detids})
+        for detid in detids:
+            # Sum over particles per event
+            energy = ak.sum(columns[detid].edep, axis=-1)
+            if response is not None:
+                energy = apply_response(energy, response, response_rng(RESPONSE_SEED, detid, 0, file_seed(output)))
+            total_edep_arrays.append(energy)
 
     # Concatenate events across detectors
     total_edep = ak.concatenate(total_edep_arrays)
 
     # Fill histogram
-    hist.new.Reg(2200, 0, 2200, name="energy [keV]").Double().fill(total_edep).plot(
-        yerr=False, label=detid_label
-    )
+    return hist.new.Reg(2200, 0, 2200, name="energy [keV]").Double().fill(total_edep)
 
-# ---------------------------
-# Energy spectra
-# ---------------------------
-plt.figure()
-for label in ["BEGe", "Coax", "PEN_BEGe", "PEN_Coax"]:
-    plot_edep(label)
 
-plt.ylabel("counts / 1 keV")
-plt.yscale("log")
-plt.legend()
-plt.show()
+def reduce_all(output_files):
+    """Run every reduction over all `output_files` and return the results needed for the plots."""
+    results = {}
+
+    # Energy spectra; one process pool serves every group (its workers only
+    # start once a histogram is missing from the cache)
+    with contextlib.ExitStack() as stack:
+        pool = None
+        if PARALLEL:
+            pool = stack.enter_context(concurrent.futures.ProcessPoolExecutor(max_workers=N_WORKERS))
+        results["spectra"] = {
+            label: reduce_edep(label, output_files, pool)
+            for label in ["BEGe", "Coax", "PEN_BEGe", "PEN_Coax"]
+        }
+
+    # Density maps of several files need one common binning (cached, so a
+    # re-plot does not read every step position again)
+    density_range = None
+    if DENSITY_MAP and len(output_files) > 1:
+        density_range = {
+            group_label: position_range(detids, list(output_files), chunk_size=CHUNK_SIZE, cache_dir=CACHE_DIR)
+            for group_label, detids in scatter_groups.items()
+        }
+
+    # The remaining sections go file by file (each file opened once and
+    # shared by all of them) and are merged afterwards
+    partials = []
+    for path in output_files:
+        partial = {}
+        with open_lh5(path) as output:
+            # HPGe spectra with and without the PEN/PMT veto; event ids are
+            # only unique within one file, so the veto is built per file
+            veto_ids = veto_event_ids(
+                veto_pen_detids, output, PEN_THRESHOLD, veto_pmt_detids, PMT_THRESHOLD, CHUNK_SIZE
+            )
+            partial["anticoincidence"] = {
+                label: fill_anticoincidence(det_map[label], veto_ids, output, chunk_size=CHUNK_SIZE)
+                for label in ["BEGe", "Coax"]
+            }
+
+            # Step positions
+            if DENSITY_MAP:
+                partial["density"] = {
+                    group_label: fill_density(
+                        detids, output, DENSITY_BINS,
+                        range=density_range[group_label] if density_range else None,
+                        weight=DENSITY_WEIGHT, chunk_size=CHUNK_SIZE, cache_dir=CACHE_DIR,
+                    )
+                    for group_label, detids in scatter_groups.items()
+                }
+
+            # Wavelength, arrival time and photons per event in one pass per
+            # PMT; ["evtid"] / ["n_photons"] keep the per-event counts for cuts
+            partial["optical"] = {
+                detid: fill_optical_streaming(
+                    detid, output, wavelength_axis, time_axis, photon_axis, CHUNK_SIZE, cache_dir=CACHE_DIR
+                )
+                for detid in optical_detids
+            }
+            for detid, optical in partial["optical"].items():
+                # which file each (file-local) event id belongs to
+                optical["file_index"] = np.full(len(optical["evtid"]), len(partials))
+        partials.append(partial)
+
+    results.update(merge_partials(partials))
+
+    if not DENSITY_MAP:
+        # The scatter plots only show a 20k event sample: read it from the
+        # first file, every column needed in one pass
+        columns = {}
+        for detids in scatter_groups.values():
+            for detid in detids:
+                columns.setdefault(detid, []).extend(["xloc", "zloc"])
+
+        results["scatter"] = read_columns(output_files[0], columns, n_rows=20_000)
+
+    return results
+
 
 # ---------------------------
-# Combined detector mapping for scatter plots
+# Plotting
 # ---------------------------
-scatter_groups = {
-    "BEGe": ["det001"],                  # single detector
-    "Coax": ["det002"],                  # single detector
-    "PEN_BEGe + PMT_BEGe": ["det003", "det004"],  # combine detectors
-    "PEN_Coax + PMT_Coax": ["det009"],  # combine detectors
-}
+def import_pyplot(batch):
+    """Import matplotlib on first use; `batch` selects the non-interactive Agg backend."""
+    import matplotlib
 
-# Create 2x2 subplots
-fig, axes = plt.subplots(2, 2, figsize=(12, 10))
+    if batch:
+        matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
 
-colors = ["red", "blue"]  # colors for multiple detectors in the same group
+    plt.rcParams["figure.figsize"] = (10, 3)
+    return plt
 
-for ax, (group_label, detids) in zip(axes.flat, scatter_groups.items()):
-    for i, detid in enumerate(detids):
-        arr = lh5.read_as(f"stp/{detid}", "output.lh5", "ak")[:20_000]
-        ax.scatter(
-            ak.flatten(arr.xloc),
-            ak.flatten(arr.zloc),
-            s=1,
-            color=colors[i % len(colors)],
-            label=detid
-        )
 
-    ax.set_title(group_label)
-    ax.set_xlabel("x [m]")
-    ax.set_ylabel("z [m]")
-    ax.axis("equal")
-    ax.legend()
+def finish_figure(plt, name, outdir):
+    """Show the current figure, or save it as <outdir>/<name>.png in batch mode."""
+    if outdir is None:
+        plt.show()
+        return
 
-plt.tight_layout()
-plt.show()
+    path = os.path.join(outdir, f"{name}.png")
+    plt.savefig(path, dpi=150)
+    plt.close()
+    print(f"[OK] Plot written to: {path}")
 
-import lgdo.lh5 as lh5
-import awkward as ak
-import matplotlib.pyplot as plt
 
-# Detector IDs for optical PMTs
-detids = ["det007", "det008"]
-
-data = {}
-for detid in detids:
-    # Read wavelength and time arrays
-    wavelength = lh5.read_as(f"stp/{detid}/wavelength", "output.lh5", "ak")
-    time = lh5.read_as(f"stp/{detid}/time", "output.lh5", "ak")
-    
-    # Flatten arrays for plotting
-    wavelength_flat = ak.flatten(wavelength)
-    time_flat = ak.flatten(time)
-    
-    data[detid] = {"wavelength": wavelength_flat, "time": time_flat}
-
-# --- Histogram of wavelengths ---
-plt.figure(figsize=(8,5))
-plt.hist(data["det007"]["wavelength"], bins=50, alpha=0.7, label="det007")
-plt.hist(data["det008"]["wavelength"], bins=50, alpha=0.7, label="det008")
-plt.xlabel("Wavelength [nm]")
-plt.ylabel("Counts")
-plt.title("Photon Wavelength Distribution")
-plt.legend()
-plt.show()
-
-# --- Histogram of arrival times ---
-plt.figure(figsize=(8,5))
-plt.hist(data["det007"]["time"], bins=100, alpha=0.7, label="det007")
-plt.hist(data["det008"]["time"], bins=100, alpha=0.7, label="det008")
-plt.xlabel("Time [ns]")
-plt.ylabel("Counts")
-plt.title("Photon Arrival Time Distribution")
-plt.legend()
-plt.show()
+def plot_all(results, outdir=None):
+    """Draw every plot; with `outdir` set nothing blocks and all plots go to disk."""
+    plt = import_pyplot(batch=outdir is not None)
+    from matplotlib.colors import LogNorm
+
+    if outdir is not None:
+        os.makedirs(outdir, exist_ok=True)
+
+    # ---------------------------
+    # Energy spectra
+    # ---------------------------
+    plt.figure()
+    for label, h in results["spectra"].items():
+        h.plot(yerr=False, label=label)
+
+    plt.ylabel("counts / 1 keV")
+    plt.yscale("log")
+    plt.legend()
+    finish_figure(plt, "energy_spectra", outdir)
+
+    # ---------------------------
+    # HPGe spectra with and without the PEN/PMT veto
+    # ---------------------------
+    plt.figure()
+    for label, spectra in results["anticoincidence"].items():
+        spectra["raw"].plot(yerr=False, label=label)
+        spectra["vetoed"].plot(yerr=False, label=f"{label} after veto")
+
+    plt.ylabel("counts / 1 keV")
+    plt.yscale("log")
+    plt.legend()
+    finish_figure(plt, "anticoincidence_spectra", outdir)
+
+    # Create 2x2 subplots
+    fig, axes = plt.subplots(2, 2, figsize=(12, 10))
+
+    if "density" in results:
+        for ax, (group_label, h) in zip(axes.flat, results["density"].items()):
+            x_edges, y_edges = h.axes[0].edges, h.axes[1].edges
+            image = ax.imshow(
+                h.values().T,
+                origin="lower",
+                extent=[x_edges[0], x_edges[-1], y_edges[0], y_edges[-1]],
+                norm=LogNorm(),
+                aspect="equal",
+            )
+            fig.colorbar(image, ax=ax, label="energy [keV]" if DENSITY_WEIGHT else "steps")
+
+            ax.set_title(group_label)
+            ax.set_xlabel("x [m]")
+            ax.set_ylabel("z [m]")
+    else:
+        stp = results["scatter"]
+        colors = ["red", "blue"]  # colors for multiple detectors in the same group
+
+        for ax, (group_label, detids) in zip(axes.flat, scatter_groups.items()):
+            for i, detid in enumerate(detids):
+                arr = stp[detid][:20_000]
+                ax.scatter(
+                    ak.flatten(arr.xloc),
+                    ak.flatten(arr.zloc),
+                    s=1,
+                    color=colors[i % len(colors)],
+                    label=detid
+                )
+
+            ax.set_title(group_label)
+            ax.set_xlabel("x [m]")
+            ax.set_ylabel("z [m]")
+            ax.axis("equal")
+            ax.legend()
+
+    plt.tight_layout()
+    finish_figure(plt, "step_positions", outdir)
+
+    data = results["optical"]
+
+    # --- Histogram of wavelengths ---
+    plt.figure(figsize=(8,5))
+    for detid in optical_detids:
+        data[detid]["wavelength"].plot(yerr=False, label=detid)
+    plt.xlabel("Wavelength [nm]")
+    plt.ylabel("Counts")
+    plt.title("Photon Wavelength Distribution")
+    plt.legend()
+    finish_figure(plt, "photon_wavelength", outdir)
+
+    # --- Histogram of arrival times ---
+    plt.figure(figsize=(8,5))
+    for detid in optical_detids:
+        data[detid]["time"].plot(yerr=False, label=detid)
+    plt.xlabel("Time [ns]")
+    plt.ylabel("Counts")
+    plt.title("Photon Arrival Time Distribution")
+    plt.legend()
+    finish_figure(plt, "photon_time", outdir)
+
+    # --- Histogram of detected photons per event ---
+    plt.figure(figsize=(8,5))
+    for detid in optical_detids:
+        data[detid]["photons"].plot(yerr=False, label=detid)
+    plt.xlabel("Photons per event")
+    plt.ylabel("Events")
+    plt.yscale("log")
+    plt.title("Detected Photons per Event")
+    plt.legend()
+    finish_figure(plt, "photons_per_event", outdir)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Plot remage output spectra")
+    parser.add_argument("files", nargs="*", default=OUTPUT_FILES, help="remage output files")
+    parser.add_argument("--batch", action="store_true", help="write plots to --outdir instead of showing them")
+    parser.add_argument("--outdir", default=REPORT_DIR, help="directory for --batch plots")
+    parser.add_argument("--reduce-only", action="store_true", help="only fill histograms (and the cache), no plots")
+    parser.add_argument("--to-flat", metavar="DIR", help="convert the (single) input file to a flat memory-mapped cache in DIR and exit")
+    args = parser.parse_args(argv)
+
+    if args.to_flat:
+        convert_to_flat(args.files[0], args.to_flat, chunk_size=CHUNK_SIZE)
+        return
+
+    results = reduce_all(args.files)
+    if args.reduce_only:
+        return
+
+    plot_all(results, outdir=args.outdir if args.batch else None)
+
 
+# The guard keeps process-pool workers (spawned on macOS) from re-running
+# the plotting script when they import this module.
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+#!/Users/maninder/Desktop/Programs/remage/build/python_venv/bin/python
+"""
+Arrays of PEN-encapsulated HPGe detectors (strings of 50-200 units).
+
+Each detector type (BEGe, Coax) is built once as an encapsulated unit --
+HPGe, PEN wall, PEN bottom and PMT with its optical surface -- and then only
+placed, so the registry and GDML grow by four physical volumes per copy.
+
+Usage:
+    python PENArray.py                                  # default 7 strings x 8 units
+    python PENArray.py positions.csv                    # name,type,x,y,z in cm
+    python PENArray.py --strings 12 --per-string 10 --write-positions array.csv
+"""
+
+import argparse
+import math
+
+import pyg4ometry.geant4 as g4
+import pyg4ometry.geant4.solid as solid
+import pygeomtools
+from pygeomtools import RemageDetectorInfo
+
+from detector_metadata import bege_meta, coax_meta
+from geometry_tools import check_overlaps, load_positions, show_geometry, write_detector_macro, write_positions
+from PENEncapsulationOpticalTest import (
+    make_encapsulated_unit,
+    make_materials,
+    place_encapsulated_unit,
+)
+
+# -----------------------------
+# Detector types available in position tables
+# -----------------------------
+det_types = {
+    "bege": ("BEGe", bege_meta),
+    "coax": ("Coax", coax_meta),
+}
+
+# Free LAr around the array (cm)
+LAR_MARGIN = 10.0
+
+
+def string_positions(n_strings=7, per_string=8, string_spacing=12.0, unit_pitch=9.0, types=("bege", "coax")):
+    """
+    Default layout: one central string plus n_strings - 1 on a ring, with
+    per_string units stacked every unit_pitch cm. Types alternate along a string.
+    """
+    ring = n_strings - 1
+    radius = string_spacing / (2*math.sin(math.pi/ring)) if ring > 1 else string_spacing
+    radius = max(radius, string_spacing)
+    heads = [(0.0, 0.0)] + [
+        (radius*math.cos(2*math.pi*i/ring), radius*math.sin(2*math.pi*i/ring)) for i in range(ring)
+    ]
+
+    positions = []
+    z0 = (per_string - 1) * unit_pitch / 2.0
+    for s, (x, y) in enumerate(heads):
+        for k in range(per_string):
+            name = f"S{s:02d}_U{k:02d}"
+            positions.append((name, types[k % len(types)], (x, y, z0 - k*unit_pitch)))
+    return positions
+
+
+def build_array(positions, margin=0.1, thickness=0.2, bottom_thickness=0.2, pmt_gap=0.1, optics_rtol=None):
+    """Build the registry for `positions` (see geometry_tools.load_positions)."""
+    reg = g4.Registry()
+    pen, lar = make_materials(reg, optics_rtol)
+
+    # LAr cylinder enclosing all units
+    r_max = max(math.hypot(x, y) for _, _, (x, y, _) in positions) + LAR_MARGIN
+    z_max = max(abs(z) for _, _, (_, _, z) in positions) + LAR_MARGIN
+
+    world_s = solid.Box("world_s", 4*r_max, 4*r_max, 4*z_max, registry=reg, lunit="cm")
+    world_l = g4.LogicalVolume(world_s, "G4_Galactic", "World_lv", registry=reg)
+    reg.setWorld(world_l)
+
+    lar_s = solid.Tubs("LAr_s", 0, r_max, 2*z_max, 0, 2*math.pi, registry=reg, lunit="cm")
+    lar_l = g4.LogicalVolume(lar_s, lar, "LAr_lv", registry=reg)
+    lar_pv = g4.PhysicalVolume([0,0,0], [0,0,0], lar_l, "LAr_pv", world_l, registry=reg)
+
+    # One unit per detector type, built on first use
+    units = {}
+    for i, (name, det_type, position) in enumerate(positions):
+        if det_type not in units:
+            prefix, meta = det_types[det_type]
+            units[det_type] = make_encapsulated_unit(
+                reg, pen, meta, f"PEN_{prefix}",
+                margin=margin, thickness=thickness, bottom_thickness=bottom_thickness, pmt_gap=pmt_gap,
+            )
+        place_encapsulated_unit(reg, units[det_type], lar_l, name, position, first_uid=4*i + 1)
+
+    lar_pv.pygeom_active_detector = RemageDetectorInfo("scintillator", 4*len(positions) + 1, {"name": "LAr"})
+
+    print(
+        f"[INFO] {len(positions)} units from {len(units)} unit types: "
+        f"{len(reg.logicalVolumeDict)} logical / {len(reg.physicalVolumeDict)} physical volumes"
+    )
+    return reg
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Array of PEN-encapsulated HPGe detectors")
+    parser.add_argument("positions", nargs="?", help="CSV position table (name,type,x,y,z in cm)")
+    parser.add_argument("--strings", type=int, default=7, help="strings in the default layout")
+    parser.add_argument("--per-string", type=int, default=8, help="units per string in the default layout")
+    parser.add_argument("--write-positions", metavar="CSV", help="save the position table used")
+    parser.add_argument("--output", default="HPGe_PEN_array.gdml", help="output GDML file")
+    parser.add_argument("--check", action="store_true", help="run the overlap check before export")
+    parser.add_argument("--optics-rtol", type=float, default=None, help="resample optical spectra to this relative error")
+    args = parser.parse_args()
+
+    if args.positions:
+        positions = load_positions(args.positions)
+    else:
+        positions = string_positions(args.strings, args.per_string)
+    if args.write_positions:
+        write_positions(positions, args.write_positions)
+
+    reg = build_array(positions, optics_rtol=args.optics_rtol)
+
+    if args.check and check_overlaps(reg.logicalVolumeDict["LAr_lv"]):
+        raise SystemExit("[ERROR] overlaps/extrusions found, GDML not written")
+
+    write_detector_macro(reg, args.output.rsplit(".", 1)[0] + ".detectors.mac")
+    pygeomtools.write_pygeom(reg, args.output)
+
+    show_geometry(reg, {"LAr": [0,0,1,0.1], "PEN": [0,0.5,0.5,0.3]}, snapshot_prefix="HPGe_PEN_array")
@@ -3,7 +3,6 @@ import pyg4ometry.geant4 as g4
 import pyg4ometry.geant4.solid as solid
 import pyg4ometry as pg4
 import pygeomtools
-from legendhpges import make_hpge
 from legendoptics.pen import (
     pyg4_pen_attach_rindex,
     pyg4_pen_attach_attenuation,
@@ -13,6 +12,9 @@ from legendoptics.pen import (
 from pygeomtools import RemageDetectorInfo
 from numpy import pi
 
+from detector_metadata import bege_meta, coax_meta
+from geometry_tools import cached_hpge, show_geometry
+
 reg = g4.Registry()
 
 # If you don’t have pygeomtools.detector_origins, define your own:
@@ -57,35 +59,8 @@ pg4.geant4.PhysicalVolume([0, 0, 0], [0, 0, 0], lar_l, "LAr", world_l, registry=
 # -----------------------------
 # HPGe detectors
 # -----------------------------
-bege_meta = {
-    "name": "B00000B",
-    "type": "bege",
-    "production": {"enrichment": {"val": 0.874, "unc": 0.003}, "mass_in_g": 697.0},
-    "geometry": {
-        "height_in_mm": 29.46,
-        "radius_in_mm": 36.98,
-        "groove": {"depth_in_mm": 2.0, "radius_in_mm": {"outer": 10.5, "inner": 7.5}},
-        "pp_contact": {"radius_in_mm": 7.5, "depth_in_mm": 0},
-        "taper": {"top": {"angle_in_deg": 0.0, "height_in_mm": 0.0}, "bottom": {"angle_in_deg": 0.0, "height_in_mm": 0.0}},
-    },
-}
-
-coax_meta = {
-    "name": "C000RG1",
-    "type": "coax",
-    "production": {"enrichment": {"val": 0.855, "unc": 0.015}},
-    "geometry": {
-        "height_in_mm": 40,
-        "radius_in_mm": 38.25,
-        "borehole": {"radius_in_mm": 6.75, "depth_in_mm": 40},
-        "groove": {"depth_in_mm": 2, "radius_in_mm": {"outer": 20, "inner": 17}},
-        "pp_contact": {"radius_in_mm": 17, "depth_in_mm": 0},
-        "taper": {"top": {"angle_in_deg": 45, "height_in_mm": 5}, "bottom": {"angle_in_deg": 45, "height_in_mm": 2}, "borehole": {"angle_in_deg": 0, "height_in_mm": 0}},
-    },
-}
-
-bege_l = make_hpge(bege_meta, name="BEGe_L", registry=reg)
-coax_l = make_hpge(coax_meta, name="Coax_L", registry=reg)
+bege_l = cached_hpge(bege_meta, reg, "BEGe_L")
+coax_l = cached_hpge(coax_meta, reg, "Coax_L")
 
 # -----------------------------
 # Positions diametrically opposite along Y-axis
@@ -167,13 +142,12 @@ pen_coax_pv.pygeom_active_detector = pygeomtools.RemageDetectorInfo(
 
 
 # -----------------------------
-# Visualization
+# Export GDML
 # -----------------------------
-viewer = pg4.visualisation.VtkViewerColoured(materialVisOptions={"G4_lAr":[0,0,1,0.1], "PEN":[0,0.5,0.5,0.3]})
-viewer.addLogicalVolume(reg.getWorldVolume())
-viewer.view()
+pygeomtools.write_pygeom(reg, "HPGe_with_PEN.gdml")
 
 # -----------------------------
-# Export GDML
+# Visualization (mode set by PYG4_VIEW)
 # -----------------------------
-pygeomtools.write_pygeom(reg, "HPGe_with_PEN.gdml")
+show_geometry(reg, {"G4_lAr":[0,0,1,0.1], "PEN":[0,0.5,0.5,0.3]}, snapshot_prefix="HPGe_with_PEN")
+
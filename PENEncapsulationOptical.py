@@ -3,7 +3,6 @@ import pyg4ometry.geant4 as g4
 import pyg4ometry.geant4.solid as solid
 import pygeomtools
 import pyg4ometry as pg4
-from legendhpges import make_hpge
 from legendoptics.pen import (
     pyg4_pen_attach_rindex,
     pyg4_pen_attach_attenuation,
@@ -16,6 +15,9 @@ from legendoptics.lar import (
     pyg4_lar_attach_scintillation,
 )
 from pygeomtools import RemageDetectorInfo
+
+from detector_metadata import bege_meta, coax_meta
+from geometry_tools import attach_optics, cached_hpge, show_geometry
 from numpy import pi
 
 
@@ -56,10 +58,10 @@ pen.add_element_natoms(H, 10)
 pen.add_element_natoms(O, 4)
 
 # Attach optical properties to PEN
-pyg4_pen_attach_rindex(pen, reg)
-pyg4_pen_attach_attenuation(pen, reg)
-pyg4_pen_attach_wls(pen, reg)
-pyg4_pen_attach_scintillation(pen, reg)
+attach_optics(pyg4_pen_attach_rindex, pen, reg)
+attach_optics(pyg4_pen_attach_attenuation, pen, reg)
+attach_optics(pyg4_pen_attach_wls, pen, reg)
+attach_optics(pyg4_pen_attach_scintillation, pen, reg)
 
 
 
@@ -84,9 +86,9 @@ lar = g4.Material(
 lar.add_element_natoms(Ar, 1)
 
 # Attach optical properties with proper units
-pyg4_lar_attach_rindex(lar, reg)
-pyg4_lar_attach_attenuation(lar, reg, lar_temperature)
-pyg4_lar_attach_scintillation(lar, reg, scint_yield)
+attach_optics(pyg4_lar_attach_rindex, lar, reg)
+attach_optics(pyg4_lar_attach_attenuation, lar, reg, lar_temperature)
+attach_optics(pyg4_lar_attach_scintillation, lar, reg, scint_yield)
 
 
 
@@ -104,50 +106,11 @@ lar_s = solid.Orb("LAr_s", 100, registry=reg)  # radius in cm
 lar_l = g4.LogicalVolume(lar_s, lar, "LAr_lv", registry=reg, lunit="cm")
 g4.PhysicalVolume([0, 0, 0], [0, 0, 0], lar_l, "LAr_pv", world_l, registry=reg)
 
-# -----------------------------
-# HPGe detectors metadata
-# -----------------------------
-bege_meta = {
-    "name": "B00000B",
-    "type": "bege",
-    "production": {"enrichment": {"val": 0.874, "unc": 0.003}, "mass_in_g": 697.0},
-    "geometry": {
-        "height_in_mm": 29.46,
-        "radius_in_mm": 36.98,
-        "groove": {"depth_in_mm": 2.0, "radius_in_mm": {"outer": 10.5, "inner": 7.5}},
-        "pp_contact": {"radius_in_mm": 7.5, "depth_in_mm": 0},   # <-- add this
-        "taper": {
-            "top": {"angle_in_deg": 0.0, "height_in_mm": 0.0},
-            "bottom": {"angle_in_deg": 0.0, "height_in_mm": 0.0},
-        },
-    },
-}
-
-
-coax_meta = {
-    "name": "C000RG1",
-    "type": "coax",
-    "production": {"enrichment": {"val": 0.855, "unc": 0.015}},
-    "geometry": {
-        "height_in_mm": 40,
-        "radius_in_mm": 38.25,
-        "borehole": {"radius_in_mm": 6.75, "depth_in_mm": 40},       # <-- required
-        "groove": {"depth_in_mm": 2, "radius_in_mm": {"outer": 20, "inner": 17}},
-        "pp_contact": {"radius_in_mm": 17, "depth_in_mm": 0},        # <-- required
-        "taper": {
-            "top": {"angle_in_deg": 45, "height_in_mm": 5},
-            "bottom": {"angle_in_deg": 45, "height_in_mm": 2},
-            "borehole": {"angle_in_deg": 0, "height_in_mm": 0},
-        },
-    },
-}
-
-
 # -----------------------------
 # Create HPGe logical volumes
 # -----------------------------
-bege_l = make_hpge(bege_meta, name="BEGe_L", registry=reg)
-coax_l = make_hpge(coax_meta, name="Coax_L", registry=reg)
+bege_l = cached_hpge(bege_meta, reg, "BEGe_L")
+coax_l = cached_hpge(coax_meta, reg, "Coax_L")
 
 # -----------------------------
 # Place HPGe detectors inside LAr
@@ -207,21 +170,20 @@ pg4.geant4.PhysicalVolume(
 )
 
 # -----------------------------
-# Visualization (FIXED)
+# Export GDML
+# -----------------------------
+pygeomtools.write_pygeom(reg, "HPGe_with_PEN_optical.gdml")
+
+# -----------------------------
+# Visualization (mode set by PYG4_VIEW)
 # -----------------------------
-# Use the viewer from pygeomtools.visualization (American spelling)
-viewer = pg4.visualisation.VtkViewerColoured(
-    materialVisOptions={
+show_geometry(
+    reg,
+    {
         "LAr": [0,0,1,0.1],        # your custom LAr
         "PEN": [0,0.5,0.5,0.3],    # your PEN encapsulation
         "G4_LAr": [0.5,0.5,0.5,0.2]
-    }
+    },
+    snapshot_prefix="HPGe_with_PEN_optical",
 )
 
-viewer.addLogicalVolume(reg.getWorldVolume())
-viewer.view()
-# -----------------------------
-# Export GDML
-# -----------------------------
-pygeomtools.write_pygeom(reg, "HPGe_with_PEN_optical.gdml")
-
@@ -3,8 +3,6 @@
 import math
 import pyg4ometry.geant4 as g4
 import pyg4ometry.geant4.solid as solid
-import pyg4ometry as pg4
-from legendhpges import make_hpge
 from legendoptics.pen import (
     pyg4_pen_attach_rindex,
     pyg4_pen_attach_attenuation,
@@ -21,10 +19,18 @@ from pygeomtools import RemageDetectorInfo
 from numpy import pi
 
 import pygeomtools
-# -----------------------------
-# Registry
-# -----------------------------
-reg = g4.Registry()
+
+from detector_metadata import bege_meta, coax_meta
+from geometry_tools import (
+    BuildProfile,
+    attach_optics,
+    cached_hpge,
+    check_overlaps,
+    profile_stage,
+    show_geometry,
+    validate_run_macro,
+    write_detector_macro,
+)
 
 # -----------------------------
 # Utility: add detector origins
@@ -38,251 +44,115 @@ def add_detector_origin(name, pv, registry):
         "zloc": pv.position[2],
     }
 
-# -----------------------------
-# PEN material
-# -----------------------------
-C = g4.ElementSimple("Carbon", "C", 6, 12.01, registry=reg)
-H = g4.ElementSimple("Hydrogen", "H", 1, 1.008, registry=reg)
-O = g4.ElementSimple("Oxygen", "O", 8, 16.00, registry=reg)
-
-pen = g4.Material(
-    name="PEN",
-    density=1.3,
-    number_of_components=3,
-    state="solid",
-    temperature=293.15,
-    registry=reg,
-)
-pen.add_element_natoms(C, 14)
-pen.add_element_natoms(H, 10)
-pen.add_element_natoms(O, 4)
-
-pyg4_pen_attach_rindex(pen, reg)
-pyg4_pen_attach_attenuation(pen, reg)
-pyg4_pen_attach_wls(pen, reg)
-pyg4_pen_attach_scintillation(pen, reg)
-
-# -----------------------------
-# LAr material
-# -----------------------------
-Ar = g4.ElementSimple("Argon", "Ar", 18, 39.95, registry=reg)
-lar = g4.Material(
-    name="LAr",
-    density=1.390,
-    number_of_components=1,
-    state="liquid",
-    temperature=88.8,
-    pressure=1e5,
-    registry=reg,
-)
-lar.add_element_natoms(Ar, 1)
-
-lar_temperature = 88.8 * u.K
-
-pyg4_lar_attach_rindex(lar, reg)
-pyg4_lar_attach_attenuation(
-    lar_mat=lar,
-    reg=reg,
-    lar_temperature=lar_temperature,
-    lar_dielectric_method="cern2020",
-    attenuation_method_or_length="legend200-llama",
-    rayleigh_enabled_or_length=True,
-    absorption_enabled_or_length=True,
-)
-pyg4_lar_attach_scintillation(lar, reg, flat_top_yield=1000/u.MeV)
-
-# -----------------------------
-# World volume
-# -----------------------------
-world_s = solid.Box("world_s", 100, 100, 100, registry=reg, lunit="cm")
-world_l = g4.LogicalVolume(world_s, "G4_Galactic", "World_lv", registry=reg)
-reg.setWorld(world_l)
-
-# -----------------------------
-# LAr volume (cylinder)
-# -----------------------------
-lar_radius = 12
-lar_half_height = 25
-lar_s = solid.Tubs("LAr_s", 0, lar_radius, lar_half_height, 0, 2*math.pi, registry=reg, lunit="cm")
-lar_l = g4.LogicalVolume(lar_s, lar, "LAr_lv", registry=reg, lunit="cm")
-lar_pv = g4.PhysicalVolume([0,0,0], [0,0,0], lar_l, "LAr_pv", world_l, registry=reg)
-
-
-
-# -----------------------------
-# HPGe metadata
-# -----------------------------
-bege_meta = {
-    "name": "B00000B",
-    "type": "bege",
-    "production": {"enrichment": {"val": 0.874, "unc": 0.003}, "mass_in_g": 697.0},
-    "geometry": {
-        "height_in_mm": 29.46,
-        "radius_in_mm": 36.98,
-        "groove": {"depth_in_mm": 2.0, "radius_in_mm": {"outer": 10.5, "inner": 7.5}},
-        "pp_contact": {"radius_in_mm": 7.5, "depth_in_mm": 0},
-        "taper": {"top": {"angle_in_deg": 0.0, "height_in_mm": 0.0}, "bottom": {"angle_in_deg": 0.0, "height_in_mm": 0.0}},
-    },
-}
-
-coax_meta = {
-    "name": "C000RG1",
-    "type": "coax",
-    "production": {"enrichment": {"val": 0.855, "unc": 0.015}},
-    "geometry": {
-        "height_in_mm": 40,
-        "radius_in_mm": 38.25,
-        "borehole": {"radius_in_mm": 6.75, "depth_in_mm": 40},
-        "groove": {"depth_in_mm": 2, "radius_in_mm": {"outer": 20, "inner": 17}},
-        "pp_contact": {"radius_in_mm": 17, "depth_in_mm": 0},
-        "taper": {"top": {"angle_in_deg": 45, "height_in_mm": 5}, "bottom": {"angle_in_deg": 45, "height_in_mm": 2}, "borehole": {"angle_in_deg": 0, "height_in_mm": 0}},
-    },
-}
-
 
 # -----------------------------
-# Create HPGe logical volumes
+# Materials
 # -----------------------------
-bege_l = make_hpge(bege_meta, name="BEGe_L", registry=reg)
-coax_l = make_hpge(coax_meta, name="Coax_L", registry=reg)
+def make_materials(reg, optics_rtol=None):
+    """
+    Create the PEN and LAr materials with their optical properties; returns
+    (pen, lar). `optics_rtol` resamples the spectra (see attach_optics).
+    """
+    # -----------------------------
+    # PEN material
+    # -----------------------------
+    C = g4.ElementSimple("Carbon", "C", 6, 12.01, registry=reg)
+    H = g4.ElementSimple("Hydrogen", "H", 1, 1.008, registry=reg)
+    O = g4.ElementSimple("Oxygen", "O", 8, 16.00, registry=reg)
+
+    pen = g4.Material(
+        name="PEN",
+        density=1.3,
+        number_of_components=3,
+        state="solid",
+        temperature=293.15,
+        registry=reg,
+    )
+    pen.add_element_natoms(C, 14)
+    pen.add_element_natoms(H, 10)
+    pen.add_element_natoms(O, 4)
+
+    attach_optics(pyg4_pen_attach_rindex, pen, reg, rtol=optics_rtol)
+    attach_optics(pyg4_pen_attach_attenuation, pen, reg, rtol=optics_rtol)
+    attach_optics(pyg4_pen_attach_wls, pen, reg, rtol=optics_rtol)
+    attach_optics(pyg4_pen_attach_scintillation, pen, reg, rtol=optics_rtol)
+
+    # -----------------------------
+    # LAr material
+    # -----------------------------
+    Ar = g4.ElementSimple("Argon", "Ar", 18, 39.95, registry=reg)
+    lar = g4.Material(
+        name="LAr",
+        density=1.390,
+        number_of_components=1,
+        state="liquid",
+        temperature=88.8,
+        pressure=1e5,
+        registry=reg,
+    )
+    lar.add_element_natoms(Ar, 1)
+
+    lar_temperature = 88.8 * u.K
+
+    attach_optics(pyg4_lar_attach_rindex, lar, reg, rtol=optics_rtol)
+    attach_optics(
+        pyg4_lar_attach_attenuation,
+        lar,
+        reg,
+        lar_temperature=lar_temperature,
+        lar_dielectric_method="cern2020",
+        attenuation_method_or_length="legend200-llama",
+        rayleigh_enabled_or_length=True,
+        absorption_enabled_or_length=True,
+        rtol=optics_rtol,
+    )
+    attach_optics(pyg4_lar_attach_scintillation, lar, reg, flat_top_yield=1000/u.MeV, rtol=optics_rtol)
 
-# -----------------------------
-# Place HPGe detectors inside LAr
-# -----------------------------
-bege_pos = [0, 0, 7.0, "cm"]
-coax_pos = [0, 0, -7.0, "cm"]
+    return pen, lar
 
-bege_pv = g4.PhysicalVolume([0,0,0], bege_pos, bege_l, "BEGe_pv", lar_l, registry=reg)
-coax_pv = g4.PhysicalVolume([0,0,0], coax_pos, coax_l, "Coax_pv", lar_l, registry=reg)
 
 # -----------------------------
-# PEN with bottom function
+# PEN shell and PMT around one HPGe detector
 # -----------------------------
-def create_pen_with_bottom(det_meta, det_pos, name_prefix, det_id,
-                           margin=0.1, thickness=0.2, bottom_thickness=0.2):
+def make_pen_shell(reg, pen, det_meta, name_prefix, margin=0.1, thickness=0.2, bottom_thickness=0.2):
+    """
+    PEN wall and bottom plate around one HPGe detector. Returns
+    {"wall": (lv, dz), "bottom": (lv, dz)}, dz being the offset (cm) of
+    the part centre from the detector position.
+    """
     det_radius_cm = det_meta["geometry"]["radius_in_mm"] / 10.0
     det_half_height_cm = det_meta["geometry"]["height_in_mm"] / 20.0
 
-    # Cylindrical wall
+    # Cylindrical wall, its bottom at the detector position
     inner_r = det_radius_cm + margin
     outer_r = inner_r + thickness
     height = 2*(det_half_height_cm + margin)
     wall_s = solid.Tubs(f"{name_prefix}_wall_s", inner_r, outer_r, height,
                         0, 2*math.pi, registry=reg, lunit="cm")
-    wall_l = g4.LogicalVolume(wall_s, pen, f"{name_prefix}_wall_lv", registry=reg)
-
-    # PEN center shifted so bottom at detector center
-    pen_center_z = det_pos[2] + height/2.0
-    wall_pv = g4.PhysicalVolume([0,0,0], [det_pos[0], det_pos[1], pen_center_z, "cm"], wall_l,
-                                f"{name_prefix}_wall_pv", lar_l, registry=reg)
 
     # Bottom plate
     bottom_s = solid.Tubs(f"{name_prefix}_bottom_s", 0, outer_r, bottom_thickness/2.0,
                           0, 2*math.pi, registry=reg, lunit="cm")
-    bottom_l = g4.LogicalVolume(bottom_s, pen, f"{name_prefix}_bottom_lv", registry=reg)
-    bottom_pos_z = pen_center_z  - height/2.0-margin/2.0 - bottom_thickness/2.0
-    bottom_pos = [det_pos[0], det_pos[1], bottom_pos_z, "cm"]
-    bottom_pv = g4.PhysicalVolume([0,0,0], bottom_pos, bottom_l, f"{name_prefix}_bottom_pv",
-                                  lar_l, registry=reg)
 
-# Register PEN wall as scintillator
-    wall_pv.pygeom_active_detector = RemageDetectorInfo("scintillator", det_id, {"name": name_prefix})
-
-    effective_height = height + bottom_thickness
-    return wall_pv, bottom_pv, bottom_pos_z
-
-# -----------------------------
-# Create PEN volumes
-# -----------------------------
-
-wall_pv_bege, bottom_pv_bege, pen_bege_half_height = create_pen_with_bottom(
-    bege_meta, bege_pos, "PEN_BEGe", 3, margin=0.1, thickness=0.2, bottom_thickness=0.2
-)
-wall_pv_coax, bottom_pv_coax, pen_coax_half_height = create_pen_with_bottom(
-    coax_meta, coax_pos, "PEN_Coax", 4, margin=0.1, thickness=0.2, bottom_thickness=0.2
-)
-'''
-def create_pmt_under_pen(det_pos, pen_half_height, name_prefix, det_id, gap=0.1):
-    """
-    Places a PMT exactly `gap` cm below the bottom of a PEN shell.
-    Default gap = 0.1 cm = 1 mm.
-    """
-    # PMT geometry
-    side_half = 2.54     # cm (PMT is 5.08x5.08 cm square)
-    thickness = 0.5      # cm total thickness
-    half_thickness = thickness / 2.0
-
-    # Detector center (in cm)
-    det_x, det_y, det_z = float(det_pos[0]), float(det_pos[1]), float(det_pos[2])
-
-    # PEN bottom z
-    pen_bottom_z = pen_half_height
-
-    # PMT center = PEN bottom - gap - half_thickness
-    pmt_center_z = pen_bottom_z - gap - half_thickness
-
-    # Solid: pass half-extents
-    pmt_s = solid.Box(f"{name_prefix}_s", side_half, side_half, half_thickness, registry=reg, lunit="cm")
-    pmt_l = g4.LogicalVolume(pmt_s, "G4_Galactic", f"{name_prefix}_lv", registry=reg)
-    pmt_pos = [det_x, det_y, pmt_center_z, "cm"]
-
-    # Place physical volume
-    pmt_pv = g4.PhysicalVolume([0,0,0], pmt_pos, pmt_l, f"{name_prefix}_pv", lar_l, registry=reg)
-    pmt_pv.pygeom_active_detector = RemageDetectorInfo("optical", det_id, {"name": name_prefix})
-
-    # --- Add optical surface ---
-    surf = g4.solid.OpticalSurface(
-        f"{name_prefix}_surface",
-        finish="ground",
-        model="unified",
-        surf_type="dielectric_metal",
-        value=0,
-        registry=reg
-    )
-    surf.addVecProperty("EFFICIENCY", [400, 600], [1, 1])    # 100% detection efficiency
-    surf.addVecProperty("REFLECTIVITY", [1, 10], [0, 0])  # no reflection
-    g4.SkinSurface(f"{name_prefix}_skin", pmt_l, surf, registry=reg)
-
-    print(
-        f"[DEBUG] {name_prefix}: det_z={det_z:.2f} cm, pen_half_height={pen_half_height:.2f} cm, "
-        f"pen_bottom_z={pen_bottom_z:.2f} cm, pmt_center_z={pmt_center_z:.2f} cm"
-    )
-
-    return pmt_pv
+    return {
+        "wall": (g4.LogicalVolume(wall_s, pen, f"{name_prefix}_wall_lv", registry=reg), height/2.0),
+        "bottom": (g4.LogicalVolume(bottom_s, pen, f"{name_prefix}_bottom_lv", registry=reg),
+                   -margin/2.0 - bottom_thickness/2.0),
+    }
 
-'''
 
-def create_pmt_under_pen(det_pos, pen_half_height, name_prefix, det_id, gap=0.1):
+def make_pmt(reg, name_prefix, bottom_dz, gap=0.1):
     """
-    Places a PMT exactly `gap` cm below the bottom of a PEN shell.
-    Default gap = 0.1 cm = 1 mm.
+    PMT (5.08x5.08x0.5 cm, fully absorbing optical surface) `gap` cm below
+    the PEN bottom plate centred at `bottom_dz`. Returns (lv, dz) like
+    make_pen_shell.
     """
-    # PMT geometry
-    side_half = 2.54     # cm (PMT is 5.08x5.08 cm square)
-    thickness = 0.5      # cm total thickness
-    half_thickness = thickness / 2.0
-
-    # Detector center (in cm)
-    det_x, det_y, det_z = float(det_pos[0]), float(det_pos[1]), float(det_pos[2])
-
-   
-    pen_bottom_z = pen_half_height
-
-    
-    pmt_center_z = pen_bottom_z - gap - half_thickness
+    side_half = 2.54
+    half_thickness = 0.25
 
-    # Solid: pass half-extents
     pmt_s = solid.Box(f"{name_prefix}_s", side_half, side_half, half_thickness, registry=reg, lunit="cm")
     pmt_l = g4.LogicalVolume(pmt_s, "G4_Galactic", f"{name_prefix}_lv", registry=reg)
-    pmt_pos = [det_x, det_y, pmt_center_z, "cm"]
 
-    # Place physical volume
-    pmt_pv = g4.PhysicalVolume([0,0,0], pmt_pos, pmt_l, f"{name_prefix}_pv", lar_l, registry=reg)
-
-    # --- Register as optical detector (this is the key line) ---
-    pmt_pv.pygeom_active_detector = RemageDetectorInfo("optical", det_id, {"name": name_prefix})
-
-    # --- Add optical surface ---
     surf = g4.solid.OpticalSurface(
         f"{name_prefix}_surface",
         finish="ground",
@@ -295,77 +165,192 @@ def create_pmt_under_pen(det_pos, pen_half_height, name_prefix, det_id, gap=0.1)
     surf.addVecProperty("REFLECTIVITY", [1, 10], [0, 0])     # no reflection
     g4.SkinSurface(f"{name_prefix}_skin", pmt_l, surf, registry=reg)
 
-    print(
-        f"[DEBUG] {name_prefix}: det_z={det_z:.2f} cm, pen_half_height={pen_half_height:.2f} cm, "
-        f"pen_bottom_z={pen_bottom_z:.2f} cm, pmt_center_z={pmt_center_z:.2f} cm"
-    )
-
-    return pmt_pv
+    return pmt_l, bottom_dz - gap - half_thickness
 
 
-pmt_bege_pv = create_pmt_under_pen(bege_pos, pen_bege_half_height, "PMT_BEGe", 5)
-pmt_coax_pv = create_pmt_under_pen(coax_pos, pen_coax_half_height, "PMT_Coax", 6)
-
-
-bege_pv.pygeom_active_detector = pygeomtools.RemageDetectorInfo(
-    "germanium",
-    1,
-    bege_meta,
-)
-coax_pv.pygeom_active_detector = pygeomtools.RemageDetectorInfo(
-    "germanium",
-    2,
-    coax_meta,
-)
-
-# PEN walls as scintillators
-wall_pv_bege.pygeom_active_detector = RemageDetectorInfo("scintillator", 3, {"name": "PEN_BEGe_wall"})
-wall_pv_coax.pygeom_active_detector = RemageDetectorInfo("scintillator", 5, {"name": "PEN_Coax_wall"})
-
-# PEN bottom plates as scintillators
-bottom_pv_bege.pygeom_active_detector = RemageDetectorInfo("scintillator", 4, {"name": "PEN_BEGe_bottom"})
-bottom_pv_coax.pygeom_active_detector = RemageDetectorInfo("scintillator", 6, {"name": "PEN_Coax_bottom"})
-
-# PMTs as optical
-pmt_bege_pv.pygeom_active_detector = RemageDetectorInfo("optical", 7, {"name": "PMT_BEGe"})
-pmt_coax_pv.pygeom_active_detector = RemageDetectorInfo("optical", 8, {"name": "PMT_Coax"})
-
-# Optional: LAr as scintillator
-lar_l.pygeom_active_detector = RemageDetectorInfo("scintillator", 9, {"name": "LAr"})
+def place_part(reg, part, mother_l, name, position, det_type, uid, meta):
+    """Place a (lv, dz) part relative to `position` (x, y, z in cm) as a remage detector."""
+    lv, dz = part
+    x, y, z = (float(v) for v in position[:3])
+    pv = g4.PhysicalVolume([0,0,0], [x, y, z + dz, "cm"], lv, name, mother_l, registry=reg)
+    pv.pygeom_active_detector = RemageDetectorInfo(det_type, uid, meta)
+    return pv
 
 
 # -----------------------------
-# Add detector origins
+# Replicated encapsulated detectors (arrays)
 # -----------------------------
-for pv in [bege_pv, coax_pv,
-           wall_pv_bege, bottom_pv_bege,
-           wall_pv_coax, bottom_pv_coax,
-           pmt_bege_pv, pmt_coax_pv, lar_pv]:
-    add_detector_origin(pv.name, pv, reg)
-
+def make_encapsulated_unit(reg, pen, det_meta, name_prefix,
+                           margin=0.1, thickness=0.2, bottom_thickness=0.2, pmt_gap=0.1):
+    """
+    Build the logical volumes of one HPGe + PEN wall + PEN bottom + PMT unit
+    once, so it can be placed any number of times with place_encapsulated_unit.
+    """
+    unit = make_pen_shell(reg, pen, det_meta, name_prefix, margin, thickness, bottom_thickness)
+    unit["meta"] = det_meta
+    unit["hpge"] = (cached_hpge(det_meta, reg, f"{name_prefix}_hpge_lv"), 0.0)
+    unit["pmt"] = make_pmt(reg, f"{name_prefix}_pmt", unit["bottom"][1], pmt_gap)
+    return unit
 
-# -----------------------------
-# Source
-# -----------------------------
-source_s = solid.Tubs("Source_s", 0, 1, 1, 0, 2*pi, registry=reg)
-source_l = g4.LogicalVolume(source_s, "G4_BRAIN_ICRP", "Source_L", registry=reg, lunit="mm")
-g4.PhysicalVolume([0,0,0], [0,0,0], source_l, "Source", lar_l, registry=reg)
 
-# -----------------------------
-# Visualization
-# -----------------------------
-viewer = pg4.visualisation.VtkViewerColoured(
-    materialVisOptions={
-        "LAr": [0,0,1,0.1],
-        "PEN": [0,0.5,0.5,0.3],
-        "G4_Galactic": [0.5,0.5,0.5,0.2],
+def place_encapsulated_unit(reg, unit, mother_l, name, position, first_uid):
+    """
+    Place one copy of `unit` at `position` (x, y, z in cm) with unique PV
+    names <name>_{hpge,wall,bottom,pmt}_pv and the detector uids
+    first_uid .. first_uid + 3. Returns the placed physical volumes.
+    """
+    detector_info = {
+        "hpge": ("germanium", unit["meta"]),
+        "wall": ("scintillator", {"name": f"{name}_wall"}),
+        "bottom": ("scintillator", {"name": f"{name}_bottom"}),
+        "pmt": ("optical", {"name": f"{name}_pmt"}),
     }
-)
-viewer.addLogicalVolume(reg.getWorldVolume())
-viewer.view()
+    pvs = []
+    for uid, part in enumerate(("hpge", "wall", "bottom", "pmt"), start=first_uid):
+        det_type, meta = detector_info[part]
+        pvs.append(place_part(reg, unit[part], mother_l, f"{name}_{part}_pv", position, det_type, uid, meta))
+    return pvs
+
 
 # -----------------------------
-# Export GDML
+# Build the full geometry
 # -----------------------------
-import pygeomtools
-pygeomtools.write_pygeom(reg, "HPGe_with_PEN_optical.gdml")
+def build_registry(margin=0.1, thickness=0.2, bottom_thickness=0.2, pmt_gap=0.1, optics_rtol=None,
+                   profile=None):
+    """
+    Build the HPGe + PEN + PMT geometry and return its registry.
+    Lengths are in cm and apply to both encapsulated detectors;
+    `optics_rtol` compresses the optical spectra (see attach_optics).
+    Stages are timed into `profile` (a BuildProfile) if given.
+    """
+    # -----------------------------
+    # Registry
+    # -----------------------------
+    reg = g4.Registry()
+
+    with profile_stage(profile, "materials"):
+        pen, lar = make_materials(reg, optics_rtol)
+
+    # -----------------------------
+    # World volume
+    # -----------------------------
+    world_s = solid.Box("world_s", 100, 100, 100, registry=reg, lunit="cm")
+    world_l = g4.LogicalVolume(world_s, "G4_Galactic", "World_lv", registry=reg)
+    reg.setWorld(world_l)
+
+    # -----------------------------
+    # LAr volume (cylinder)
+    # -----------------------------
+    lar_radius = 12
+    lar_half_height = 25
+    lar_s = solid.Tubs("LAr_s", 0, lar_radius, lar_half_height, 0, 2*math.pi, registry=reg, lunit="cm")
+    lar_l = g4.LogicalVolume(lar_s, lar, "LAr_lv", registry=reg, lunit="cm")
+    lar_pv = g4.PhysicalVolume([0,0,0], [0,0,0], lar_l, "LAr_pv", world_l, registry=reg)
+
+    # -----------------------------
+    # Create HPGe logical volumes
+    # -----------------------------
+    with profile_stage(profile, "hpge"):
+        bege_l = cached_hpge(bege_meta, reg, "BEGe_L")
+        coax_l = cached_hpge(coax_meta, reg, "Coax_L")
+
+    # -----------------------------
+    # Place HPGe detectors inside LAr
+    # -----------------------------
+    bege_pos = [0, 0, 7.0, "cm"]
+    coax_pos = [0, 0, -7.0, "cm"]
+
+    bege_pv = g4.PhysicalVolume([0,0,0], bege_pos, bege_l, "BEGe_pv", lar_l, registry=reg)
+    coax_pv = g4.PhysicalVolume([0,0,0], coax_pos, coax_l, "Coax_pv", lar_l, registry=reg)
+
+    bege_pv.pygeom_active_detector = pygeomtools.RemageDetectorInfo(
+        "germanium",
+        1,
+        bege_meta,
+    )
+    coax_pv.pygeom_active_detector = pygeomtools.RemageDetectorInfo(
+        "germanium",
+        2,
+        coax_meta,
+    )
+
+    # -----------------------------
+    # Create PEN shells and PMTs (uids: walls/bottoms 3-6, PMTs 7-8)
+    # -----------------------------
+    pen_pmt_pvs = []
+    with profile_stage(profile, "pen_pmt"):
+        for det, det_meta, det_pos, wall_id, pmt_id in (
+            ("BEGe", bege_meta, bege_pos, 3, 7),
+            ("Coax", coax_meta, coax_pos, 5, 8),
+        ):
+            shell = make_pen_shell(reg, pen, det_meta, f"PEN_{det}",
+                                   margin=margin, thickness=thickness, bottom_thickness=bottom_thickness)
+            pmt = make_pmt(reg, f"PMT_{det}", shell["bottom"][1], gap=pmt_gap)
+            pen_pmt_pvs += [
+                place_part(reg, shell["wall"], lar_l, f"PEN_{det}_wall_pv", det_pos,
+                           "scintillator", wall_id, {"name": f"PEN_{det}_wall"}),
+                place_part(reg, shell["bottom"], lar_l, f"PEN_{det}_bottom_pv", det_pos,
+                           "scintillator", wall_id + 1, {"name": f"PEN_{det}_bottom"}),
+                place_part(reg, pmt, lar_l, f"PMT_{det}_pv", det_pos, "optical", pmt_id, {"name": f"PMT_{det}"}),
+            ]
+
+    # Optional: LAr as scintillator
+    lar_pv.pygeom_active_detector = RemageDetectorInfo("scintillator", 9, {"name": "LAr"})
+
+    # -----------------------------
+    # Add detector origins
+    # -----------------------------
+    for pv in [bege_pv, coax_pv, *pen_pmt_pvs, lar_pv]:
+        add_detector_origin(pv.name, pv, reg)
+
+    # -----------------------------
+    # Source
+    # -----------------------------
+    source_s = solid.Tubs("Source_s", 0, 1, 1, 0, 2*pi, registry=reg)
+    source_l = g4.LogicalVolume(source_s, "G4_BRAIN_ICRP", "Source_L", registry=reg, lunit="mm")
+    g4.PhysicalVolume([0,0,0], [0,0,0], source_l, "Source", lar_l, registry=reg)
+
+    return reg
+
+
+# The guard lets sweep workers import build_registry without building,
+# opening a viewer or writing the default GDML.
+if __name__ == "__main__":
+    gdml_path = "HPGe_with_PEN_optical.gdml"
+    profile = BuildProfile()
+    # Cold import times only with PYG4_PROFILE_IMPORTS=1
+    profile.time_imports(["pyg4ometry", "legendhpges", "legendoptics", "pygeomtools"])
+
+    with profile.stage("build"):
+        reg = build_registry(profile=profile)
+
+    # -----------------------------
+    # Overlap check (before Geant4 ever sees the geometry); includes tessellation
+    # -----------------------------
+    with profile.stage("overlaps"):
+        overlaps = check_overlaps(reg.logicalVolumeDict["LAr_lv"])
+    if overlaps:
+        raise SystemExit(f"[ERROR] {len(overlaps)} overlaps/extrusions found, GDML not written")
+
+    # -----------------------------
+    # Export GDML (detectors are registered through its RMG_detector info)
+    # -----------------------------
+    detectors = write_detector_macro(reg, "detectors.mac")
+    for macro in ("gammas.mac", "vis-gammas.mac", "inspect-geometry.mac"):
+        validate_run_macro(macro, detectors)
+    with profile.stage("write_gdml"):
+        pygeomtools.write_pygeom(reg, gdml_path)
+    profile.write(gdml_path)
+
+    # -----------------------------
+    # Visualization (mode set by PYG4_VIEW)
+    # -----------------------------
+    show_geometry(
+        reg,
+        {
+            "LAr": [0,0,1,0.1],
+            "PEN": [0,0.5,0.5,0.3],
+            "G4_Galactic": [0.5,0.5,0.5,0.2],
+        },
+        snapshot_prefix="HPGe_with_PEN_optical",
+    )
@@ -0,0 +1,39 @@
+#!/Users/maninder/Desktop/Programs/remage/build/python_venv/bin/python
+"""
+Parametric sweep of the PEN encapsulation geometry of
+PENEncapsulationOpticalTest.py for veto-design studies.
+
+Every combination of the grid below is built in its own worker process and
+written to <outdir>/<variant>.gdml plus <variant>.json. Re-running the sweep
+only builds the variants that are missing. Materials and optical matrices are
+identical for all variants and are written once to <outdir>/shared.
+"""
+
+import argparse
+import os
+
+from geometry_tools import run_sweep
+from PENEncapsulationOpticalTest import build_registry
+
+# -----------------------------
+# Parameter grid (all lengths in cm)
+# -----------------------------
+grid = {
+    "thickness": [0.1, 0.2, 0.3, 0.5],
+    "margin": [0.05, 0.1, 0.2],
+    "bottom_thickness": [0.1, 0.2, 0.3],
+    "pmt_gap": [0.05, 0.1, 0.2],
+}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="PEN encapsulation geometry sweep")
+    parser.add_argument("--outdir", default="sweep", help="output directory for the variants")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: all cores)")
+    parser.add_argument("--no-shared", action="store_true", help="write self-contained GDML files")
+    args = parser.parse_args()
+
+    shared_dir = None if args.no_shared else os.path.join(args.outdir, "shared")
+    run_sweep(
+        build_registry, grid, args.outdir, max_workers=args.workers, prefix="HPGe_with_PEN", shared_dir=shared_dir
+    )
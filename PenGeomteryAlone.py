@@ -1,7 +1,6 @@
 import math
 import pyg4ometry.geant4 as g4
 import pyg4ometry.geant4.solid as solid
-import pyg4ometry.visualisation as vis
 from legendoptics.pen import (
     pyg4_pen_attach_rindex,
     pyg4_pen_attach_attenuation,
@@ -10,6 +9,8 @@ from legendoptics.pen import (
 )
 from pygeomtools import RemageDetectorInfo, write_pygeom
 
+from geometry_tools import show_geometry
+
 # -----------------------------
 # Setup Geant4 Registry
 # -----------------------------
@@ -131,17 +132,16 @@ reg.worldName = logical_world.name  # add this line
 
 
 
-# Create viewer and add volumes
-viewer = vis.VtkViewer()
+write_pygeom(reg, "geometry_with_pen.gdml")    # export GDML
 
 # Set PEN bowl color to teal
 logical_bowl.visualisationColor = [0.0, 0.5, 0.5]  # teal
-viewer.renWin.SetMultiSamples(10)  # anti-aliasing for smoother edges
-
-viewer.addLogicalVolume(reg.getWorldVolume())  # add world volume
-viewer.addLogicalVolume(logical_bowl)          # add PEN bowl with color
-logical_bowl.visualisation = True     
-
-viewer.view()                                   # display geometry
-
-write_pygeom(reg, "geometry_with_pen.gdml")    # export GDML
+logical_bowl.visualisation = True
+
+# Display geometry (mode set by PYG4_VIEW)
+show_geometry(
+    reg,
+    snapshot_prefix="geometry_with_pen",
+    multisamples=10,  # anti-aliasing for smoother edges
+    logical_volumes=[reg.getWorldVolume(), logical_bowl],  # world + PEN bowl with color
+)
@@ -0,0 +1,38 @@
+"""
+HPGe detector metadata shared by the geometry builder scripts
+(legendhpges format, lengths in mm).
+"""
+
+bege_meta = {
+    "name": "B00000B",
+    "type": "bege",
+    "production": {"enrichment": {"val": 0.874, "unc": 0.003}, "mass_in_g": 697.0},
+    "geometry": {
+        "height_in_mm": 29.46,
+        "radius_in_mm": 36.98,
+        "groove": {"depth_in_mm": 2.0, "radius_in_mm": {"outer": 10.5, "inner": 7.5}},
+        "pp_contact": {"radius_in_mm": 7.5, "depth_in_mm": 0},
+        "taper": {
+            "top": {"angle_in_deg": 0.0, "height_in_mm": 0.0},
+            "bottom": {"angle_in_deg": 0.0, "height_in_mm": 0.0},
+        },
+    },
+}
+
+coax_meta = {
+    "name": "C000RG1",
+    "type": "coax",
+    "production": {"enrichment": {"val": 0.855, "unc": 0.015}},
+    "geometry": {
+        "height_in_mm": 40,
+        "radius_in_mm": 38.25,
+        "borehole": {"radius_in_mm": 6.75, "depth_in_mm": 40},
+        "groove": {"depth_in_mm": 2, "radius_in_mm": {"outer": 20, "inner": 17}},
+        "pp_contact": {"radius_in_mm": 17, "depth_in_mm": 0},
+        "taper": {
+            "top": {"angle_in_deg": 45, "height_in_mm": 5},
+            "bottom": {"angle_in_deg": 45, "height_in_mm": 2},
+            "borehole": {"angle_in_deg": 0, "height_in_mm": 0},
+        },
+    },
+}
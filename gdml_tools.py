@@ -0,0 +1,904 @@
+"""
+Helpers for combining existing GDML geometries (remage output, CAD/STL
+conversions) with pyg4ometry.
+
+Only the standard library is imported at module level; pyg4ometry is
+imported inside the functions that need it.
+"""
+
+import concurrent.futures
+import contextlib
+import hashlib
+import json
+import os
+import pickle
+import re
+import tempfile
+import time
+
+# On-disk cache of parsed (and decimated) registries, keyed by file content and tolerances
+REGISTRY_CACHE_DIR = ".registry_cache"
+
+# Bumped whenever the decimation or the pickled registry layout changes
+# (invalidates old cache entries)
+_REGISTRY_CACHE_FORMAT = 2
+
+# Facets smaller than this fraction of the squared mesh extent count as degenerate
+DEGENERATE_AREA_FRACTION = 1e-12
+
+# Registry dictionaries merged by merge_registries, in dependency order
+MERGE_KINDS = (
+    ("defineDict", "define"),
+    ("materialDict", "material"),
+    ("solidDict", "solid"),
+    ("logicalVolumeDict", "logical volume"),
+    ("assemblyVolumeDict", "assembly volume"),
+    ("physicalVolumeDict", "physical volume"),
+    ("surfaceDict", "surface"),
+)
+
+# Kinds whose objects are shared when their content is identical
+CONTENT_DEDUP_KINDS = ("define", "material", "solid")
+
+# Identifiers inside GDML expression strings ("2*x + y_stl")
+_IDENTIFIER_RE = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")
+
+
+# -----------------------------
+# Content fingerprints
+# -----------------------------
+# Attributes that do not describe an object's content: its identity, owner,
+# users and cached meshes
+_NON_CONTENT_ATTRS = ("name", "_name", "registry", "dependents", "mesh", "_NIST_compounds")
+
+# Predefined (Geant4 NIST) materials are defined by their name alone
+_NAMED_MATERIAL_TYPES = ("nist", "arbitrary")
+
+
+def _is_registry_object(value):
+    """Named objects owned by a registry (defines, materials, solids, volumes)."""
+    return hasattr(value, "name") and hasattr(value, "registry") and not isinstance(value, type)
+
+
+def _is_expression(value):
+    """pyg4ometry expression holders (BasicExpression): a GDML expression string."""
+    return hasattr(value, "expressionString") and hasattr(value, "eval")
+
+
+def _expression_attrs(obj):
+    """
+    Attributes of `obj` that may hold raw GDML expression strings or define
+    names: the (non-unit) parameters of a solid, stored as _<varName>.
+    Other strings (state, lunit, finish, ...) are never expressions.
+    """
+    names = [name for name in getattr(obj, "varNames", ()) if "unit" not in name]
+    return {*names, *(f"_{name}" for name in names)}
+
+
+def _evaluate(expression):
+    try:
+        return float(expression.eval())
+    except Exception:
+        return None
+
+
+def _canonical(value, resolve, renamed_defines, depth=0, expression=False):
+    """
+    JSON-able form of `value`. Registered objects (those `resolve` names)
+    appear as references by their merged name; expressions by their string,
+    with define renames applied, and their evaluated value. Plain strings
+    only get the renames where they are expressions (`expression`).
+    """
+    if isinstance(value, str):
+        return _rename_in_string(value, renamed_defines) if expression else value
+    if value is None or isinstance(value, (bool, int, float)):
+        return value
+    if hasattr(value, "tolist"):
+        return value.tolist()
+    if isinstance(value, (list, tuple)):
+        return [_canonical(v, resolve, renamed_defines, depth, expression) for v in value]
+    if isinstance(value, dict):
+        return {
+            str(k): _canonical(v, resolve, renamed_defines, depth, expression)
+            for k, v in sorted(value.items(), key=lambda kv: str(kv[0]))
+        }
+    if _is_expression(value):
+        return ["expression", _rename_in_string(value.expressionString, renamed_defines), _evaluate(value)]
+    if depth > 0 and _is_registry_object(value):
+        name = resolve(value)
+        if name is not None:
+            return ["ref", type(value).__name__, name]
+    if hasattr(value, "__dict__") and depth < 6:
+        expression_attrs = _expression_attrs(value)
+        content = {
+            k: _canonical(v, resolve, renamed_defines, depth + 1, k in expression_attrs)
+            for k, v in sorted(vars(value).items())
+            if k not in _NON_CONTENT_ATTRS and not callable(v)
+        }
+        if getattr(value, "type", None) in _NAMED_MATERIAL_TYPES:
+            content["name"] = value.name
+        return [type(value).__name__, content]
+    return repr(value)
+
+
+def content_hash(obj, resolve=lambda o: o.name, renamed_defines=None):
+    """
+    Hash of everything that defines `obj` except its own name, registry and
+    users. `resolve` gives the name of a referenced registered object (None
+    to hash its content instead); `renamed_defines` ({old: new}) is applied
+    to expression strings first, so "2*x" of a source whose x was renamed
+    does not match "2*x" of the target.
+    """
+    text = json.dumps(_canonical(obj, resolve, renamed_defines or {}), sort_keys=True, default=repr)
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+# -----------------------------
+# Reference rewiring
+# -----------------------------
+def _rename_in_string(text, renamed_defines):
+    """Apply define renames to a name or GDML expression string."""
+    if not renamed_defines:
+        return text
+    if text in renamed_defines:
+        return renamed_defines[text]
+    return _IDENTIFIER_RE.sub(lambda m: renamed_defines.get(m.group(), m.group()), text)
+
+
+def _rewire_value(value, context, expression=False):
+    """Rewired `value`; strings are only renamed where they are expressions (`expression`)."""
+    replaced = context["replaced"]
+    if id(value) in replaced:
+        return replaced[id(value)]
+    if isinstance(value, str):
+        return _rename_in_string(value, context["renamed_defines"]) if expression else value
+    if isinstance(value, list):
+        value[:] = [_rewire_value(v, context, expression) for v in value]
+        return value
+    if isinstance(value, tuple):
+        return tuple(_rewire_value(v, context, expression) for v in value)
+    if isinstance(value, dict):
+        for k, v in value.items():
+            value[k] = _rewire_value(v, context, expression)
+        return value
+    # every other pyg4ometry object of the source (expressions, positions,
+    # transferred volumes) is rewired in place; objects owned by the target
+    # are left alone
+    if type(value).__module__.startswith("pyg4ometry") and getattr(value, "registry", None) is not context["target"]:
+        _rewire_object(value, context)
+    return value
+
+
+def _rewire_object(obj, context):
+    """Point every reference held by `obj` at the merged objects, in place."""
+    if id(obj) in context["seen"] or not hasattr(obj, "__dict__"):
+        return
+    context["seen"].add(id(obj))
+    if _is_expression(obj):
+        obj.expressionString = _rename_in_string(obj.expressionString, context["renamed_defines"])
+        obj.parseTree = None
+    expression_attrs = _expression_attrs(obj)
+    for key, value in vars(obj).items():
+        if key == "registry":
+            if value is context["source"]:
+                obj.registry = context["target"]
+            continue
+        if key in ("name", "_name", "mesh") or callable(value):
+            continue
+        new_value = _rewire_value(value, context, key in expression_attrs)
+        if new_value is not value:
+            setattr(obj, key, new_value)
+
+
+# -----------------------------
+# Registry merge
+# -----------------------------
+def _unique_name(name, taken, suffix):
+    new_name = f"{name}{suffix}"
+    count = 2
+    while new_name in taken:
+        new_name = f"{name}{suffix}{count}"
+        count += 1
+    return new_name
+
+
+def merge_registries(target, source, suffix="_merged", material_map=None, verbose=True, index=None):
+    """
+    Merge every define, material, solid, volume and surface of `source`
+    into `target` (in place) and return the merge report.
+
+    Both registries are indexed once by name and by content hash:
+    - identical content (defines, materials, solids) reuses the target object;
+    - a name collision with different content renames the source object
+      once, with `suffix` (one rename map per kind);
+    - `material_map` ({source material name: target material name}) forces
+      source materials onto existing target materials, e.g. {"PEN": "PEN"}
+      to use the optical PEN of a remage geometry for CAD parts.
+    All references held by the transferred objects (materials, solids,
+    logical volumes, positions and define names inside expressions) are
+    then rewired in a single pass. Source objects keep their identity, so
+    handles taken from `source` before the merge stay valid.
+
+    `index` ({kind: {content hash: target object}}) is filled on first use
+    and kept up to date with the added objects; pass the same dict to
+    successive merges into one target so the target is hashed only once.
+    It is only valid as long as `target` changes through these merges alone.
+
+    The report is {"renamed": {kind: {old: new}}, "reused": {kind: {source: target}},
+    "added": {kind: count}}.
+    """
+    start_time = time.perf_counter()
+    material_map = material_map or {}
+    index = {} if index is None else index
+
+    replaced = {}  # id(source object) -> target object it is replaced by
+    final_name = {}  # id(registered object) -> name in the merged registry
+    for attr, _ in MERGE_KINDS:
+        for reg in (target, source):
+            for obj in getattr(reg, attr, {}).values():
+                final_name.setdefault(id(obj), obj.name)
+    renamed = {kind: {} for _, kind in MERGE_KINDS}
+    reused = {kind: {} for _, kind in MERGE_KINDS}
+    added = {kind: 0 for _, kind in MERGE_KINDS}
+    transferred = []
+
+    def resolve(obj):
+        # None for anonymous objects (e.g. the positions of a boolean solid),
+        # which are hashed by content
+        return final_name.get(id(obj))
+
+    for attr, kind in MERGE_KINDS:
+        target_dict = getattr(target, attr, None)
+        source_dict = getattr(source, attr, None)
+        if target_dict is None or not source_dict:
+            continue
+
+        by_hash = None
+        if kind in CONTENT_DEDUP_KINDS:
+            if kind not in index:
+                index[kind] = {}
+                for obj in target_dict.values():
+                    index[kind].setdefault(content_hash(obj, resolve), obj)
+            by_hash = index[kind]
+        # expression strings of the source read in the merged namespace
+        source_renames = renamed["define"]
+
+        for name, obj in list(source_dict.items()):
+            match = key = None
+            if kind == "material" and name in material_map:
+                match = target_dict.get(material_map[name])
+                if match is None:
+                    raise ValueError(f"material_map: target material {material_map[name]!r} not found")
+            elif by_hash is not None:
+                key = content_hash(obj, resolve, source_renames)
+                match = by_hash.get(key)
+
+            if match is not None:
+                replaced[id(obj)] = match
+                final_name[id(obj)] = match.name
+                if match.name != name:
+                    reused[kind][name] = match.name
+                    if kind == "define":
+                        renamed[kind][name] = match.name
+                continue
+
+            if name in target_dict:
+                new_name = _unique_name(name, target_dict, suffix)
+                renamed[kind][name] = new_name
+                obj.name = new_name
+            target_dict[obj.name] = obj
+            final_name[id(obj)] = obj.name
+            if key is not None:
+                # hashed with its merged references, as if it were rewired already
+                by_hash[key] = obj
+            if kind == "logical volume" and hasattr(target, "logicalVolumeList"):
+                target.logicalVolumeList.append(obj.name)
+            transferred.append(obj)
+            added[kind] += 1
+
+    context = {
+        "replaced": replaced,
+        "renamed_defines": renamed["define"],
+        "seen": set(),
+        "source": source,
+        "target": target,
+    }
+    for obj in transferred:
+        _rewire_object(obj, context)
+
+    if verbose:
+        print(f"[INFO] Merged registries in {time.perf_counter() - start_time:.2f} s")
+        for _, kind in MERGE_KINDS:
+            if added[kind] or renamed[kind] or reused[kind]:
+                print(
+                    f"[INFO]   {kind}: {added[kind]} added, {len(reused[kind])} reused, "
+                    f"{sum(1 for k in renamed[kind] if k not in reused[kind])} renamed"
+                )
+
+    return {"renamed": renamed, "reused": reused, "added": added}
+
+
+# -----------------------------
+# Tessellated mesh decimation
+# -----------------------------
+def indexed_mesh(solid):
+    """(vertices (n, 3) in mm, triangles (m, 3) vertex indices) of any pyg4ometry solid."""
+    import numpy as np
+
+    vertices, polygons, _ = solid.mesh().toVerticesAndPolygons()
+    triangles = [
+        (polygon[0], polygon[i], polygon[i + 1])
+        for polygon in polygons
+        for i in range(1, len(polygon) - 1)
+    ]
+    return np.asarray(vertices, dtype=np.float64), np.asarray(triangles, dtype=np.int64).reshape(-1, 3)
+
+
+def mesh_volume(vertices, facets):
+    """Enclosed volume (mm^3) of a closed, consistently oriented triangle mesh."""
+    import numpy as np
+
+    a, b, c = (vertices[facets[:, i]] for i in range(3))
+    return abs(np.einsum("ij,ij->i", a, np.cross(b, c)).sum()) / 6.0
+
+
+def cluster_vertices(vertices, facets, cell):
+    """
+    Vertex-clustering decimation on a grid of size `cell` (mm): vertices in
+    a cell merge into their mean, collapsed and duplicate facets are dropped.
+    Returns (vertices, facets, deviation).
+
+    Every original facet maps affinely onto its image (a facet, an edge or a
+    vertex of the result), so as long as all images are still part of the
+    new surface, no point of either surface is further than the largest
+    vertex displacement from the other; `deviation` is that bound in mm, or
+    inf when part of the original surface was dropped.
+    """
+    import numpy as np
+
+    keys = np.floor((vertices - vertices.min(axis=0)) / cell).astype(np.int64)
+    _, cluster = np.unique(keys, axis=0, return_inverse=True)
+    cluster = cluster.reshape(-1)
+    n_clusters = cluster.max() + 1
+
+    counts = np.bincount(cluster, minlength=n_clusters)
+    merged = np.stack(
+        [np.bincount(cluster, weights=vertices[:, k], minlength=n_clusters) / counts for k in range(3)], axis=1
+    )
+    deviation = np.linalg.norm(vertices - merged[cluster], axis=1).max()
+
+    images = cluster[facets]
+    n_distinct = (
+        1
+        + (images[:, 0] != images[:, 1])
+        + ((images[:, 2] != images[:, 0]) & (images[:, 2] != images[:, 1]))
+    )
+    new_facets = images[n_distinct == 3]
+    # drop facets that now coincide (same vertex set), keeping the first
+    _, first = np.unique(np.sort(new_facets, axis=1), axis=0, return_index=True)
+    new_facets = new_facets[np.sort(first)]
+
+    # facets collapsed to an edge or a vertex must still lie on the new surface
+    def edge_codes(edges):
+        edges = np.sort(edges, axis=1)
+        return edges[:, 0] * n_clusters + edges[:, 1]
+
+    surface_edges = edge_codes(new_facets[:, [0, 1, 1, 2, 2, 0]].reshape(-1, 2))
+    segments = np.sort(images[n_distinct == 2], axis=1)
+    # the two distinct ids of a segment are its min and max
+    segments = segments[:, [0, 2]]
+    points = images[n_distinct == 1, 0]
+    if not (np.isin(edge_codes(segments), surface_edges).all() and np.isin(points, new_facets).all()):
+        deviation = np.inf
+
+    # compact the vertex list to the vertices still in use
+    used, new_facets = np.unique(new_facets, return_inverse=True)
+    return merged[used], new_facets.reshape(-1, 3), deviation
+
+
+def mesh_defects(vertices, facets):
+    """
+    Why `facets` is not a closed, consistently oriented 2-manifold without
+    degenerate facets (every edge shared by exactly two facets, in opposite
+    directions), or None if it is one.
+    """
+    import numpy as np
+
+    if len(facets) == 0:
+        return "no facets"
+    a, b, c = (vertices[facets[:, i]] for i in range(3))
+    area = 0.5 * np.linalg.norm(np.cross(b - a, c - a), axis=1)
+    min_area = DEGENERATE_AREA_FRACTION * float(np.ptp(vertices, axis=0).max()) ** 2
+    n_degenerate = int((area <= min_area).sum())
+    if n_degenerate:
+        return f"{n_degenerate} degenerate facets"
+
+    n = len(vertices)
+    edges = facets[:, [0, 1, 1, 2, 2, 0]].reshape(-1, 2).astype(np.int64)
+    forward = edges[:, 0] * n + edges[:, 1]
+    if len(np.unique(forward)) < len(forward):
+        return "edge shared by more than two facets or facets flipped"
+    n_open = int((~np.isin(edges[:, 1] * n + edges[:, 0], forward)).sum())
+    if n_open:
+        return f"{n_open} open edges"
+    return None
+
+
+def decimate_mesh(vertices, facets, max_deviation, max_volume_change=0.01, iterations=24):
+    """
+    Largest clustering cell (binary search) whose result is a valid closed
+    surface (mesh_defects), stays within `max_deviation` mm of the original
+    surface (see cluster_vertices) and within `max_volume_change` (relative)
+    of its volume. Returns (vertices, facets, report).
+    """
+    import numpy as np
+
+    volume = mesh_volume(vertices, facets)
+    best = (vertices, facets, 0.0, volume)
+    rejected = {}
+
+    low, high = 0.0, float(np.ptp(vertices, axis=0).max())
+    for _ in range(iterations):
+        cell = 0.5 * (low + high)
+        if cell <= 0:
+            break
+        new_vertices, new_facets, deviation = cluster_vertices(vertices, facets, cell)
+        reason, new_volume = None, 0.0
+        if deviation > max_deviation:
+            reason = "surface deviation"
+        elif mesh_defects(new_vertices, new_facets) is not None:
+            reason = "invalid surface"
+        else:
+            new_volume = mesh_volume(new_vertices, new_facets)
+            if abs(new_volume - volume) > max_volume_change * volume:
+                reason = "volume change"
+        if reason is None:
+            low = cell
+            if len(new_facets) < len(best[1]):
+                best = (new_vertices, new_facets, deviation, new_volume)
+        else:
+            rejected[reason] = rejected.get(reason, 0) + 1
+            high = cell
+
+    new_vertices, new_facets, deviation, new_volume = best
+    report = {
+        "facets_before": int(len(facets)),
+        "facets_after": int(len(new_facets)),
+        "max_deviation_mm": float(deviation),
+        "volume_before_mm3": float(volume),
+        "volume_after_mm3": float(new_volume),
+        "rejected": rejected,
+    }
+    return new_vertices, new_facets, report
+
+
+def _solids_referenced_by_solids(reg):
+    """ids of the solids of `reg` that another solid (boolean, multi-union) is built from."""
+    referenced = set()
+    for solid in reg.solidDict.values():
+        referenced.update(id(item) for item in _constituent_solids(solid))
+    return referenced
+
+
+def _constituent_solids(solid):
+    """Solids that `solid` (a boolean, multi-union, ...) is built from."""
+    from pyg4ometry.geant4.solid import SolidBase
+
+    constituents, stack = [], list(vars(solid).values())
+    while stack:
+        item = stack.pop()
+        if isinstance(item, (list, tuple)):
+            stack.extend(item)
+        elif isinstance(item, SolidBase) and item is not solid:
+            constituents.append(item)
+    return constituents
+
+
+def decimate_tessellated(reg, max_deviation, max_volume_change=0.01, verbose=True):
+    """
+    Decimate every TessellatedSolid used by a logical volume of `reg`
+    (see decimate_mesh) and swap in the reduced solid; solids that another
+    solid is built from are left alone. Reports facet reduction, volume
+    and -- where the material density is known -- mass change per solid.
+    Returns the reports keyed by solid name.
+    """
+    import pyg4ometry.geant4 as g4
+
+    users = {}
+    for lv in reg.logicalVolumeDict.values():
+        if isinstance(lv.solid, g4.solid.TessellatedSolid):
+            users.setdefault(lv.solid.name, []).append(lv)
+
+    reports = {}
+    replaced = []
+    referenced = _solids_referenced_by_solids(reg)
+    for name, lvs in users.items():
+        old_solid = lvs[0].solid
+        if id(old_solid) in referenced:
+            # a boolean solid still uses the original facets
+            if verbose:
+                print(f"[INFO] {name}: used by another solid, not decimated")
+            continue
+        vertices, facets = indexed_mesh(old_solid)
+        new_vertices, new_facets, report = decimate_mesh(vertices, facets, max_deviation, max_volume_change)
+        if report["facets_after"] >= report["facets_before"]:
+            continue
+
+        new_solid = g4.solid.TessellatedSolid(
+            f"{name}_decimated",
+            [new_vertices.tolist(), new_facets.tolist()],
+            reg,
+            meshtype=g4.solid.TessellatedSolid.MeshType.Freecad,
+        )
+        for lv in lvs:
+            lv.solid = new_solid
+            # volumes read without meshing (read_registries) stay that way
+            if getattr(lv, "mesh", None) is not None:
+                lv.reMesh()
+        reg.solidDict.pop(name, None)
+        replaced.append(old_solid)
+
+        density = getattr(lvs[0].material, "density", None)
+        if isinstance(density, (int, float)):
+            # g/cm3 * mm3 -> g
+            report["mass_change_g"] = density * (report["volume_after_mm3"] - report["volume_before_mm3"]) / 1000.0
+        reports[name] = report
+
+        if verbose:
+            change = report["volume_after_mm3"] / report["volume_before_mm3"] - 1
+            mass = f", mass {report['mass_change_g']:+.3f} g" if "mass_change_g" in report else ""
+            print(
+                f"[INFO] {name}: {report['facets_before']} -> {report['facets_after']} facets, "
+                f"max deviation {report['max_deviation_mm']:.3f} mm, volume {change:+.3%}{mass}"
+            )
+
+    # the vertex defines of replaced solids read from GDML would otherwise
+    # be written again as orphans
+    orphans = _vertex_define_names(replaced) - _vertex_define_names(reg.solidDict.values())
+    for vertex in orphans:
+        reg.defineDict.pop(vertex, None)
+    return reports
+
+
+def _vertex_define_names(solids):
+    """Names of the position defines the GDML-type tessellated `solids` are built from."""
+    import pyg4ometry.geant4 as g4
+
+    names = set()
+    for solid in solids:
+        if isinstance(solid, g4.solid.TessellatedSolid) and solid.meshtype == g4.solid.TessellatedSolid.MeshType.Gdml:
+            names.update(vertex for facet in solid.meshtess for vertex in facet)
+    return names
+
+
+# -----------------------------
+# Registry cache
+# -----------------------------
+def gdml_fingerprint(path):
+    """
+    sha256 of a GDML file and of the external entity files (shared
+    includes) it declares, so editing either invalidates the cache.
+    """
+    from geometry_tools import gdml_includes
+
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    for include_path in gdml_includes(path):
+        with open(include_path, "rb") as f:
+            digest.update(hashlib.sha256(f.read()).digest())
+    return digest.hexdigest()
+
+
+def registry_cache_key(path, decimate=None):
+    """Cache address of the registry read from a GDML file."""
+    from geometry_tools import package_version
+
+    key = {
+        "format": _REGISTRY_CACHE_FORMAT,
+        "gdml": gdml_fingerprint(path),
+        "pyg4ometry": package_version("pyg4ometry"),
+        "decimate": list(decimate) if decimate is not None else None,
+    }
+    return hashlib.sha256(json.dumps(key, sort_keys=True).encode()).hexdigest()
+
+
+class _RegistryPickler(pickle.Pickler):
+    """
+    Pickler for pyg4ometry registries. Materials hold pyg4ometry's
+    dict_keys view of the NIST material names, which is restored by
+    reference, the volume meshes wrap CGAL objects, which are dropped
+    (pickled volumes are unmeshed, see read_registries), and some solids
+    need their parameter properties back on the class (_new_solid).
+    """
+
+    def reducer_override(self, obj):
+        from pyg4ometry.geant4 import _Material
+        from pyg4ometry.geant4.solid import SolidBase
+        from pyg4ometry.visualisation import Mesh
+
+        if obj is _Material._nistMaterialList:
+            return _Material.getNistMaterialList, ()
+        if isinstance(obj, type({}.keys())):
+            return list, (list(obj),)
+        if isinstance(obj, Mesh):
+            return type(None), ()
+        if isinstance(obj, SolidBase):
+            properties = tuple(name for name in getattr(obj, "varNames", ()) if f"_{name}" in vars(obj))
+            if properties:
+                return _new_solid, (type(obj), properties), vars(obj)
+        return NotImplemented
+
+
+def _new_solid(cls, properties):
+    """
+    Unpickle a solid whose parameters are class properties that pyg4ometry
+    only adds when the first solid of that class is constructed.
+    """
+    solid = cls.__new__(cls)
+    for name in properties:
+        solid._addProperty(name)
+    return solid
+
+
+def parse_registry(path, decimate=None, cache_path=None):
+    """
+    Parse `path` without meshing its volumes, run
+    decimate_tessellated(reg, *decimate) on it if `decimate` is given, and
+    pickle the result to `cache_path` if given.
+    """
+    import pyg4ometry.config
+    from pyg4ometry.gdml import Reader
+
+    do_meshing = pyg4ometry.config.doMeshing
+    pyg4ometry.config.doMeshing = False
+    try:
+        reg = Reader(path).getRegistry()
+        if decimate is not None:
+            decimate_tessellated(reg, *decimate)
+    finally:
+        pyg4ometry.config.doMeshing = do_meshing
+
+    if cache_path is not None:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            _RegistryPickler(f, pickle.HIGHEST_PROTOCOL).dump(reg)
+        os.replace(tmp_path, cache_path)
+    return reg
+
+
+def _parse_registry_to_cache(path, decimate, cache_path):
+    """Process-pool worker: only the pickle file crosses the process boundary."""
+    parse_registry(path, decimate, cache_path)
+
+
+def read_registry(path, decimate=None, cache_dir=REGISTRY_CACHE_DIR):
+    """
+    Parse one GDML file into a pyg4ometry registry. `decimate` =
+    (max_deviation, max_volume_change) reduces its tessellated solids
+    first. The registry is pickled to `cache_dir`, so unchanged files are
+    neither parsed nor decimated again on later runs; cache_dir=None
+    disables the cache. The logical volumes are not meshed (mesh is None),
+    as for merging and writing they need not be; show_geometry meshes them
+    when drawing.
+    """
+    return read_registries([path], 1, decimate, cache_dir)[0]
+
+
+def read_registries(paths, max_workers=None, decimate=None, cache_dir=REGISTRY_CACHE_DIR):
+    """
+    Read several GDML files (see read_registry). Files without a cached
+    registry are parsed and decimated concurrently in a process pool that
+    hands them back through pickle files; these are loaded here, in the
+    order of `paths`.
+    """
+    start_time = time.perf_counter()
+    registries = [None] * len(paths)
+    with contextlib.ExitStack() as stack:
+        pickle_dir = cache_dir
+        if pickle_dir is None and len(paths) > 1 and max_workers != 1:
+            pickle_dir = stack.enter_context(tempfile.TemporaryDirectory())
+        pickle_paths = [
+            None if pickle_dir is None else os.path.join(pickle_dir, f"{registry_cache_key(path, decimate)}.pkl")
+            for path in paths
+        ]
+        missing = [
+            i for i, pickle_path in enumerate(pickle_paths)
+            if cache_dir is None or not os.path.exists(pickle_path)
+        ]
+
+        if len(missing) == 1 or max_workers == 1:
+            for i in missing:
+                registries[i] = parse_registry(paths[i], decimate, pickle_paths[i] if cache_dir else None)
+        elif missing:
+            with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers) as pool:
+                list(pool.map(
+                    _parse_registry_to_cache,
+                    [paths[i] for i in missing],
+                    [decimate] * len(missing),
+                    [pickle_paths[i] for i in missing],
+                ))
+
+        for i, pickle_path in enumerate(pickle_paths):
+            if registries[i] is None:
+                if i not in missing:
+                    print(f"[INFO] {paths[i]}: registry loaded from cache")
+                with open(pickle_path, "rb") as f:
+                    registries[i] = pickle.load(f)
+    print(f"[INFO] Read {len(paths)} GDML files in {time.perf_counter() - start_time:.2f} s")
+    return registries
+
+
+def prune_to_world_daughters(reg):
+    """
+    Drop the world volume of a part registry, the placements in it and
+    everything not used below them (volumes, solids, surfaces), so merging
+    the part does not copy them into the target as orphans. Returns the
+    logical volumes placed in the world.
+    """
+    world = reg.getWorldVolume()
+    if world is None:
+        raise ValueError("part registry has no world volume")
+    daughters = [pv.logicalVolume for pv in world.daughterVolumes]
+
+    volumes, placements, stack = set(), set(), list(daughters)
+    while stack:
+        volume = stack.pop()
+        if id(volume) in volumes:
+            continue
+        volumes.add(id(volume))
+        for pv in volume.daughterVolumes:
+            placements.add(id(pv))
+            stack.append(pv.logicalVolume)
+
+    surfaces = {
+        name: surface
+        for name, surface in reg.surfaceDict.items()
+        if id(getattr(surface, "volumeref", None)) in volumes
+        or (id(getattr(surface, "physref1", None)) in placements and id(getattr(surface, "physref2", None)) in placements)
+    }
+    solids, stack = set(), [
+        v.solid for v in reg.logicalVolumeDict.values() if id(v) in volumes
+    ] + [surface.surface_property for surface in surfaces.values()]
+    while stack:
+        solid = stack.pop()
+        if id(solid) not in solids:
+            solids.add(id(solid))
+            stack.extend(_constituent_solids(solid))
+
+    for attr, kept in (
+        ("logicalVolumeDict", volumes),
+        ("assemblyVolumeDict", volumes),
+        ("physicalVolumeDict", placements),
+        ("solidDict", solids),
+    ):
+        registry_dict = getattr(reg, attr, {})
+        for name in [name for name, obj in registry_dict.items() if id(obj) not in kept]:
+            del registry_dict[name]
+    reg.surfaceDict = surfaces
+    if hasattr(reg, "logicalVolumeList"):
+        reg.logicalVolumeList = [name for name in reg.logicalVolumeList if name in reg.logicalVolumeDict]
+    return daughters
+
+
+def merge_parts(target, paths, registries, material_map=None):
+    """
+    Merge part registries (read from `paths`) into `target` one after
+    another in the given order, so names and collision renames are
+    reproducible; a part's collisions get the suffix _<file stem>. Only
+    the volumes below each part's world are merged, and the target's
+    content index is built once for all parts.
+    Returns the logical volume placed in each part's world.
+    """
+    parts = []
+    index = {}
+    for path, reg in zip(paths, registries):
+        stem = re.sub(r"[^A-Za-z0-9_]", "_", os.path.splitext(os.path.basename(path))[0])
+        daughters = prune_to_world_daughters(reg)
+        if len(daughters) != 1:
+            raise ValueError(f"{path}: expected one part in the world volume, found {len(daughters)}")
+        parts.append(daughters[0])
+        merge_registries(target, reg, suffix=f"_{stem}", material_map=material_map, index=index)
+    return parts
+
+
+# -----------------------------
+# Direct STL import
+# -----------------------------
+def _stl_record_dtype():
+    import numpy as np
+
+    # binary STL facet record: normal, 3 vertices (float32), attribute byte count
+    return np.dtype([("normal", "<f4", (3,)), ("vertices", "<f4", (3, 3)), ("attribute", "<u2")])
+
+
+def _unique_rows(rows):
+    """
+    np.unique(rows, axis=0, return_inverse=True) through a single lexsort,
+    several times faster for millions of (n, 3) rows.
+    """
+    import numpy as np
+
+    order = np.lexsort(rows.T[::-1])
+    sorted_rows = rows[order]
+    first = np.ones(len(rows), dtype=bool)
+    first[1:] = np.any(sorted_rows[1:] != sorted_rows[:-1], axis=1)
+    inverse = np.empty(len(rows), dtype=np.int64)
+    inverse[order] = np.cumsum(first) - 1
+    return sorted_rows[first], inverse
+
+
+def read_stl(path):
+    """
+    Read an STL file into (vertices (n, 3) float64, facets (m, 3) int64).
+    Binary files are memory-mapped and decoded as one record array;
+    identical corner coordinates are merged into shared vertices and
+    degenerate facets are dropped. ASCII STL is supported as a fallback.
+    """
+    import numpy as np
+
+    size = os.path.getsize(path)
+    with open(path, "rb") as f:
+        header = f.read(84)
+    n_facets = int(np.frombuffer(header[80:84], dtype="<u4")[0]) if len(header) == 84 else 0
+    record = _stl_record_dtype()
+
+    if len(header) == 84 and size == 84 + n_facets * record.itemsize:
+        records = np.memmap(path, dtype=record, mode="r", offset=84, shape=(n_facets,))
+        corners = np.asarray(records["vertices"], dtype=np.float64).reshape(-1, 3)
+    elif header.lstrip().startswith(b"solid"):
+        with open(path, "rb") as f:
+            text = f.read()
+        numbers = re.findall(rb"vertex\s+(\S+)\s+(\S+)\s+(\S+)", text)
+        corners = np.asarray(numbers, dtype=np.float64).reshape(-1, 3)
+    else:
+        raise ValueError(f"{path}: not a valid binary or ASCII STL file")
+
+    vertices, inverse = _unique_rows(corners)
+    facets = inverse.reshape(-1, 3)
+    keep = (facets[:, 0] != facets[:, 1]) & (facets[:, 1] != facets[:, 2]) & (facets[:, 0] != facets[:, 2])
+    return vertices, facets[keep]
+
+
+def stl_to_logical_volume(path, reg, name, material, scale=1.0, decimate=None, verbose=True):
+    """
+    Create a TessellatedSolid and its logical volume directly from an STL
+    file (see read_stl), without writing and re-parsing a GDML file.
+    `material` is a material object or the name of a material in `reg`;
+    other names raise a ValueError unless they are Geant4 NIST names
+    ("G4_..."). `scale` converts the STL units to mm and `decimate` =
+    (max_deviation, max_volume_change) reduces the facets (decimate_mesh).
+    """
+    import pyg4ometry.geant4 as g4
+
+    if isinstance(material, str):
+        if material in reg.materialDict:
+            material = reg.materialDict[material]
+        elif not material.startswith("G4_"):
+            raise ValueError(f"{path}: material {material!r} not found in the registry")
+
+    start_time = time.perf_counter()
+    vertices, facets = read_stl(path)
+    vertices = vertices * scale
+    n_facets = len(facets)
+    if decimate is not None:
+        vertices, facets, _ = decimate_mesh(vertices, facets, *decimate)
+
+    # plain nested lists in one conversion each: pyg4ometry indexes the
+    # Freecad mesh per vertex, which is slower on numpy rows
+    solid = g4.solid.TessellatedSolid(
+        f"{name}_s",
+        [vertices.tolist(), facets.tolist()],
+        reg,
+        meshtype=g4.solid.TessellatedSolid.MeshType.Freecad,
+    )
+    lv = g4.LogicalVolume(solid, material, f"{name}_lv", reg)
+
+    if verbose:
+        print(
+            f"[INFO] {path}: {n_facets} facets ({len(facets)} kept), {len(vertices)} vertices "
+            f"in {time.perf_counter() - start_time:.2f} s"
+        )
+    return lv
@@ -0,0 +1,1112 @@
+"""
+Shared helpers for the pyg4ometry geometry builder scripts.
+
+Only the standard library is imported at module level; pyg4ometry,
+legendoptics and friends are imported inside the functions that need them.
+"""
+
+import concurrent.futures
+import contextlib
+import csv
+import hashlib
+import importlib.metadata
+import itertools
+import json
+import os
+import pickle
+import re
+import subprocess
+import sys
+import time
+import tracemalloc
+import xml.etree.ElementTree as ET
+
+# On-disk cache of computed optical property tables
+OPTICS_CACHE_DIR = ".optics_cache"
+
+# Distribution names of packages imported under a different module name
+PACKAGE_DISTRIBUTIONS = {
+    "legendhpges": "legend-pygeom-hpges",
+    "legendoptics": "legend-pygeom-optics",
+    "pygeomtools": "legend-pygeom-tools",
+}
+
+# Set to 1 to also trace Python memory per build stage (BuildProfile); off by
+# default because tracemalloc slows allocation-heavy stages several-fold
+PROFILE_MEMORY_ENV = "PYG4_PROFILE_MEMORY"
+
+# Set to 1 to also record cold import times (BuildProfile.time_imports); off
+# by default because it re-imports the packages in a fresh interpreter
+PROFILE_IMPORTS_ENV = "PYG4_PROFILE_IMPORTS"
+
+# How the builder scripts show the geometry: "interactive" (VTK window),
+# "snapshot" (offscreen PNGs, no window) or "none". Set PYG4_VIEW to override.
+VIEW_MODE_ENV = "PYG4_VIEW"
+
+# Camera (azimuth, elevation) in degrees for snapshot mode; z is drawn upwards
+SNAPSHOT_VIEWS = {
+    "front": (0, 0),
+    "side": (90, 0),
+    "top": (0, 89.9),
+    "iso": (45, 30),
+}
+
+
+# -----------------------------
+# Optical property cache
+# -----------------------------
+# Material methods through which legendoptics attaches optical properties
+_PROPERTY_METHODS = (
+    "addProperty",
+    "addVecProperty",
+    "addConstProperty",
+    "addVecPropertyPint",
+    "addConstPropertyPint",
+)
+
+# Bumped whenever the recorded call format changes (invalidates old entries)
+_OPTICS_CACHE_FORMAT = 2
+
+
+class _MatrixHandle:
+    """Placeholder for the matrix returned by recorded call number `index`."""
+
+    def __init__(self, index):
+        self.index = index
+
+
+class _PropertyRecorder:
+    """
+    Stand-in for a pyg4ometry Material that records every property call.
+    The calls are applied to the real material afterwards (see _apply_calls).
+    Each recorded call returns a _MatrixHandle, so a matrix can be passed on
+    to a later call (e.g. addProperty("SCINTILLATIONCOMPONENT2", matrix)).
+    """
+
+    def __init__(self, material):
+        self._material = material
+        self.calls = []
+
+    def __getattr__(self, name):
+        attr = getattr(self._material, name)
+        if name not in _PROPERTY_METHODS:
+            return attr
+
+        def record(*args, **kwargs):
+            self.calls.append((name, args, kwargs))
+            return _MatrixHandle(len(self.calls) - 1)
+
+        return record
+
+
+def _encode(value):
+    """Turn pint quantities and matrix handles into plain tuples for pickling."""
+    if isinstance(value, _MatrixHandle):
+        return ("__result__", value.index)
+    if hasattr(value, "magnitude") and hasattr(value, "units"):
+        return ("__quantity__", value.magnitude, str(value.units))
+    return value
+
+
+def _decode(value, results):
+    """Inverse of _encode; `results` are the return values of the calls replayed so far."""
+    if isinstance(value, tuple) and len(value) == 2 and value[0] == "__result__":
+        return results[value[1]]
+    if isinstance(value, tuple) and len(value) == 3 and value[0] == "__quantity__":
+        from legendoptics.lar import u
+
+        return u.Quantity(value[1], value[2])
+    return value
+
+
+def package_version(module):
+    """Installed version of the package providing `module` (raises PackageNotFoundError)."""
+    return importlib.metadata.version(PACKAGE_DISTRIBUTIONS.get(module, module))
+
+
+def _cache_token(value):
+    """Stable text form of an attach-function argument for the cache key."""
+    if hasattr(value, "magnitude") and hasattr(value, "units"):
+        return f"{value.magnitude!r} {value.units}"
+    return repr(value)
+
+
+def optics_cache_key(attach, material_name, args=(), kwargs=None):
+    """Content address of an attach call: function, legendoptics version, material, parameters."""
+    key = {
+        "format": _OPTICS_CACHE_FORMAT,
+        "function": f"{attach.__module__}.{attach.__qualname__}",
+        "legendoptics": package_version("legendoptics"),
+        "material": material_name,
+        "args": [_cache_token(a) for a in args],
+        "kwargs": {k: _cache_token(v) for k, v in sorted((kwargs or {}).items())},
+    }
+    return hashlib.sha256(json.dumps(key, sort_keys=True).encode()).hexdigest()
+
+
+def simplify_spectrum(x, y, rtol, atol=0.0):
+    """
+    Indices of the fewest points (greedy) such that linear interpolation
+    through them reproduces every y within max(rtol * |y|, atol). The bound
+    is relative to each sample alone, so large sentinel values elsewhere in
+    the table (e.g. "no absorption" lengths) do not loosen it.
+    `x` must be monotonic; the end points are always kept.
+    """
+    import numpy as np
+
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    n = len(x)
+    if n <= 2:
+        return np.arange(n)
+
+    tolerance = np.maximum(rtol * np.abs(y), atol)
+    keep = [0]
+    i = 0
+    while i < n - 1:
+        j = i + 1
+        # extend the segment i -> j + 1 while it still represents all points in between
+        while j + 1 < n:
+            between = slice(i + 1, j + 1)
+            slope = (y[j + 1] - y[i]) / (x[j + 1] - x[i])
+            interpolated = y[i] + slope * (x[between] - x[i])
+            if np.any(np.abs(interpolated - y[between]) > tolerance[between]):
+                break
+            j += 1
+        keep.append(j)
+        i = j
+    return np.asarray(keep)
+
+
+def _compress_call(material_name, method, args, rtol):
+    """
+    Resample a vector-property call (name, x, y, ...) to simplify_spectrum
+    points. The resampled curve is checked against every original sample;
+    should it miss one by more than rtol, the full table is kept.
+    """
+    import numpy as np
+
+    if method not in ("addVecProperty", "addVecPropertyPint") or len(args) < 3:
+        return args
+    name, x, y = args[:3]
+    x_values = np.asarray(getattr(x, "magnitude", x), dtype=np.float64)
+    y_values = np.asarray(getattr(y, "magnitude", y), dtype=np.float64)
+    if x_values.ndim != 1 or x_values.shape != y_values.shape or len(x_values) <= 2:
+        return args
+    steps = np.diff(x_values)
+    if not (np.all(steps > 0) or np.all(steps < 0)):
+        return args
+
+    keep = simplify_spectrum(x_values, y_values, rtol)
+    order = slice(None) if steps[0] > 0 else slice(None, None, -1)
+    interpolated = np.interp(x_values[order], x_values[keep][order], y_values[keep][order])[order]
+    if np.any(np.abs(interpolated - y_values) > rtol * np.abs(y_values)):
+        print(f"[WARNING] {material_name} {name}: resampled spectrum exceeds rtol={rtol:g}, keeping all points")
+        return args
+    print(
+        f"[INFO] {material_name} {name}: {len(x_values)} -> {len(keep)} points "
+        f"({len(x_values) / len(keep):.1f}x, rtol={rtol:g})"
+    )
+
+    def take(values):
+        return values[keep] if hasattr(values, "magnitude") else np.asarray(values)[keep]
+
+    return (name, take(x), take(y)) + tuple(args[3:])
+
+
+def _apply_calls(mat, calls, rtol=None):
+    """Replay recorded (encoded) property calls onto `mat`, optionally compressing spectra."""
+    results = []
+    for method, call_args, call_kwargs in calls:
+        call_args = [_decode(a, results) for a in call_args]
+        if rtol is not None:
+            call_args = _compress_call(mat.name, method, call_args, rtol)
+        call_kwargs = {k: _decode(v, results) for k, v in call_kwargs.items()}
+        results.append(getattr(mat, method)(*call_args, **call_kwargs))
+
+
+def attach_optics(attach, mat, reg, *args, cache_dir=OPTICS_CACHE_DIR, rtol=None, **kwargs):
+    """
+    Cached replacement for `attach(mat, reg, *args, **kwargs)`, where `attach`
+    is one of the legendoptics pyg4_*_attach_* functions.
+
+    The first call records the properties the function attaches and stores
+    them under a key built from the function, the legendoptics version, the
+    material name and the parameters. Later calls replay the stored tables
+    onto `mat` instead of recomputing them.
+
+    With `rtol`, every vector property is resampled to the fewest points that
+    stay within that relative error (simplify_spectrum) before it is attached;
+    the cache always holds the full tables.
+    """
+    path = os.path.join(cache_dir, f"{optics_cache_key(attach, mat.name, args, kwargs)}.pkl")
+
+    if os.path.exists(path):
+        with open(path, "rb") as f:
+            calls = pickle.load(f)
+        _apply_calls(mat, calls, rtol)
+        return
+
+    recorder = _PropertyRecorder(mat)
+    attach(recorder, reg, *args, **kwargs)
+
+    calls = [
+        (method, [_encode(a) for a in call_args], {k: _encode(v) for k, v in call_kwargs.items()})
+        for method, call_args, call_kwargs in recorder.calls
+    ]
+    _apply_calls(mat, calls, rtol)
+
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        pickle.dump(calls, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
+
+
+# -----------------------------
+# Memoized HPGe construction
+# -----------------------------
+def hpge_cache_key(meta):
+    """Memo key of an HPGe: its canonicalised metadata JSON."""
+    return hashlib.sha256(json.dumps(meta, sort_keys=True, separators=(",", ":")).encode()).hexdigest()
+
+
+def cached_hpge(meta, reg, name):
+    """
+    Memoized `legendhpges.make_hpge(meta, registry=reg, name=name)`: within a
+    registry, identical metadata returns the same logical volume (so `name`
+    only matters for the first call). Nothing is kept across processes, so
+    the exported solids are always the ones legendhpges builds.
+    """
+    key = hpge_cache_key(meta)
+    memo = reg.__dict__.setdefault("_hpge_memo", {})
+    if key not in memo:
+        from legendhpges import make_hpge
+
+        memo[key] = make_hpge(meta, registry=reg, name=name)
+    return memo[key]
+
+
+# -----------------------------
+# Detector registry / remage macros
+# -----------------------------
+# remage detector type names used by /RMG/Geometry/RegisterDetector
+_REMAGE_DETECTOR_TYPES = {
+    "germanium": "Germanium",
+    "scintillator": "Scintillator",
+    "optical": "Optical",
+}
+
+
+def collect_detectors(reg):
+    """
+    Collect every RemageDetectorInfo attached to a physical volume of `reg`
+    as a list of (uid, pv_name, detector_type), sorted by uid.
+
+    This is the single source of truth for detector ids: duplicate uids,
+    unknown detector types and infos attached to logical volumes (which
+    write_pygeom silently ignores) raise a ValueError before anything is
+    exported or simulated.
+    """
+    misplaced = [name for name, lv in reg.logicalVolumeDict.items() if hasattr(lv, "pygeom_active_detector")]
+    if misplaced:
+        raise ValueError(f"Detector info attached to logical volume(s) {misplaced}; attach it to the physical volume")
+
+    detectors, by_uid = [], {}
+    for name, pv in reg.physicalVolumeDict.items():
+        info = getattr(pv, "pygeom_active_detector", None)
+        if info is None:
+            continue
+        if info.detector_type not in _REMAGE_DETECTOR_TYPES:
+            raise ValueError(f"{name}: unknown detector type {info.detector_type!r}")
+        if info.uid in by_uid:
+            raise ValueError(f"Detector uid {info.uid} used by both {by_uid[info.uid]} and {name}")
+        by_uid[info.uid] = name
+        detectors.append((info.uid, name, info.detector_type))
+
+    return sorted(detectors)
+
+
+def restore_detectors(reg):
+    """
+    Move the detector auxiliary structure of a GDML written by write_pygeom
+    back onto its physical volumes (pygeom_active_detector) and drop it from
+    reg.userInfo, so more detectors can be registered and write_pygeom can
+    write the complete structure again. Returns the number of detectors.
+    """
+    from pygeomtools.detectors import AUXKEY_DET, AUXKEY_DETMETA, get_all_sensvols
+
+    if not any(aux.auxtype == AUXKEY_DETMETA for aux in reg.userInfo):
+        return 0
+
+    sensvols = get_all_sensvols(reg)
+    unknown = [name for name in sensvols if name not in reg.physicalVolumeDict]
+    if unknown:
+        raise ValueError(f"Detector auxvals refer to unknown physical volume(s) {unknown}")
+
+    # pygeomtools refuses new detector infos while the structure exists
+    reg.userInfo = [aux for aux in reg.userInfo if aux.auxtype not in (AUXKEY_DET, AUXKEY_DETMETA)]
+    for name, info in sensvols.items():
+        reg.physicalVolumeDict[name].pygeom_active_detector = info
+    return len(sensvols)
+
+
+def detector_macro(detectors):
+    """remage macro lines registering `detectors` (from collect_detectors)."""
+    return "\n".join(
+        f"/RMG/Geometry/RegisterDetector {_REMAGE_DETECTOR_TYPES[det_type]} {name} {uid:03d}"
+        for uid, name, det_type in detectors
+    )
+
+
+def write_detector_macro(reg, path):
+    """
+    Validate the detectors of `reg` and write their registration block to
+    `path`. write_pygeom already embeds the same registration in the GDML
+    (RMG_detector auxiliaries), so this file is only meant for runs whose
+    GDML lacks it -- never include both.
+    """
+    detectors = collect_detectors(reg)
+    with open(path, "w") as f:
+        f.write("# Generated from the geometry build -- do not edit by hand\n")
+        f.write(detector_macro(detectors) + "\n")
+    print(f"[OK] {len(detectors)} detectors registered in {path}")
+    return detectors
+
+
+def macro_registrations(macro_path):
+    """(pv_name, uid) of every RegisterDetector line in a macro, following /control/execute."""
+    registrations = []
+    with open(macro_path) as f:
+        for line in f:
+            words = line.split("#")[0].split()
+            if len(words) >= 4 and words[0] == "/RMG/Geometry/RegisterDetector":
+                registrations.append((words[2], int(words[3])))
+            elif len(words) >= 2 and words[0] == "/control/execute":
+                included = os.path.join(os.path.dirname(macro_path), words[1])
+                registrations += macro_registrations(included)
+    return registrations
+
+
+def validate_run_macro(macro_path, detectors):
+    """
+    Raise a ValueError if the run macro registers a detector twice or again
+    on top of `detectors` (those embedded in the GDML), which otherwise only
+    shows up as an LH5EncodeError after the whole simulation has run.
+    """
+    names = {name for _, name, _ in detectors}
+    uids = {uid for uid, _, _ in detectors}
+    for name, uid in macro_registrations(macro_path):
+        if name in names or uid in uids:
+            raise ValueError(f"{macro_path}: detector {name} (uid {uid}) is registered twice")
+        names.add(name)
+        uids.add(uid)
+
+
+# -----------------------------
+# GDML export with shared includes
+# -----------------------------
+_ENTITY_RE = re.compile(r'<!ENTITY\s+\w+\s+SYSTEM\s+"([^"]+)"')
+_XSI_NAMESPACE = "http://www.w3.org/2001/XMLSchema-instance"
+
+
+def _write_if_changed(path, text):
+    """Atomically write `text` to `path` unless it already holds exactly that; True if written."""
+    if os.path.exists(path):
+        with open(path) as f:
+            if f.read() == text:
+                return False
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+    return True
+
+
+def _shared_include(shared_dir, kind, text):
+    """Write `text` once to <shared_dir>/<kind>_<hash>.xml and return that path."""
+    digest = hashlib.sha256(text.encode()).hexdigest()[:16]
+    path = os.path.join(shared_dir, f"{kind}_{digest}.xml")
+    if not os.path.exists(path):
+        _write_if_changed(path, text)
+    return path
+
+
+def write_gdml_shared(reg, gdml_path, shared_dir):
+    """
+    Export `reg` like pygeomtools.write_pygeom, but move the optical
+    <matrix> defines and the <materials> section into content-addressed
+    include files in `shared_dir` (one per material configuration), pulled
+    in through XML external entities that Geant4's GDML parser resolves.
+    The variant file is only rewritten if its content changed.
+
+    Note: pyg4ometry's own GDML reader does not expand external entities,
+    so read such files back with Geant4 (or use write_pygeom).
+    Returns True if `gdml_path` was (re)written.
+    """
+    import pygeomtools
+    from pyg4ometry.gdml.Defines import Matrix
+
+    os.makedirs(shared_dir, exist_ok=True)
+    tmp_path = f"{gdml_path}.{os.getpid()}.tmp.gdml"
+    pygeomtools.write_pygeom(reg, tmp_path)
+    ET.register_namespace("xsi", _XSI_NAMESPACE)
+    try:
+        root = ET.parse(tmp_path).getroot()
+    finally:
+        os.remove(tmp_path)
+
+    # The include text is serialised from the parsed elements, so it does not
+    # depend on how the writer lays out the file; each include is replaced
+    # by a comment placeholder that becomes the entity reference below.
+    entities = []
+    define = root.find("define")
+    matrices = [] if define is None else define.findall("matrix")
+    if any(isinstance(d, Matrix) for d in reg.defineDict.values()) and not matrices:
+        raise ValueError(f"{gdml_path}: the registry has optical matrices, but none were found in the GDML")
+    if matrices:
+        text = _extract_include(define, matrices, "matrices")
+        entities.append(("matrices", _shared_include(shared_dir, "matrices", text)))
+
+    materials = root.find("materials")
+    if materials is None:
+        raise ValueError(f"{gdml_path}: no <materials> section found in the GDML")
+    text = _extract_include(root, [materials], "materials")
+    entities.append(("materials", _shared_include(shared_dir, "materials", text)))
+
+    gdml_dir = os.path.dirname(os.path.abspath(gdml_path))
+    doctype = "<!DOCTYPE gdml [\n" + "".join(
+        f'\t<!ENTITY {name} SYSTEM "{os.path.relpath(os.path.abspath(path), gdml_dir)}">\n'
+        for name, path in entities
+    ) + "]>\n"
+    body = ET.tostring(root, encoding="unicode")
+    for name, _ in entities:
+        body = body.replace(f"<!--&{name};-->", f"&{name};", 1)
+    return _write_if_changed(gdml_path, '<?xml version="1.0" ?>\n' + doctype + body + "\n")
+
+
+def _extract_include(parent, elements, entity):
+    """
+    Replace `elements` of `parent` by a placeholder for the entity reference
+    and return them as include file text.
+    """
+    placeholder = ET.Comment(f"&{entity};")
+    placeholder.tail = elements[-1].tail
+    parent.insert(list(parent).index(elements[0]), placeholder)
+    for element in elements:
+        parent.remove(element)
+        element.tail = "\n"
+    return "".join(ET.tostring(element, encoding="unicode") for element in elements)
+
+
+def gdml_includes(gdml_path):
+    """Paths of the external entity files (shared includes) a GDML file declares."""
+    with open(gdml_path, errors="replace") as f:
+        head = f.read(1 << 16)
+    gdml_dir = os.path.dirname(os.path.abspath(gdml_path))
+    return [os.path.join(gdml_dir, include) for include in _ENTITY_RE.findall(head)]
+
+
+# -----------------------------
+# Position tables for detector arrays
+# -----------------------------
+POSITION_COLUMNS = ("name", "type", "x", "y", "z")
+
+
+def load_positions(table):
+    """
+    Read a detector position table: a CSV file with the columns
+    name,type,x,y,z (cm) or an iterable of rows in that order.
+    Returns a list of (name, type, (x, y, z)); names must be unique.
+    """
+    if isinstance(table, (str, os.PathLike)):
+        with open(table, newline="") as f:
+            rows = [[row[c] for c in POSITION_COLUMNS] for row in csv.DictReader(f)]
+    else:
+        rows = list(table)
+
+    positions, names = [], set()
+    for name, det_type, x, y, z in rows:
+        name = str(name).strip()
+        if name in names:
+            raise ValueError(f"Duplicate position name {name!r}")
+        names.add(name)
+        positions.append((name, str(det_type).strip(), (float(x), float(y), float(z))))
+    return positions
+
+
+def write_positions(positions, path):
+    """Write (name, type, (x, y, z)) rows as a CSV position table."""
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(POSITION_COLUMNS)
+        for name, det_type, (x, y, z) in positions:
+            writer.writerow([name, det_type, x, y, z])
+
+
+# -----------------------------
+# Parametric geometry sweeps
+# -----------------------------
+def parameter_grid(grid):
+    """Expand {"name": [values, ...]} into a list of parameter dicts (all combinations)."""
+    names = sorted(grid)
+    return [dict(zip(names, values)) for values in itertools.product(*(grid[n] for n in names))]
+
+
+def variant_name(params, prefix="variant"):
+    """File stem of one sweep variant, e.g. variant_margin0.1_thickness0.2."""
+    return "_".join([prefix] + [f"{k}{v}" for k, v in sorted(params.items())])
+
+
+def _variant_done(meta_path, params):
+    """
+    True if `meta_path` records `params` and the variant is complete: either
+    rejected for overlaps, or its GDML and every shared include it
+    references exist. Paths are resolved against the metadata directory.
+    """
+    if not os.path.exists(meta_path):
+        return False
+    with open(meta_path) as f:
+        meta = json.load(f)
+    if meta.get("params") != params:
+        return False
+    if meta.get("overlaps"):
+        return True
+    if not meta.get("gdml"):
+        return False
+    gdml_path = os.path.join(os.path.dirname(os.path.abspath(meta_path)), meta["gdml"])
+    if not os.path.exists(gdml_path):
+        return False
+    return all(os.path.exists(include) for include in gdml_includes(gdml_path))
+
+
+def build_variant(build, params, gdml_path, meta_path, check_lv="LAr_lv", shared_dir=None):
+    """
+    Worker: build one registry with `build(**params)`, write it to
+    `gdml_path` and its parameters and build time to `meta_path`.
+    Variants with overlaps below `check_lv` are not exported; the
+    overlaps are recorded in the metadata instead. The detector
+    registration macro is written next to the GDML. With `shared_dir`
+    materials and optical matrices go to shared includes (write_gdml_shared).
+    """
+    import pygeomtools
+
+    start_time = time.perf_counter()
+    reg = build(**params)
+
+    overlaps = []
+    if check_lv is not None:
+        overlaps = check_overlaps(reg.logicalVolumeDict[check_lv], verbose=False)
+    if not overlaps:
+        write_detector_macro(reg, os.path.splitext(gdml_path)[0] + ".detectors.mac")
+        if shared_dir is None:
+            pygeomtools.write_pygeom(reg, gdml_path)
+        else:
+            write_gdml_shared(reg, gdml_path, shared_dir)
+
+    meta = {
+        "params": params,
+        # relative to the metadata file, so the sweep directory can be moved
+        "gdml": None if overlaps else os.path.relpath(gdml_path, os.path.dirname(os.path.abspath(meta_path))),
+        "overlaps": overlaps,
+        "build_seconds": time.perf_counter() - start_time,
+    }
+    with open(meta_path, "w") as f:
+        json.dump(meta, f, indent=2)
+    return meta
+
+
+def run_sweep(build, grid, outdir, max_workers=None, prefix="variant", shared_dir=None, mp_context=None):
+    """
+    Build every parameter combination of `grid` with `build(**params)` in a
+    process pool, one variant per worker task. Each variant is written to
+    <outdir>/<name>.gdml plus <name>.json; variants whose metadata already
+    matches are skipped. `build` must be importable (a module-level function).
+    `shared_dir` enables shared material/optics includes for all variants.
+    `mp_context` selects the worker start method (e.g. a "spawn" context
+    for a parent that already runs library threads, which a fork can
+    deadlock). Returns the metadata of all variants.
+    """
+    os.makedirs(outdir, exist_ok=True)
+
+    results, todo, failed, rejected = [], [], [], []
+    for params in parameter_grid(grid):
+        name = variant_name(params, prefix)
+        gdml_path = os.path.join(outdir, f"{name}.gdml")
+        meta_path = os.path.join(outdir, f"{name}.json")
+        if _variant_done(meta_path, params):
+            print(f"[SKIP] {name} already built")
+            with open(meta_path) as f:
+                results.append(json.load(f))
+        else:
+            todo.append((name, params, gdml_path, meta_path))
+
+    start_time = time.perf_counter()
+    with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers, mp_context=mp_context) as pool:
+        futures = {
+            pool.submit(build_variant, build, params, gdml_path, meta_path, shared_dir=shared_dir): name
+            for name, params, gdml_path, meta_path in todo
+        }
+        for i, future in enumerate(concurrent.futures.as_completed(futures), start=1):
+            name = futures[future]
+            try:
+                meta = future.result()
+            except Exception as e:
+                print(f"[{i}/{len(todo)}] [FAIL] {name}: {e}")
+                failed.append(name)
+                continue
+            results.append(meta)
+            if meta["overlaps"]:
+                print(f"[{i}/{len(todo)}] [OVERLAP] {name}: {len(meta['overlaps'])} overlaps, not exported")
+                rejected.append(name)
+                continue
+            print(f"[{i}/{len(todo)}] [OK] {name} built in {meta['build_seconds']:.1f} s")
+
+    n_skipped = len(results) - len(todo) + len(failed)
+    print(
+        f"[OK] Sweep finished in {time.perf_counter() - start_time:.1f} s: "
+        f"{len(todo) - len(failed) - len(rejected)} built, {n_skipped} skipped, "
+        f"{len(rejected)} rejected (overlaps), {len(failed)} failed"
+    )
+    return results
+
+
+# -----------------------------
+# Build profiling
+# -----------------------------
+class BuildProfile:
+    """
+    Wall time of named build stages, plus the process RSS high-water mark
+    (which includes C/VTK allocations). The OS only reports the peak over the
+    whole process lifetime, so each stage records that running peak at its
+    end and how much the stage raised it; a stage that stays below an earlier
+    peak shows no growth whatever it allocated. Stages may be nested.
+
+    `memory=True` (default: $PYG4_PROFILE_MEMORY == "1") additionally
+    traces the Python heap peak of every stage with tracemalloc, where a
+    parent's peak includes its children's. Tracing slows allocation-heavy
+    stages considerably, so the profile records whether it was on and its
+    timings should not be compared with untraced ones. `imports=True`
+    (default: $PYG4_PROFILE_IMPORTS == "1") enables time_imports.
+
+        profile = BuildProfile()
+        with profile.stage("materials"):
+            ...
+        profile.write("geometry.gdml")   # -> geometry.profile.json
+    """
+
+    def __init__(self, memory=None, imports=None):
+        if memory is None:
+            memory = os.environ.get(PROFILE_MEMORY_ENV) == "1"
+        if imports is None:
+            imports = os.environ.get(PROFILE_IMPORTS_ENV) == "1"
+        self.memory = memory
+        self.imports = imports
+        self.stages = []
+        self._stack = []
+        self._start = time.perf_counter()
+        if memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        if self.memory:
+            if self._stack:
+                self._stack[-1]["peak"] = max(self._stack[-1]["peak"], tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+        entry = {"name": "/".join([s["name"] for s in self._stack] + [name]), "peak": 0, "rss": _peak_rss_mb()}
+        self._stack.append(entry)
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start_time
+            self._stack.pop()
+            record = {"stage": entry["name"], "seconds": round(seconds, 4)}
+            rss = _peak_rss_mb()
+            if rss is not None:
+                record["running_peak_rss_mb"] = rss
+                record["peak_rss_growth_mb"] = round(rss - entry["rss"], 1)
+            if self.memory:
+                peak = max(entry["peak"], tracemalloc.get_traced_memory()[1])
+                if self._stack:
+                    self._stack[-1]["peak"] = max(self._stack[-1]["peak"], peak)
+                record["traced_peak_mb"] = round(peak / 2**20, 2)
+            self.stages.append(record)
+            rss_note = "" if rss is None else f" (running peak RSS {rss:.0f} MB, +{rss - entry['rss']:.0f} MB)"
+            print(f"[INFO] {entry['name']}: {seconds:.2f} s{rss_note}")
+
+    def time_imports(self, modules):
+        """
+        Cold import time of `modules`, measured in a fresh interpreter (they
+        are usually already imported by the time a profile exists). That
+        costs the full import time once more, so nothing is done unless the
+        profile was created with `imports=True`.
+        """
+        if not self.imports:
+            return
+        code = (
+            "import importlib, json, time\n"
+            "times = {}\n"
+            f"for name in {list(modules)!r}:\n"
+            "    t = time.perf_counter()\n"
+            "    importlib.import_module(name)\n"
+            "    times[name] = time.perf_counter() - t\n"
+            "print(json.dumps(times))\n"
+        )
+        result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True)
+        if result.returncode != 0:
+            print(f"[WARNING] Could not time imports: {result.stderr.strip().splitlines()[-1:]}")
+            return
+        for name, seconds in json.loads(result.stdout.strip().splitlines()[-1]).items():
+            self.stages.append({"stage": f"import/{name}", "seconds": round(seconds, 4)})
+
+    def write(self, gdml_path):
+        """Write the profile to <gdml stem>.profile.json next to the GDML file."""
+        path = os.path.splitext(gdml_path)[0] + ".profile.json"
+        profile = {
+            "gdml": os.path.basename(gdml_path),
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": sys.version.split()[0],
+            "packages": {},
+            "memory_traced": self.memory,
+            "total_seconds": round(time.perf_counter() - self._start, 4),
+            "stages": self.stages,
+        }
+        for package in ("pyg4ometry", "legendhpges", "legendoptics", "pygeomtools"):
+            try:
+                profile["packages"][package] = package_version(package)
+            except importlib.metadata.PackageNotFoundError:
+                print(f"[WARNING] Version of {package} not found (distribution {PACKAGE_DISTRIBUTIONS.get(package, package)!r})")
+                profile["packages"][package] = None
+        with open(path, "w") as f:
+            json.dump(profile, f, indent=2)
+        print(f"[OK] Build profile written to {path}")
+        return path
+
+
+def _peak_rss_mb():
+    """Peak resident set size of this process so far in MB, or None where unavailable."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return round(peak / (2**20 if sys.platform == "darwin" else 2**10), 1)
+
+
+def profile_stage(profile, name):
+    """`profile.stage(name)`, or a no-op when profiling is off (profile is None)."""
+    return contextlib.nullcontext() if profile is None else profile.stage(name)
+
+
+# -----------------------------
+# Geometry viewing
+# -----------------------------
+def show_geometry(
+    reg,
+    material_vis_options=None,
+    snapshot_prefix="geometry",
+    multisamples=None,
+    logical_volumes=None,
+    mode=None,
+    views=None,
+    size=(1200, 900),
+):
+    """
+    Show the geometry of `reg` according to `mode` (default: $PYG4_VIEW, else
+    "interactive"):
+
+    - "interactive": the usual blocking VTK window
+    - "snapshot": render `views` offscreen to <snapshot_prefix>_<view>.png
+    - "none": do nothing (pure batch builds)
+
+    With `material_vis_options` a VtkViewerColoured is used, else a plain
+    VtkViewer. `logical_volumes` defaults to the world volume and
+    `multisamples` sets the anti-aliasing of the render window.
+    Call this after writing the GDML so the export never waits on the GUI.
+    """
+    mode = mode or os.environ.get(VIEW_MODE_ENV, "interactive")
+    if mode == "none":
+        return
+    if mode not in ("interactive", "snapshot"):
+        raise ValueError(f"unknown view mode '{mode}' (expected interactive, snapshot or none)")
+
+    import pyg4ometry.visualisation as vis
+
+    if material_vis_options is not None:
+        viewer = vis.VtkViewerColoured(materialVisOptions=material_vis_options)
+    else:
+        viewer = vis.VtkViewer()
+    if multisamples is not None:
+        viewer.renWin.SetMultiSamples(multisamples)  # anti-aliasing
+    # volumes read through gdml_tools.read_registries are not meshed yet
+    for lv in reg.logicalVolumeDict.values():
+        if getattr(lv, "mesh", None) is None:
+            lv.reMesh()
+    for lv in logical_volumes if logical_volumes is not None else [reg.getWorldVolume()]:
+        viewer.addLogicalVolume(lv)
+
+    if mode == "interactive":
+        viewer.view()
+        return
+
+    render_snapshots(viewer, snapshot_prefix, views or SNAPSHOT_VIEWS, size)
+
+
+def render_snapshots(viewer, prefix, views=None, size=(1200, 900)):
+    """Render a filled pyg4ometry viewer offscreen, one PNG per camera view."""
+    import vtk
+
+    ren, ren_win = viewer.ren, viewer.renWin
+    ren_win.SetOffScreenRendering(1)
+    ren_win.SetSize(*size)
+    if ren.GetActors().GetNumberOfItems() == 0 and hasattr(viewer, "buildPipelinesAppend"):
+        # Newer pyg4ometry only creates the actors when the viewer is shown
+        viewer.buildPipelinesAppend()
+
+    paths = []
+    for name, (azimuth, elevation) in (views or SNAPSHOT_VIEWS).items():
+        camera = ren.GetActiveCamera()
+        camera.SetFocalPoint(0, 0, 0)
+        camera.SetPosition(0, -1, 0)
+        camera.SetViewUp(0, 0, 1)
+        camera.Azimuth(azimuth)
+        camera.Elevation(elevation)
+        camera.OrthogonalizeViewUp()
+        ren.ResetCamera()
+        ren_win.Render()
+
+        image = vtk.vtkWindowToImageFilter()
+        image.SetInput(ren_win)
+        image.ReadFrontBufferOff()
+        image.Update()
+
+        path = f"{prefix}_{name}.png"
+        writer = vtk.vtkPNGWriter()
+        writer.SetFileName(path)
+        writer.SetInputConnection(image.GetOutputPort())
+        writer.Write()
+        paths.append(path)
+        print(f"[OK] Snapshot written to: {path}")
+
+    return paths
+
+
+# -----------------------------
+# Fast overlap / extrusion check
+# -----------------------------
+def solid_triangles(solid):
+    """Triangles (n, 3, 3) in mm of the tessellated mesh of a pyg4ometry solid."""
+    import numpy as np
+
+    vertices, polygons, _ = solid.mesh().toVerticesAndPolygons()
+    vertices = np.asarray(vertices, dtype=np.float64)
+    triangles = [
+        (polygon[0], polygon[i], polygon[i + 1])
+        for polygon in polygons
+        for i in range(1, len(polygon) - 1)
+    ]
+    return vertices[np.asarray(triangles, dtype=np.int64)]
+
+
+def placed_triangles(pv):
+    """Triangles of a daughter volume transformed into its mother's frame."""
+    import numpy as np
+    from pyg4ometry import transformation
+
+    rotation = np.linalg.inv(transformation.tbxyz2matrix(pv.rotation.eval()))
+    translation = np.asarray(pv.position.eval(), dtype=np.float64)
+    triangles = solid_triangles(pv.logicalVolume.solid)
+    return triangles @ np.asarray(rotation).T + translation
+
+
+def sample_surface(triangles, n_samples, rng):
+    """Area-weighted random points on a triangle mesh, plus all its vertices."""
+    import numpy as np
+
+    a, b, c = triangles[:, 0], triangles[:, 1], triangles[:, 2]
+    area = 0.5 * np.linalg.norm(np.cross(b - a, c - a), axis=1)
+    picked = rng.choice(len(triangles), size=n_samples, p=area / area.sum())
+    u, v = rng.random(n_samples), rng.random(n_samples)
+    flip = u + v > 1
+    u[flip], v[flip] = 1 - u[flip], 1 - v[flip]
+    points = a[picked] + u[:, None] * (b - a)[picked] + v[:, None] * (c - a)[picked]
+    return np.concatenate([points, triangles.reshape(-1, 3)])
+
+
+def points_inside(points, triangles, max_pairs=4_000_000):
+    """
+    Vectorised ray-parity test: True for points inside the closed triangle
+    mesh. Rays go along a slightly tilted +z axis to avoid hitting edges.
+    """
+    import numpy as np
+
+    direction = np.array([1e-4, 2e-4, 1.0])
+    direction /= np.linalg.norm(direction)
+
+    v0 = triangles[:, 0]
+    e1 = triangles[:, 1] - v0
+    e2 = triangles[:, 2] - v0
+    h = np.cross(direction, e2)
+    det = np.einsum("ij,ij->i", e1, h)
+    ok = np.abs(det) > 1e-12
+    v0, e1, e2, h, det = v0[ok], e1[ok], e2[ok], h[ok], det[ok]
+    inv_det = 1.0 / det
+
+    inside = np.zeros(len(points), dtype=bool)
+    step = max(1, max_pairs // max(len(v0), 1))
+    for start in range(0, len(points), step):
+        p = points[start : start + step, None, :]
+        s = p - v0
+        u = np.einsum("nmk,mk->nm", s, h) * inv_det
+        q = np.cross(s, e1)
+        v = np.einsum("k,nmk->nm", direction, q) * inv_det
+        t = np.einsum("mk,nmk->nm", e2, q) * inv_det
+        hits = (u >= 0) & (v >= 0) & (u + v <= 1) & (t > 0)
+        inside[start : start + step] = hits.sum(axis=1) % 2 == 1
+    return inside
+
+
+def _closest_points(p, a, b, c):
+    """
+    Closest point on triangle (a, b, c) to p, row by row (all (k, 3)); the
+    Voronoi-region method of Ericson, Real-Time Collision Detection, 5.1.5.
+    """
+    import numpy as np
+
+    def dot(u, v):
+        return np.einsum("ij,ij->i", u, v)
+
+    ab, ac, ap, bp, cp = b - a, c - a, p - a, p - b, p - c
+    d1, d2 = dot(ab, ap), dot(ac, ap)
+    d3, d4 = dot(ab, bp), dot(ac, bp)
+    d5, d6 = dot(ab, cp), dot(ac, cp)
+    va, vb, vc = d3 * d6 - d5 * d4, d5 * d2 - d1 * d6, d1 * d4 - d3 * d2
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        denom = va + vb + vc
+        closest = a + ab * (vb / denom)[:, None] + ac * (vc / denom)[:, None]
+        # edges and corners, lowest priority first so the checks of the
+        # reference implementation win in its order
+        regions = [
+            ((va <= 0) & (d4 - d3 >= 0) & (d5 - d6 >= 0), b + (c - b) * ((d4 - d3) / ((d4 - d3) + (d5 - d6)))[:, None]),
+            ((vb <= 0) & (d2 >= 0) & (d6 <= 0), a + ac * (d2 / (d2 - d6))[:, None]),
+            ((d6 >= 0) & (d5 <= d6), c),
+            ((vc <= 0) & (d1 >= 0) & (d3 <= 0), a + ab * (d1 / (d1 - d3))[:, None]),
+            ((d3 >= 0) & (d4 <= d3), b),
+            ((d1 <= 0) & (d2 <= 0), a),
+        ]
+    for mask, point in regions:
+        closest = np.where(mask[:, None], point, closest)
+    return closest
+
+
+def surface_distance(points, triangles, max_pairs=4_000_000):
+    """
+    Exact distance (mm) from each point to a triangle mesh. The distance to
+    the nearest triangle centroid bounds the result from above, so only the
+    triangles whose bounding box lies within that bound are evaluated.
+    """
+    import numpy as np
+
+    lo, hi = triangles.min(axis=1), triangles.max(axis=1)
+    centroids = triangles.mean(axis=1)
+    distance = np.empty(len(points))
+    step = max(1, max_pairs // max(len(triangles), 1))
+    for start in range(0, len(points), step):
+        p = points[start : start + step]
+        d = p[:, None, :] - centroids[None, :, :]
+        bound = np.sqrt(np.einsum("nmk,nmk->nm", d, d).min(axis=1))
+        # distance from each point to each triangle's bounding box
+        gap = np.maximum(lo[None] - p[:, None], 0) + np.maximum(p[:, None] - hi[None], 0)
+        point_idx, tri_idx = np.nonzero(np.einsum("nmk,nmk->nm", gap, gap) <= bound[:, None] ** 2)
+
+        tri = triangles[tri_idx]
+        closest = _closest_points(p[point_idx], tri[:, 0], tri[:, 1], tri[:, 2])
+        pair_distance = np.linalg.norm(p[point_idx] - closest, axis=1)
+        # degenerate (zero-area) triangles fall back to their corners
+        bad = ~np.isfinite(pair_distance)
+        if bad.any():
+            pair_distance[bad] = np.linalg.norm(tri[bad] - p[point_idx][bad][:, None], axis=2).min(axis=1)
+
+        chunk = bound.copy()
+        np.minimum.at(chunk, point_idx, pair_distance)
+        distance[start : start + step] = chunk
+    return distance
+
+
+def check_overlaps(mother_lv, n_samples=2000, tolerance=0.01, seed=0, verbose=True):
+    """
+    Fast pre-export check of the daughters of `mother_lv` (e.g. LAr_lv):
+    overlaps between sibling volumes and extrusions out of the mother.
+
+    Each daughter's mesh surface is sampled (area weighted), pairs are culled
+    by their bounding boxes, and the sampled points are tested against the
+    other meshes with a vectorised ray-parity test. The reported depth is
+    the largest exact distance (mm) of an offending point from the other
+    mesh surface (surface_distance); points closer than `tolerance` (mm)
+    count as touching.
+
+    Returns a list of {"kind", "volumes", "n_points", "max_depth_mm"}.
+    """
+    import numpy as np
+
+    start_time = time.perf_counter()
+    rng = np.random.default_rng(seed)
+
+    mother = solid_triangles(mother_lv.solid)
+
+    daughters = []
+    for pv in mother_lv.daughterVolumes:
+        triangles = placed_triangles(pv)
+        points = sample_surface(triangles, n_samples, rng)
+        daughters.append((pv.name, triangles, points, points.min(axis=0), points.max(axis=0)))
+
+    issues = []
+
+    def report(kind, names, depth):
+        depth = depth[depth > tolerance]
+        if len(depth) > 0:
+            issues.append(
+                {"kind": kind, "volumes": names, "n_points": int(len(depth)), "max_depth_mm": float(depth.max())}
+            )
+
+    # Extrusions: daughter surface points outside the mother
+    for name, _, points, _, _ in daughters:
+        outside = ~points_inside(points, mother)
+        if outside.any():
+            report("extrusion", [name, mother_lv.name], surface_distance(points[outside], mother))
+
+    # Overlaps: surface points of one sibling inside another (both directions)
+    for i, (name_a, tri_a, pts_a, lo_a, hi_a) in enumerate(daughters):
+        for name_b, tri_b, pts_b, lo_b, hi_b in daughters[i + 1 :]:
+            if np.any(lo_a > hi_b + tolerance) or np.any(lo_b > hi_a + tolerance):
+                continue  # bounding boxes do not touch
+
+            depth = []
+            for points, triangles, lo, hi in (
+                (pts_a, tri_b, lo_b, hi_b),
+                (pts_b, tri_a, lo_a, hi_a),
+            ):
+                candidates = points[np.all((points >= lo - tolerance) & (points <= hi + tolerance), axis=1)]
+                if len(candidates) == 0:
+                    continue
+                inside = points_inside(candidates, triangles)
+                if inside.any():
+                    depth.append(surface_distance(candidates[inside], triangles))
+            if depth:
+                depth = np.concatenate(depth)
+                report("overlap", [name_a, name_b], depth)
+
+    if verbose:
+        elapsed = time.perf_counter() - start_time
+        print(f"[INFO] Overlap check of {mother_lv.name}: {len(daughters)} daughters in {elapsed:.2f} s")
+        for issue in issues:
+            print(
+                f"[WARNING] {issue['kind']}: {' / '.join(issue['volumes'])} "
+                f"({issue['n_points']} points, up to {issue['max_depth_mm']:.3f} mm)"
+            )
+
+    return issues
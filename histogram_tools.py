@@ -0,0 +1,806 @@
+"""
+Helpers for reducing remage stp output into histograms.
+
+The functions here never hold a whole stp table in memory: the tables are
+read in fixed-size row chunks and histograms are filled incrementally, so
+peak memory is set by the chunk size and not by the size of the file.
+"""
+
+import contextlib
+import concurrent.futures
+import hashlib
+import json
+import os
+import pickle
+import time
+import zlib
+
+import awkward as ak
+import h5py
+import hist
+import numpy as np
+from lgdo import lh5
+
+# Rows (events) read per chunk in streaming mode
+DEFAULT_CHUNK_SIZE = 100_000
+
+# On-disk histogram cache location and size limit
+HIST_CACHE_DIR = ".hist_cache"
+HIST_CACHE_MAX_BYTES = 2 * 1024**3
+
+# Metadata file marking a flat (memory-mapped) stp cache directory
+FLAT_META_FILE = "flat_cache.json"
+
+
+# ---------------------------
+# Axes
+# ---------------------------
+def energy_axis(n_bins=2200, low=0, high=2200):
+    """Default 1 keV energy axis used for all spectra."""
+    return hist.axis.Regular(n_bins, low, high, name="energy [keV]")
+
+
+def wavelength_axis(n_bins=120, low=100, high=700):
+    """Default optical photon wavelength axis."""
+    return hist.axis.Regular(n_bins, low, high, name="wavelength [nm]")
+
+
+def time_axis(n_bins=200, low=0, high=1000):
+    """Default optical photon arrival time axis."""
+    return hist.axis.Regular(n_bins, low, high, name="time [ns]")
+
+
+def photon_count_axis(high=100):
+    """Default detected photons per event axis."""
+    return hist.axis.Integer(0, high, name="photons / event")
+
+
+# ---------------------------
+# Reading
+# ---------------------------
+def open_lh5(lh5_file):
+    """
+    Context manager returning an open h5py file. An already open file is
+    passed through untouched, so helpers can share a single handle; so is a
+    flat-cache directory (see convert_to_flat).
+    """
+    if isinstance(lh5_file, h5py.File) or is_flat_cache(lh5_file):
+        return contextlib.nullcontext(lh5_file)
+    return h5py.File(lh5_file, "r")
+
+
+def read_columns(lh5_file, columns, n_rows=None):
+    """
+    Read only the requested fields of several stp tables in one pass.
+
+    `columns` maps detector ids to the list of fields to read, e.g.
+    {"det001": ["xloc", "zloc"], "det007": ["wavelength", "time"]}.
+    `n_rows` limits the number of events read, either for all detectors
+    (int) or per detector id (dict). The file is opened once and the
+    columns are returned as {detid: ak.Array with the requested fields}.
+    """
+    data = {}
+    with open_lh5(lh5_file) as f:
+        for detid, fields in columns.items():
+            limit = n_rows.get(detid) if isinstance(n_rows, dict) else n_rows
+            if is_flat_cache(f):
+                data[detid] = read_flat_table(f, detid, fields, 0, limit)
+                continue
+            kwargs = {} if limit is None else {"n_rows": limit}
+            data[detid] = lh5.read(
+                f"stp/{detid}", f, field_mask=list(fields), **kwargs
+            ).view_as("ak")
+    return data
+
+
+def iter_chunks(name, lh5_file="output.lh5", chunk_size=DEFAULT_CHUNK_SIZE, field_mask=None):
+    """
+    Yield consecutive row chunks of the LH5 object `name` as awkward arrays.
+    Only `chunk_size` rows are decoded at a time; for tables `field_mask`
+    restricts the fields that are read.
+    """
+    if is_flat_cache(lh5_file):
+        yield from iter_flat_chunks(name, lh5_file, chunk_size, field_mask)
+        return
+
+    kwargs = {} if field_mask is None else {"field_mask": list(field_mask)}
+    with open_lh5(lh5_file) as f:
+        n_rows = lh5.read_n_rows(name, f)
+        for start in range(0, n_rows, chunk_size):
+            yield lh5.read_as(
+                name, f, "ak", start_row=start, n_rows=min(chunk_size, n_rows - start), **kwargs
+            )
+
+
+# ---------------------------
+# Histogram cache
+# ---------------------------
+def file_fingerprint(path, n_samples=16, block_size=64 * 1024):
+    """
+    Cheap content fingerprint of a (possibly huge) file: size, modification
+    time and a hash of `n_samples` blocks spread evenly over the file.
+    """
+    size = os.path.getsize(path)
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for i in range(n_samples):
+            f.seek(size * i // n_samples)
+            digest.update(f.read(block_size))
+    return {"size": size, "mtime_ns": os.stat(path).st_mtime_ns, "sha256": digest.hexdigest()}
+
+
+def source_fingerprint(lh5_file):
+    """
+    file_fingerprint of an output file (path or open h5py file); a flat
+    cache has the fingerprint of the file it was made from.
+    """
+    path = lh5_file.filename if isinstance(lh5_file, h5py.File) else lh5_file
+    if is_flat_cache(path):
+        with open(os.path.join(path, FLAT_META_FILE)) as f:
+            return json.load(f)["fingerprint"]
+    return file_fingerprint(path)
+
+
+def histogram_cache_key(lh5_file, detids, field, axis, extra=None):
+    """
+    Cache key from the output-file fingerprint, detectors, field and axis.
+    Binning that is not a single predefined axis goes into `extra`.
+    `lh5_file` may also be a list of files (one fingerprint each).
+    """
+    if isinstance(lh5_file, (list, tuple)):
+        fingerprint = [source_fingerprint(path) for path in lh5_file]
+    else:
+        fingerprint = source_fingerprint(lh5_file)
+    key = {
+        "file": fingerprint,
+        "detids": list(detids),
+        "field": field,
+        "axis": None if axis is None else [type(axis).__name__, axis.name, axis.edges.tolist()],
+        "extra": extra,
+    }
+    return hashlib.sha256(json.dumps(key, sort_keys=True).encode()).hexdigest()
+
+
+def evict_histogram_cache(cache_dir=HIST_CACHE_DIR, max_bytes=HIST_CACHE_MAX_BYTES):
+    """
+    Delete least recently used cache entries until the cache fits `max_bytes`.
+    Safe to run from several processes at once: entries another process
+    already removed are skipped.
+    """
+    entries = []
+    for name in os.listdir(cache_dir):
+        if name.endswith(".pkl"):
+            try:
+                st = os.stat(os.path.join(cache_dir, name))
+            except FileNotFoundError:
+                continue
+            entries.append((st.st_mtime, st.st_size, name))
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, name in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(os.path.join(cache_dir, name))
+        except FileNotFoundError:
+            pass
+        total -= size
+
+
+def cache_lookup(key, cache_dir=HIST_CACHE_DIR):
+    """
+    The histogram stored under `key`, or None if there is none. Hits
+    refresh the entry's mtime, which drives LRU eviction.
+    """
+    path = os.path.join(cache_dir, f"{key}.pkl")
+    try:
+        with open(path, "rb") as f:
+            h = pickle.load(f)
+    except FileNotFoundError:
+        # not cached yet, or evicted by another process in the meantime
+        return None
+    with contextlib.suppress(FileNotFoundError):
+        os.utime(path)
+    return h
+
+
+def cached_histogram(key, fill, cache_dir=HIST_CACHE_DIR, max_bytes=HIST_CACHE_MAX_BYTES):
+    """
+    Return the histogram stored under `key` (see cache_lookup), or build
+    it with `fill()` and store it.
+    """
+    h = cache_lookup(key, cache_dir)
+    if h is not None:
+        return h
+
+    path = os.path.join(cache_dir, f"{key}.pkl")
+    h = fill()
+
+    # written under a unique temporary name and renamed, so concurrent
+    # workers never see (or evict) a half-written entry
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        pickle.dump(h, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
+    evict_histogram_cache(cache_dir, max_bytes)
+
+    return h
+
+
+# ---------------------------
+# Detector response
+# ---------------------------
+def file_seed(lh5_file):
+    """
+    Per-file part of the response seed, from the content hash of the file
+    (source_fingerprint): outputs of a job array get their own noise
+    sequence even when they share a file name, and a flat cache the same
+    one as its source file.
+    """
+    return int(source_fingerprint(lh5_file)["sha256"][:16], 16)
+
+
+def response_rng(seed, detid, start_row, file_part):
+    """
+    Random generator for one chunk. Seeded from (seed, file, detector, first
+    row), so a smeared spectrum is reproducible for a given seed and chunk
+    size, and independent between files; `file_part` is file_seed(file).
+    """
+    return np.random.default_rng([seed, file_part, zlib.crc32(detid.encode()), start_row])
+
+
+def apply_response(energy, response, rng):
+    """
+    Smear the per-event energies (keV) with a Gaussian of width
+    sigma(E) = sqrt(a^2 + b^2 E + c^2 E^2) and drop events below the
+    threshold. `response` is a dict with keys "a", "b", "c" (keV, sqrt(keV),
+    dimensionless; missing ones count as 0) and "threshold" (keV).
+    """
+    energy = np.asarray(energy, dtype=np.float64)
+    sigma = np.sqrt(
+        response.get("a", 0.0) ** 2
+        + response.get("b", 0.0) ** 2 * np.clip(energy, 0, None)
+        + response.get("c", 0.0) ** 2 * energy**2
+    )
+    smeared = energy + sigma * rng.standard_normal(len(energy))
+    return smeared[smeared >= response.get("threshold", 0.0)]
+
+
+# ---------------------------
+# Streaming energy spectra
+# ---------------------------
+def edep_cache_key(
+    detids, lh5_file="output.lh5", axis=None, chunk_size=DEFAULT_CHUNK_SIZE, response=None, seed=0, **kwargs
+):
+    """Cache key of fill_edep_streaming with the same arguments (other keyword arguments are ignored)."""
+    axis = axis if axis is not None else energy_axis()
+    extra = "sum"
+    if response is not None:
+        extra = {
+            "reduction": "sum",
+            "response": response,
+            "seed": [seed, file_seed(lh5_file)],
+            "chunk_size": chunk_size,
+        }
+    return histogram_cache_key(lh5_file, detids, "edep", axis, extra=extra)
+
+
+def fill_edep_streaming(
+    detids,
+    lh5_file="output.lh5",
+    axis=None,
+    chunk_size=DEFAULT_CHUNK_SIZE,
+    cache_dir=None,
+    response=None,
+    seed=0,
+):
+    """
+    Fill the per-event summed energy deposition of `detids` into a histogram,
+    one chunk of events at a time. Prints the achieved throughput.
+    If `response` is given (see apply_response) the energies are smeared and
+    thresholded with a generator seeded from `seed` before filling.
+    If `cache_dir` is given the result is cached on disk.
+    """
+    axis = axis if axis is not None else energy_axis()
+    if cache_dir is not None:
+        key = edep_cache_key(detids, lh5_file, axis, chunk_size, response=response, seed=seed)
+        return cached_histogram(
+            key,
+            lambda: fill_edep_streaming(
+                detids, lh5_file, axis, chunk_size, response=response, seed=seed
+            ),
+            cache_dir,
+        )
+
+    h = hist.Hist(axis, storage=hist.storage.Double())
+
+    n_events = 0
+    start_time = time.perf_counter()
+    with open_lh5(lh5_file) as f:
+        file_part = file_seed(f) if response is not None else None
+        for detid in detids:
+            start_row = 0
+            for edep in iter_chunks(f"stp/{detid}/edep", f, chunk_size):
+                # Sum over steps per event
+                energy = ak.to_numpy(ak.sum(edep, axis=-1))
+                if response is not None:
+                    energy = apply_response(energy, response, response_rng(seed, detid, start_row, file_part))
+                h.fill(energy)
+                n_events += len(edep)
+                start_row += len(edep)
+
+    elapsed = time.perf_counter() - start_time
+    rate = n_events / elapsed if elapsed > 0 else float("inf")
+    print(f"[INFO] {'+'.join(detids)}: {n_events} events in {elapsed:.2f} s ({rate:.0f} events/s)")
+
+    return h
+
+
+# ---------------------------
+# Parallel reduction over files and detectors
+# ---------------------------
+def fill_parallel(fill, lh5_files, detids, max_workers=None, pool=None, cache_key=None, **kwargs):
+    """
+    Run `fill([detid], lh5_file, **kwargs)` for every (file, detector) pair
+    in a process pool and return the sum of the partial histograms.
+
+    `fill` must be a module-level function returning a histogram, e.g.
+    fill_edep_streaming. Partial results are merged in task order, so the
+    merged histogram does not depend on worker scheduling.
+
+    `pool` is an executor shared between calls (a new one with `max_workers`
+    processes is made otherwise). With `cache_key` -- the key function of
+    `fill`, e.g. edep_cache_key -- and a `cache_dir`, cached partial
+    histograms are loaded here and only the misses are sent to the pool;
+    if everything is cached no pool is used at all.
+    """
+    tasks = [(lh5_file, detid) for lh5_file in lh5_files for detid in detids]
+
+    start_time = time.perf_counter()
+    partials = [None] * len(tasks)
+    if cache_key is not None and kwargs.get("cache_dir") is not None:
+        for i, (lh5_file, detid) in enumerate(tasks):
+            partials[i] = cache_lookup(cache_key([detid], lh5_file, **kwargs), kwargs["cache_dir"])
+    missing = [i for i, h in enumerate(partials) if h is None]
+
+    if missing:
+        with contextlib.ExitStack() as stack:
+            if pool is None:
+                pool = stack.enter_context(concurrent.futures.ProcessPoolExecutor(max_workers=max_workers))
+            futures = {i: pool.submit(fill, [tasks[i][1]], tasks[i][0], **kwargs) for i in missing}
+            for i, future in futures.items():
+                partials[i] = future.result()
+
+    total = None
+    for h in partials:
+        total = h if total is None else total + h
+
+    elapsed = time.perf_counter() - start_time
+    print(
+        f"[INFO] {'+'.join(detids)}: merged {len(tasks)} partial histograms "
+        f"({len(tasks) - len(missing)} cached) from {len(lh5_files)} file(s) in {elapsed:.2f} s"
+    )
+
+    return total
+
+
+def merge_partials(partials):
+    """
+    Combine per-file results of the same reduction: histograms are added,
+    dicts are merged key by key and arrays are concatenated in file order.
+    """
+    first = partials[0]
+    if isinstance(first, dict):
+        return {key: merge_partials([p[key] for p in partials]) for key in first}
+    if isinstance(first, np.ndarray):
+        return np.concatenate(partials)
+    total = first
+    for partial in partials[1:]:
+        total = total + partial
+    return total
+
+
+def fill_edep_parallel(lh5_files, detids, max_workers=None, pool=None, **kwargs):
+    """fill_edep_streaming over many output files, parallel per (file, detector)."""
+    return fill_parallel(
+        fill_edep_streaming, lh5_files, detids, max_workers, pool=pool, cache_key=edep_cache_key, **kwargs
+    )
+
+
+# ---------------------------
+# HPGe / PEN anti-coincidence
+# ---------------------------
+def event_ids(chunk):
+    """Event id of every row of a stp chunk (per-step ids are reduced to one per row)."""
+    evtid = chunk.evtid
+    if evtid.ndim > 1:
+        evtid = ak.firsts(evtid)
+    return ak.to_numpy(evtid).astype(np.int64)
+
+
+def sum_by_event(evtids, values):
+    """Sort-merge reduction: sorted unique event ids and the summed values per id."""
+    order = np.argsort(evtids, kind="stable")
+    evtids = evtids[order]
+    unique_ids, starts = np.unique(evtids, return_index=True)
+    if len(unique_ids) == 0:
+        return unique_ids, np.zeros(0)
+    return unique_ids, np.add.reduceat(values[order], starts)
+
+
+def coincident(evtids, sorted_ids):
+    """Boolean mask of `evtids` that appear in the sorted array `sorted_ids`."""
+    if len(sorted_ids) == 0:
+        return np.zeros(len(evtids), dtype=bool)
+    pos = np.searchsorted(sorted_ids, evtids).clip(max=len(sorted_ids) - 1)
+    return sorted_ids[pos] == evtids
+
+
+def veto_event_ids(
+    pen_detids,
+    lh5_file="output.lh5",
+    pen_threshold=0.0,
+    pmt_detids=(),
+    pmt_threshold=1,
+    chunk_size=DEFAULT_CHUNK_SIZE,
+):
+    """
+    Sorted ids of events that fire the veto: the energy summed over all
+    `pen_detids` is at least `pen_threshold` (keV), or the number of photons
+    summed over all `pmt_detids` is at least `pmt_threshold`.
+    Only per-event sums are kept in memory, never the step data.
+    """
+    with open_lh5(lh5_file) as f:
+        ids, energies = [], []
+        for detid in pen_detids:
+            for chunk in iter_chunks(f"stp/{detid}", f, chunk_size, ["evtid", "edep"]):
+                ids.append(event_ids(chunk))
+                energies.append(ak.to_numpy(ak.sum(chunk.edep, axis=-1)))
+
+        ids_pmt, photons = [], []
+        for detid in pmt_detids:
+            for chunk in iter_chunks(f"stp/{detid}", f, chunk_size, ["evtid", "time"]):
+                ids_pmt.append(event_ids(chunk))
+                photons.append(ak.to_numpy(ak.num(chunk.time, axis=-1)))
+
+    veto_ids = np.zeros(0, dtype=np.int64)
+    if ids:
+        pen_ids, pen_energy = sum_by_event(np.concatenate(ids), np.concatenate(energies))
+        veto_ids = pen_ids[pen_energy >= pen_threshold]
+    if ids_pmt:
+        pmt_ids, pmt_photons = sum_by_event(np.concatenate(ids_pmt), np.concatenate(photons))
+        veto_ids = np.union1d(veto_ids, pmt_ids[pmt_photons >= pmt_threshold])
+
+    return veto_ids
+
+
+def fill_anticoincidence(
+    hpge_detids,
+    veto_ids,
+    lh5_file="output.lh5",
+    axis=None,
+    chunk_size=DEFAULT_CHUNK_SIZE,
+):
+    """
+    HPGe energy spectra with and without the veto applied. Each HPGe event is
+    looked up in the sorted `veto_ids` (see veto_event_ids) with a vectorised
+    binary search. Returns {"raw": all events, "vetoed": events surviving the
+    veto, "rejected": events removed by it}.
+    """
+    axis = axis if axis is not None else energy_axis()
+    spectra = {
+        key: hist.Hist(axis, storage=hist.storage.Double())
+        for key in ["raw", "vetoed", "rejected"]
+    }
+
+    n_events = 0
+    start_time = time.perf_counter()
+    with open_lh5(lh5_file) as f:
+        for detid in hpge_detids:
+            for chunk in iter_chunks(f"stp/{detid}", f, chunk_size, ["evtid", "edep"]):
+                energy = ak.to_numpy(ak.sum(chunk.edep, axis=-1))
+                rejected = coincident(event_ids(chunk), veto_ids)
+
+                spectra["raw"].fill(energy)
+                spectra["vetoed"].fill(energy[~rejected])
+                spectra["rejected"].fill(energy[rejected])
+                n_events += len(energy)
+
+    elapsed = time.perf_counter() - start_time
+    rate = n_events / elapsed if elapsed > 0 else float("inf")
+    print(f"[INFO] {'+'.join(hpge_detids)} anti-coincidence: {n_events} events in {elapsed:.2f} s ({rate:.0f} events/s)")
+
+    return spectra
+
+
+# ---------------------------
+# Binned step-position density
+# ---------------------------
+def position_range(
+    detids, lh5_file="output.lh5", x="xloc", y="zloc", chunk_size=DEFAULT_CHUNK_SIZE, cache_dir=None
+):
+    """
+    Bounding box [(xmin, xmax), (ymin, ymax)] of all step positions of
+    `detids`; `lh5_file` may also be a list of files (common range of all).
+    If `cache_dir` is given the range is cached on disk like a histogram.
+    """
+    if cache_dir is not None:
+        key = histogram_cache_key(lh5_file, detids, "position_range", None, extra={"x": x, "y": y})
+        return cached_histogram(
+            key, lambda: position_range(detids, lh5_file, x, y, chunk_size), cache_dir
+        )
+
+    lh5_files = lh5_file if isinstance(lh5_file, (list, tuple)) else [lh5_file]
+    lo = np.array([np.inf, np.inf])
+    hi = -lo
+    for lh5_file in lh5_files:
+        with open_lh5(lh5_file) as f:
+            for detid in detids:
+                for chunk in iter_chunks(f"stp/{detid}", f, chunk_size, [x, y]):
+                    for i, field in enumerate([x, y]):
+                        values = ak.to_numpy(ak.flatten(chunk[field]))
+                        if len(values) > 0:
+                            lo[i] = min(lo[i], values.min())
+                            hi[i] = max(hi[i], values.max())
+
+    # No steps at all: fall back to a unit box so an (empty) map can still be drawn
+    if not np.all(np.isfinite([lo, hi])):
+        return [(0.0, 1.0), (0.0, 1.0)]
+    # Regular axes exclude their upper edge, so move it just past the
+    # outermost step to keep that step out of the overflow bin
+    hi = np.nextafter(hi, np.inf)
+    return [(lo[0], hi[0]), (lo[1], hi[1])]
+
+
+def fill_density(
+    detids,
+    lh5_file="output.lh5",
+    bins=(200, 200),
+    range=None,
+    x="xloc",
+    y="zloc",
+    weight=None,
+    chunk_size=DEFAULT_CHUNK_SIZE,
+    cache_dir=None,
+):
+    """
+    Bin every step position of `detids` into a 2D (x, y) histogram, chunk by
+    chunk, so all steps are used at bounded memory. `weight` names a per-step
+    field (e.g. "edep") to weight the steps with; `range` defaults to the
+    bounding box of the data, found in a first pass.
+    """
+    if cache_dir is not None:
+        extra = {"x": x, "y": y, "bins": list(bins), "range": range, "weight": weight}
+        key = histogram_cache_key(lh5_file, detids, "density", None, extra=extra)
+        return cached_histogram(
+            key,
+            lambda: fill_density(detids, lh5_file, bins, range, x, y, weight, chunk_size),
+            cache_dir,
+        )
+
+    fields = [x, y] if weight is None else [x, y, weight]
+    with open_lh5(lh5_file) as f:
+        if range is None:
+            range = position_range(detids, f, x, y, chunk_size)
+
+        h = hist.Hist(
+            hist.axis.Regular(bins[0], *range[0], name=x),
+            hist.axis.Regular(bins[1], *range[1], name=y),
+            storage=hist.storage.Double(),
+        )
+        for detid in detids:
+            for chunk in iter_chunks(f"stp/{detid}", f, chunk_size, fields):
+                kwargs = {}
+                if weight is not None:
+                    kwargs["weight"] = ak.to_numpy(ak.flatten(chunk[weight]))
+                h.fill(
+                    ak.to_numpy(ak.flatten(chunk[x])),
+                    ak.to_numpy(ak.flatten(chunk[y])),
+                    **kwargs,
+                )
+
+    return h
+
+
+# ---------------------------
+# Streaming optical-photon analysis
+# ---------------------------
+def fill_optical_streaming(
+    detid,
+    lh5_file="output.lh5",
+    wl_axis=None,
+    t_axis=None,
+    n_axis=None,
+    chunk_size=DEFAULT_CHUNK_SIZE,
+    cache_dir=None,
+):
+    """
+    One pass over the optical detector table `stp/<detid>` that fills the
+    photon wavelength and arrival-time spectra with fixed binning and counts
+    the detected photons per event.
+
+    Returns a dict with the histograms "wavelength", "time" and "photons"
+    (photons per event) and the arrays "evtid" / "n_photons" (sorted event
+    ids and their photon counts) for later cuts.
+    """
+    wl_axis = wl_axis if wl_axis is not None else wavelength_axis()
+    t_axis = t_axis if t_axis is not None else time_axis()
+    n_axis = n_axis if n_axis is not None else photon_count_axis()
+
+    if cache_dir is not None:
+        extra = {"time": t_axis.edges.tolist(), "photons": n_axis.edges.tolist()}
+        key = histogram_cache_key(lh5_file, [detid], "optical", wl_axis, extra=extra)
+        return cached_histogram(
+            key,
+            lambda: fill_optical_streaming(detid, lh5_file, wl_axis, t_axis, n_axis, chunk_size),
+            cache_dir,
+        )
+
+    result = {
+        "wavelength": hist.Hist(wl_axis, storage=hist.storage.Double()),
+        "time": hist.Hist(t_axis, storage=hist.storage.Double()),
+        "photons": hist.Hist(n_axis, storage=hist.storage.Double()),
+    }
+
+    ids, counts = [], []
+    for chunk in iter_chunks(f"stp/{detid}", lh5_file, chunk_size, ["evtid", "wavelength", "time"]):
+        result["wavelength"].fill(ak.to_numpy(ak.flatten(chunk.wavelength)))
+        result["time"].fill(ak.to_numpy(ak.flatten(chunk.time)))
+        ids.append(event_ids(chunk))
+        counts.append(ak.to_numpy(ak.num(chunk.time, axis=-1)).astype(np.int64))
+
+    if ids:
+        # Rows of the same event may be split over chunks, so merge by id at the end
+        result["evtid"], result["n_photons"] = sum_by_event(np.concatenate(ids), np.concatenate(counts))
+    else:
+        result["evtid"], result["n_photons"] = np.zeros(0, np.int64), np.zeros(0, np.int64)
+    result["photons"].fill(result["n_photons"])
+
+    return result
+
+
+# ---------------------------
+# Memory-mapped flat stp cache
+# ---------------------------
+# Layout: <outdir>/<detid>/<field>.values.npy holds the flattened values of a
+# field and, for jagged fields, <field>.offsets.npy the event offsets into it
+# (n_rows + 1 entries). Both are plain uncompressed .npy files that are
+# memory-mapped on read, so any event range can be sliced without copying.
+def is_flat_cache(path):
+    """True if `path` is a directory written by convert_to_flat."""
+    return isinstance(path, str) and os.path.isfile(os.path.join(path, FLAT_META_FILE))
+
+
+def convert_to_flat(lh5_file, outdir, detids=None, fields=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    One-time conversion of the stp tables of `lh5_file` into the flat layout
+    above. `detids` / `fields` default to every detector table and field in
+    the file. The copy goes chunk by chunk, so memory stays bounded for any
+    file size.
+    """
+    start_time = time.perf_counter()
+    converted = {}
+    with h5py.File(lh5_file, "r") as f:
+        for detid in detids if detids is not None else detector_tables(f):
+            table = f[f"stp/{detid}"]
+            os.makedirs(os.path.join(outdir, detid), exist_ok=True)
+            converted[detid] = []
+            for field in fields if fields is not None else list(table.keys()):
+                if field not in table:
+                    continue
+                if _copy_field_to_flat(table[field], os.path.join(outdir, detid, field), chunk_size):
+                    converted[detid].append(field)
+                else:
+                    print(f"[WARNING] stp/{detid}/{field} is neither an array nor a vector of vectors, not converted")
+
+    meta = {"source": os.path.abspath(lh5_file), "fingerprint": file_fingerprint(lh5_file), "fields": converted}
+    with open(os.path.join(outdir, FLAT_META_FILE), "w") as f:
+        json.dump(meta, f, indent=2)
+
+    print(f"[OK] Flat stp cache written to: {outdir} ({time.perf_counter() - start_time:.1f} s)")
+    return outdir
+
+
+def detector_tables(f):
+    """
+    Names of the detector tables under stp. remage also writes __by_uid__
+    (links to the same tables), detector_origins and vtx there; links and
+    anything that is not a det* table are skipped.
+    """
+    names = []
+    for name in f["stp"]:
+        if not isinstance(f["stp"].get(name, getlink=True), h5py.HardLink):
+            continue
+        obj = f["stp"][name]
+        if not isinstance(obj, h5py.Group) or not name.startswith("det"):
+            continue
+        if not str(obj.attrs.get("datatype", "table")).startswith("table"):
+            continue
+        names.append(name)
+    return names
+
+
+def _copy_field_to_flat(obj, prefix, chunk_size):
+    """
+    Copy one LH5 array or vector-of-vectors into <prefix>.values.npy
+    (+ .offsets.npy). Returns False for anything else.
+    """
+    if isinstance(obj, h5py.Dataset):
+        values = np.lib.format.open_memmap(f"{prefix}.values.npy", "w+", obj.dtype, obj.shape)
+        for start in range(0, obj.shape[0], chunk_size):
+            values[start : start + chunk_size] = obj[start : start + chunk_size]
+        values.flush()
+        return True
+
+    if not isinstance(obj.get("cumulative_length"), h5py.Dataset) or not isinstance(
+        obj.get("flattened_data"), h5py.Dataset
+    ):
+        return False
+    cumulative_length = obj["cumulative_length"]
+    flattened_data = obj["flattened_data"]
+    n_rows = cumulative_length.shape[0]
+
+    offsets = np.lib.format.open_memmap(f"{prefix}.offsets.npy", "w+", np.int64, (n_rows + 1,))
+    values = np.lib.format.open_memmap(
+        f"{prefix}.values.npy", "w+", flattened_data.dtype, flattened_data.shape
+    )
+    offsets[0] = 0
+    for start in range(0, n_rows, chunk_size):
+        stop = min(start + chunk_size, n_rows)
+        lengths = cumulative_length[start:stop]
+        offsets[start + 1 : stop + 1] = lengths
+        begin = offsets[start]
+        values[begin : lengths[-1]] = flattened_data[begin : lengths[-1]]
+    offsets.flush()
+    values.flush()
+    return True
+
+
+def read_flat(flat_dir, detid, field, start=0, stop=None):
+    """Rows [start, stop) of one field as an awkward array backed by the memory map."""
+    prefix = os.path.join(flat_dir, detid, field)
+    values = np.load(f"{prefix}.values.npy", mmap_mode="r")
+    if not os.path.exists(f"{prefix}.offsets.npy"):
+        return ak.Array(ak.contents.NumpyArray(values[start:stop]))
+
+    offsets = np.load(f"{prefix}.offsets.npy", mmap_mode="r")
+    stop = len(offsets) - 1 if stop is None else min(stop, len(offsets) - 1)
+    # Offsets index into the full values array, so nothing is copied
+    content = ak.contents.ListOffsetArray(
+        ak.index.Index64(offsets[start : stop + 1]), ak.contents.NumpyArray(values)
+    )
+    return ak.Array(content)
+
+
+def read_flat_table(flat_dir, detid, fields, start=0, stop=None):
+    """Several fields of one detector as a record array, like read_columns."""
+    return ak.zip(
+        {field: read_flat(flat_dir, detid, field, start, stop) for field in fields}, depth_limit=1
+    )
+
+
+def flat_n_rows(flat_dir, detid, field):
+    """Number of rows (events) of a field in the flat cache."""
+    prefix = os.path.join(flat_dir, detid, field)
+    if os.path.exists(f"{prefix}.offsets.npy"):
+        return len(np.load(f"{prefix}.offsets.npy", mmap_mode="r")) - 1
+    return len(np.load(f"{prefix}.values.npy", mmap_mode="r"))
+
+
+def iter_flat_chunks(name, flat_dir, chunk_size=DEFAULT_CHUNK_SIZE, field_mask=None):
+    """iter_chunks for a flat cache; `name` is "stp/<detid>" or "stp/<detid>/<field>"."""
+    parts = name.split("/")
+    detid = parts[1]
+    if len(parts) > 2:
+        n_rows = flat_n_rows(flat_dir, detid, parts[2])
+        for start in range(0, n_rows, chunk_size):
+            yield read_flat(flat_dir, detid, parts[2], start, start + chunk_size)
+        return
+
+    if field_mask is None:
+        with open(os.path.join(flat_dir, FLAT_META_FILE)) as f:
+            field_mask = json.load(f)["fields"][detid]
+    n_rows = flat_n_rows(flat_dir, detid, field_mask[0])
+    for start in range(0, n_rows, chunk_size):
+        yield read_flat_table(flat_dir, detid, field_mask, start, start + chunk_size)
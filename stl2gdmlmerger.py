@@ -2,19 +2,28 @@
 """
 Merge STL-converted PEN GDML into a Remage-generated GDML
 and place it as a scintillator in the LAr volume.
+
+Usage:
+    python stl2gdmlmerger.py                          # the single PEN-L part
+    python stl2gdmlmerger.py parts/*.gdml --workers 8 # multi-part assembly
+    python stl2gdmlmerger.py PENGeometry/PEN-L.stl    # STL read directly
+
+Every GDML file, the remage geometry included, whose registry is missing
+from the pickled registry cache in .registry_cache is parsed, and its
+tessellated CAD parts decimated, in a pool of worker processes; the parent
+process only unpickles the resulting registries and merges them in the
+order given, so the output is the same for any number of workers.
 """
 
-import pyg4ometry.geant4 as g4
-from pyg4ometry.gdml import Reader, Writer
-from pyg4ometry.geant4 import Material, ElementSimple, PhysicalVolume
-from legendoptics.pen import (
-    pyg4_pen_attach_rindex,
-    pyg4_pen_attach_attenuation,
-    pyg4_pen_attach_wls,
-    pyg4_pen_attach_scintillation,
-)
+import argparse
+import os
+
+import pygeomtools
+from pyg4ometry.geant4 import PhysicalVolume
 from pygeomtools import RemageDetectorInfo
-from pyg4ometry import visualisation as vis
+
+from gdml_tools import REGISTRY_CACHE_DIR, merge_parts, read_registries, stl_to_logical_volume
+from geometry_tools import collect_detectors, restore_detectors, show_geometry
 
 
 # -----------------------------
@@ -24,164 +33,28 @@ remage_gdml = "HPGe_with_PEN_optical.gdml"
 stl_gdml    = "PENGeometry/PEN-L.gdml"
 merged_gdml = "HPGe_with_PEN_and_STL.gdml"
 
-# -----------------------------
-# Create a fresh registry
-# -----------------------------
-reg = g4.Registry()
-
-# -----------------------------
-# Define PEN material
-# -----------------------------
-C = g4.ElementSimple("Carbon", "C", 6, 12.01, registry=reg)
-H = g4.ElementSimple("Hydrogen", "H", 1, 1.008, registry=reg)
-O = g4.ElementSimple("Oxygen", "O", 8, 16.00, registry=reg)
-
-pen = g4.Material(
-    name="PEN",
-    density=1.3,
-    number_of_components=3,
-    state="solid",
-    temperature=293.15,
-    registry=reg,
-)
-pen.add_element_natoms(C, 14)
-pen.add_element_natoms(H, 10)
-pen.add_element_natoms(O, 4)
-
-# Attach optical properties
-pyg4_pen_attach_rindex(pen, reg)
-pyg4_pen_attach_attenuation(pen, reg)
-pyg4_pen_attach_wls(pen, reg)
-pyg4_pen_attach_scintillation(pen, reg)
-
-'''
-# -----------------------------
-# Read GDML files into separate registries
-# -----------------------------
-remage_reader = Reader(remage_gdml)   # returns a Registry
-remage_reg    = remage_reader  # Reader itself is a Registry-like object
-stl_reader    = Reader(stl_gdml)
-stl_reg       = stl_reader     # same here
-'''
-
-# -----------------------------
-# Read GDML files into separate registries
-# -----------------------------
-remage_reader = Reader(remage_gdml)
-remage_reg = remage_reader.getRegistry()  # ✅ This works
-
-stl_reader = Reader(stl_gdml)
-stl_reg = stl_reader.getRegistry()
-
-
-print("Remage logical volumes:")
-for name, lv in remage_reg.logicalVolumeDict.items():
-    print(" -", name)
-
-print("STL logical volumes:")
-for name, lv in stl_reg.logicalVolumeDict.items():
-    print(" -", name)
-
-# Rename duplicate "PEN" material in STL registry to avoid conflict
-for mat in getattr(stl_reg, "materialList", []):
-    if mat.name == "PEN":
-        print(f"Renaming material {mat.name} to PEN_STL to avoid duplicates")
-        mat.name = "PEN_STL"
+# STL parts are made of the (optical) PEN already defined in the remage GDML
+material_map = {"PEN": "PEN"}
 
-# Update logical volumes that reference PEN material
-for lv_name, lv in stl_reg.logicalVolumeDict.items():
-    if lv.material and lv.material.name == "PEN":
-        print(f"Updating material of logical volume {lv_name} from PEN to PEN_STL")
-        lv.material.name = "PEN_STL"
-
-print("\nSTL solids:")
-for s in stl_reg.solidDict.keys():
-    print(" -", s)
-
-print("\nSTL logical volumes:")
-for lv in stl_reg.logicalVolumeDict.keys():
-    print(" -", lv)
-
-print("\nSTL physical volumes:")
-for pv in getattr(stl_reg, "physicalVolumeList", []):
-    print(" -", pv.name)
-
-
-# Rename STL PEN material before merge
-for mat in stl_reg.materialList:
-    if 'PEN' in mat.name:
-        mat.name = 'PEN_stl'
-
-# Update logical volumes to use renamed material
-for lv in stl_reg.logicalVolumeDict.values():
-    if lv.material and 'PEN' in lv.material.name:
-        lv.material.name = 'PEN_stl'
-
-# -----------------------------
-# Merge STL registry into Remage registry
-# -----------------------------
-
-# 1️⃣ Merge defineDict entries (positions, rotations, etc.)
-for name, obj in stl_reg.defineDict.items():
-    new_name = name
-    # Ensure unique keys if there is overlap
-    while new_name in remage_reg.defineDict:
-        new_name += "_stl"
-    obj.name = new_name
-    remage_reg.defineDict[new_name] = obj
-
-print(f"Total defines in merged registry: {len(remage_reg.defineDict)}")
-print("Sample define keys:", list(remage_reg.defineDict.keys())[:10])
-
-# 2️⃣ Merge materials
-for mat in getattr(stl_reg, "materialList", []):
-    if all(mat.name != m.name for m in remage_reg.materialList):
-        remage_reg.materialList.append(mat)
-
-# Remove duplicate materials by name, keeping first occurrence
-unique_mats = {}
-new_material_list = []
-for mat in remage_reg.materialList:
-    if mat.name not in unique_mats:
-        unique_mats[mat.name] = True
-        new_material_list.append(mat)
-    else:
-        print(f"Duplicate material removed: {mat.name}")
-remage_reg.materialList = new_material_list
-
-# Re-attach PEN optical properties to the merged PEN material
-pen_material = next((m for m in remage_reg.materialList if m.name == "PEN"), None)
-if pen_material is not None:
-    pyg4_pen_attach_rindex(pen_material, remage_reg)
-    pyg4_pen_attach_attenuation(pen_material, remage_reg)
-    pyg4_pen_attach_wls(pen_material, remage_reg)
-    pyg4_pen_attach_scintillation(pen_material, remage_reg)
-
-# 3️⃣ Merge solids
-for name, solid_obj in getattr(stl_reg, "solidDict", {}).items():
-    if name not in remage_reg.solidDict:
-        remage_reg.solidDict[name] = solid_obj
-
-# 4️⃣ Merge logical volumes
-for name, lv in stl_reg.logicalVolumeDict.items():
-    if name not in remage_reg.logicalVolumeDict:
-        remage_reg.logicalVolumeDict[name] = lv
-
-# 5️⃣ Merge physical volumes
-for pv_name, pv in stl_reg.physicalVolumeDict.items():
-    if pv_name not in remage_reg.physicalVolumeDict:
-        remage_reg.physicalVolumeDict[pv_name] = pv
+# Locations where the STL PEN is placed in the LAr (x, y, z in mm)
+pen_positions = [
+    [0, 0, 60],
+    [0, 0, -90],
+    [0, 0, 0],
+]
 
-# Print counts
-print(f"Total solids in merged registry: {len(remage_reg.solidDict)}")
-print(f"Total logical volumes in merged registry: {len(remage_reg.logicalVolumeDict)}")
-print(f"Total physical volumes in merged registry: {len(remage_reg.physicalVolumeDict)}")
+# Material and length scale (to mm) of parts given directly as .stl files
+stl_material = "PEN"
+stl_scale = 1.0
 
+# Detector uid of the first STL PEN copy; copies count up from here
+pen_first_uid = 100
 
+# Decimation of the CAD tessellation before merging (None = keep every facet):
+# maximum distance from the original surface in mm and relative volume change
+decimate_max_deviation = 0.05
+decimate_max_volume_change = 0.002
 
-# -----------------------------
-# Place STL PEN in LAr
-# -----------------------------
 
 def find_logical_volume(registry, name):
     try:
@@ -190,166 +63,101 @@ def find_logical_volume(registry, name):
         raise ValueError(f"Logical volume '{name}' not found in registry.")
 
 
-# Automatically pick the first logical volume from STL GDML
-pen_lv_name = list(stl_reg.logicalVolumeDict.keys())[0]
-pen_lv = find_logical_volume(stl_reg, pen_lv_name)
-print(f"Using STL logical volume: {pen_lv_name}")
-
-
-lar_lv = find_logical_volume(remage_reg, "LAr_lv")
-world_lv = find_logical_volume(remage_reg, "World_lv")
-#pen_lv = find_logical_volume(stl_reg, "log_PEN0x600003544320")  # use actual name seen in STL
-
-
-
-print(f"pen_lv type: {type(pen_lv)}")
-print(f"lar_lv type: {type(lar_lv)}")
-print(f"reg type: {type(remage_reg)}")
-
-
-# Define the locations where you want PEN placed (x, y, z in mm)
-pen_positions = [
-    [0, 0, 60],
-    [0, 0, -90],
-    [0, 0, 0]
-]
-
-for i, pos in enumerate(pen_positions):
-    phys_name = f"PEN_stl_pv_{i}"  # unique name for each copy
-    phys_pen = PhysicalVolume(
-        [0, 0, 0],      # rotation
-        pos,             # position
-        pen_lv,          # logicalVolume
-        phys_name,       # name
-        lar_lv,          # motherVolume
-        remage_reg       # registry
-    )
-
-    # Attach detector info if not already present
-    if not hasattr(phys_pen, "pygeom_active_detector"):
-        phys_pen.pygeom_active_detector = RemageDetectorInfo(
-            "scintillator",
-            100,
-            {"name": "PEN_stl"}
-        )
-    else:
-        print(f"Detector info already set for {phys_pen.name}. Skipping assignment.")
-
-
-'''
-phys_pen = PhysicalVolume(
-    [0, 0, 0],      # rotation
-    [0, 0, 0],      # position
-    pen_lv,         # logicalVolume (daughter volume)
-    "PEN_stl_pv",   # name (string)
-    lar_lv,         # motherVolume
-    remage_reg      # registry (optional keyword argument)
-)
-
-
-if not hasattr(phys_pen, "pygeom_active_detector"):
-    phys_pen.pygeom_active_detector = RemageDetectorInfo(
-        "scintillator",
-        100,
-        {"name": "PEN_stl"}
+def print_summary(reg):
+    print("\n========== MERGED REGISTRY SUMMARY ==========")
+    print(f"Total defines: {len(reg.defineDict)}")
+    print(f"Total materials: {len(reg.materialDict)}")
+    print(f"Total solids: {len(reg.solidDict)}")
+    print(f"Total logical volumes: {len(reg.logicalVolumeDict)}")
+    print(f"Total physical volumes: {len(reg.physicalVolumeDict)}")
+    for pv_name, pv in reg.physicalVolumeDict.items():
+        mother_name = pv.motherVolume.name if pv.motherVolume else "None"
+        print(f"PV '{pv_name}' inside mother '{mother_name}'")
+    print("============================================")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Merge STL-converted part GDMLs into the remage geometry")
+    parser.add_argument("parts", nargs="*", default=[stl_gdml], help="part GDML or STL files (one CAD part each)")
+    parser.add_argument("--workers", type=int, default=None, help="GDML parsing processes (default: all cores)")
+    parser.add_argument("--output", default=merged_gdml, help="merged GDML file")
+    parser.add_argument("--no-cache", action="store_true", help="always re-parse every GDML file, ignoring the pickled registry cache")
+    args = parser.parse_args(argv)
+
+    # -----------------------------
+    # Read all GDML files in parallel workers, reducing the CAD facet count
+    # on the way (navigation cost scales with it); unchanged files are
+    # loaded from the registry cache
+    # -----------------------------
+    decimate = None
+    if decimate_max_deviation is not None:
+        decimate = (decimate_max_deviation, decimate_max_volume_change)
+    cache_dir = None if args.no_cache else REGISTRY_CACHE_DIR
+    gdml_parts = [path for path in args.parts if not path.lower().endswith(".stl")]
+    remage_reg, *part_regs = read_registries([remage_gdml] + gdml_parts, args.workers, decimate, cache_dir)
+
+    # the remage GDML already carries the detector auxvals written by
+    # write_pygeom; move them back onto the volumes so that they are written
+    # again together with the STL PEN detectors
+    n_detectors = restore_detectors(remage_reg)
+    print(f"[INFO] {n_detectors} detectors registered in {remage_gdml}")
+
+    # -----------------------------
+    # Merge the GDML parts into the Remage registry; STL parts are built
+    # straight into it (in the given order)
+    # -----------------------------
+    merged = dict(zip(gdml_parts, merge_parts(remage_reg, gdml_parts, part_regs, material_map=material_map)))
+    part_lvs = []
+    for path in args.parts:
+        if path in merged:
+            part_lvs.append(merged[path])
+        else:
+            name = os.path.splitext(os.path.basename(path))[0].replace("-", "_")
+            part_lvs.append(
+                stl_to_logical_volume(path, remage_reg, f"{name}_stl", stl_material, stl_scale, decimate)
+            )
+
+    # -----------------------------
+    # Place STL PEN in LAr
+    # -----------------------------
+    lar_lv = find_logical_volume(remage_reg, "LAr_lv")
+    world_lv = find_logical_volume(remage_reg, "World_lv")
+
+    # parts of one assembly share its coordinate frame
+    uid = pen_first_uid
+    for i, pos in enumerate(pen_positions):
+        for j, part_lv in enumerate(part_lvs):
+            suffix = f"{i}" if len(part_lvs) == 1 else f"{i}_part{j}"
+            phys_pen = PhysicalVolume([0, 0, 0], pos, part_lv, f"PEN_stl_pv_{suffix}", lar_lv, remage_reg)
+            phys_pen.pygeom_active_detector = RemageDetectorInfo("scintillator", uid, {"name": f"PEN_stl_{suffix}"})
+            uid += 1
+
+    # reorder the logical volumes so daughters are written before mothers
+    remage_reg.setWorld(world_lv)
+    collect_detectors(remage_reg)
+    for part_lv in part_lvs:
+        print(f"Logical volume '{part_lv.name}' uses material '{part_lv.material.name}'")
+    print_summary(remage_reg)
+
+    # -----------------------------
+    # Write merged GDML
+    # -----------------------------
+    pygeomtools.write_pygeom(remage_reg, args.output)
+    print(f"[OK] Merged GDML written to: {args.output}")
+
+    # -----------------------------
+    # Optional: Visualize the merged geometry using VTK (mode set by PYG4_VIEW)
+    # -----------------------------
+    show_geometry(
+        remage_reg,
+        {
+            "LAr": [0, 0, 1, 0.1],
+            "PEN": [0, 0.5, 0.5, 0.3],
+            "G4_Galactic": [0.5, 0.5, 0.5, 0.2],
+        },
+        snapshot_prefix="HPGe_with_PEN_and_STL",
     )
-else:
-    print(f"Detector info already set for {phys_pen.name}. Skipping assignment.")
-
-'''
-
-print("\nPhysical Volumes in registry:")
-for pv_name, pv in remage_reg.physicalVolumeDict.items():
-    mother_name = pv.motherVolume.name if pv.motherVolume else "None"
-    print(f"PV '{pv_name}' inside mother '{mother_name}'")
 
 
-print("\nPhysical Volumes in registry:")
-for pv_name, pv in remage_reg.physicalVolumeDict.items():
-    mother_name = pv.motherVolume.name if pv.motherVolume else "None"
-    print(f"PV '{pv_name}' inside mother '{mother_name}'")
-
-# Add your snippet here:
-print("\nPhysical Volumes and their mother volumes:")
-for pv_name, pv in remage_reg.physicalVolumeDict.items():
-    mother_name = pv.motherVolume.name if pv.motherVolume else "None"
-    print(f"PV '{pv_name}' inside mother '{mother_name}'")
-
-# Also check PEN material usage
-print("\nMaterials in merged registry:")
-for mat in remage_reg.materialList:
-    print(f"Material: {mat.name}")
-
-# Check PEN_stl logical volume material
-pen_lv = remage_reg.logicalVolumeDict.get('PEN_stl_lv0x6000028bd540', None)
-if pen_lv and pen_lv.material:
-    print(f"\nLogical volume 'PEN_stl_lv0x6000028bd540' uses material '{pen_lv.material.name}'")
-else:
-    print("\nPEN_stl_lv0x6000028bd540 or its material not found!")
-
-print("\nPhysical Volumes and their mother volumes:")
-for pv_name, pv in remage_reg.physicalVolumeDict.items():
-    mother_name = pv.motherVolume.name if pv.motherVolume else "None"
-    print(f"PV '{pv_name}' inside mother '{mother_name}'")
-
-print("\nMaterials in merged registry:")
-for mat in remage_reg.materialList:
-    print(f"Material: {mat.name}")
-
-pen_lv = remage_reg.logicalVolumeDict.get('PEN_stl_lv0x6000028bd540', None)
-if pen_lv and pen_lv.material:
-    print(f"\nLogical volume 'PEN_stl_lv0x6000028bd540' uses material '{pen_lv.material.name}'")
-else:
-    print("\nPEN_stl_lv0x6000028bd540 or its material not found!")
-
-
-
-# -----------------------------
-# Write merged GDML
-# -----------------------------
-writer = Writer()
-writer.addDetector(remage_reg)
-writer.write(merged_gdml)
-
-print(f"[OK] Merged GDML written to: {merged_gdml}")
-
-print("\n========== MERGED REGISTRY SUMMARY ==========")
-
-# Solids
-print(f"Total solids: {len(remage_reg.solidDict)}")
-print("Sample solids:", list(remage_reg.solidDict.keys())[:10])
-
-# Logical Volumes
-print(f"Total logical volumes: {len(remage_reg.logicalVolumeDict)}")
-print("Sample logical volumes:", list(remage_reg.logicalVolumeDict.keys())[:10])
-
-# Physical Volumes
-print(f"Total physical volumes: {len(remage_reg.physicalVolumeDict)}")
-print("Sample physical volumes:", list(remage_reg.physicalVolumeDict.keys())[:10])
-
-# Materials
-print(f"Total materials: {len(remage_reg.materialList)}")
-print("Materials:")
-for mat in remage_reg.materialList:
-    print(f" - {mat.name}")
-
-# Define objects (positions, rotations, etc.)
-if hasattr(remage_reg, "defineDict"):
-    print(f"Total define objects: {len(remage_reg.defineDict)}")
-    print("Sample defines:", list(remage_reg.defineDict.keys())[:10])
-else:
-    print("No defineDict found in registry.")
-
-print("============================================")
-# -----------------------------
-# Optional: Visualize the merged geometry using VTK
-# -----------------------------
-viewer = vis.VtkViewerColoured(
-    materialVisOptions={
-        "LAr": [0, 0, 1, 0.1],
-        "PEN": [0, 0.5, 0.5, 0.3],
-        "G4_Galactic": [0.5, 0.5, 0.5, 0.2],
-    }
-)
-viewer.addLogicalVolume(remage_reg.getWorldVolume())  # Use your merged registry
-viewer.view()
+if __name__ == "__main__":
+    main()
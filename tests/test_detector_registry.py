@@ -0,0 +1,59 @@
+import pytest
+
+g4 = pytest.importorskip("pyg4ometry.geant4")
+pytest.importorskip("pygeomtools")
+
+from pygeomtools import RemageDetectorInfo
+
+from geometry_tools import collect_detectors, validate_run_macro, write_detector_macro
+
+
+def build(uids):
+    """World with one small box per entry of `uids`, each a germanium detector with that uid."""
+    reg = g4.Registry()
+    world_s = g4.solid.Box("world_s", 1000, 1000, 1000, reg, "mm")
+    world_lv = g4.LogicalVolume(world_s, "G4_Galactic", "world_lv", reg)
+    reg.setWorld(world_lv)
+    det_s = g4.solid.Box("det_s", 10, 10, 10, reg, "mm")
+    det_lv = g4.LogicalVolume(det_s, "G4_Ge", "det_lv", reg)
+    for i, uid in enumerate(uids):
+        pv = g4.PhysicalVolume([0, 0, 0], [20 * i, 0, 0], det_lv, f"det{i}", world_lv, reg)
+        pv.pygeom_active_detector = RemageDetectorInfo("germanium", uid)
+    return reg
+
+
+def test_collect_detectors_sorted_by_uid():
+    assert collect_detectors(build([2, 1])) == [(1, "det1", "germanium"), (2, "det0", "germanium")]
+
+
+def test_duplicate_uid_is_rejected():
+    with pytest.raises(ValueError, match="uid 1 used by both det0 and det1"):
+        collect_detectors(build([1, 1]))
+
+
+def test_detector_info_on_a_logical_volume_is_rejected():
+    reg = build([1])
+    reg.logicalVolumeDict["det_lv"].pygeom_active_detector = RemageDetectorInfo("germanium", 2)
+    with pytest.raises(ValueError, match=r"logical volume\(s\) \['det_lv'\]"):
+        collect_detectors(reg)
+
+
+def test_double_registration_through_control_execute(tmp_path):
+    detectors = write_detector_macro(build([1, 2]), str(tmp_path / "detectors.mac"))
+
+    run = tmp_path / "run.mac"
+    run.write_text("/run/initialize\n/gun/particle gamma\n")
+    validate_run_macro(str(run), detectors)
+
+    # the generated block pulled in again on top of the GDML registration
+    run.write_text("/control/execute detectors.mac\n/run/initialize\n")
+    with pytest.raises(ValueError, match="det0 \\(uid 1\\) is registered twice"):
+        validate_run_macro(str(run), detectors)
+
+    # a detector registered twice within the macros alone
+    (tmp_path / "extra.mac").write_text("/RMG/Geometry/RegisterDetector Germanium det9 9\n")
+    run.write_text(
+        "/RMG/Geometry/RegisterDetector Germanium det9 9  # first\n/control/execute extra.mac\n"
+    )
+    with pytest.raises(ValueError, match="det9 \\(uid 9\\) is registered twice"):
+        validate_run_macro(str(run), [])
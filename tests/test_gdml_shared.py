@@ -0,0 +1,43 @@
+import os
+import xml.etree.ElementTree as ET
+
+import pytest
+
+g4 = pytest.importorskip("pyg4ometry.geant4")
+lar_optics = pytest.importorskip("legendoptics.lar")
+pytest.importorskip("pygeomtools")
+
+from geometry_tools import gdml_includes, write_gdml_shared
+
+
+def build():
+    reg = g4.Registry()
+    ar = g4.ElementSimple("Argon", "Ar", 18, 39.95, registry=reg)
+    lar = g4.Material(name="LAr", density=1.390, number_of_components=1, state="liquid", registry=reg)
+    lar.add_element_natoms(ar, 1)
+    lar_optics.pyg4_lar_attach_rindex(lar, reg)
+    world_s = g4.solid.Box("world_s", 100, 100, 100, reg, "mm")
+    world_lv = g4.LogicalVolume(world_s, lar, "world_lv", reg)
+    reg.setWorld(world_lv)
+    return reg
+
+
+def test_materials_and_matrices_move_to_shared_includes(tmp_path):
+    gdml_path = str(tmp_path / "variant.gdml")
+    shared_dir = str(tmp_path / "shared")
+    assert write_gdml_shared(build(), gdml_path, shared_dir)
+    assert not write_gdml_shared(build(), gdml_path, shared_dir)
+
+    with open(gdml_path) as f:
+        text = f.read()
+    assert "<matrix " not in text and "<materials>" not in text
+    assert text.index("&matrices;") < text.index("</define>") < text.index("&materials;") < text.index("<solids>")
+
+    includes = gdml_includes(gdml_path)
+    assert sorted(os.path.basename(path).split("_")[0] for path in includes) == ["materials", "matrices"]
+    for path in includes:
+        root = ET.fromstring(f"<include>{open(path).read()}</include>")
+        if os.path.basename(path).startswith("matrices"):
+            assert [m.get("name") for m in root] == ["LAr_RINDEX"]
+        else:
+            assert root.find("materials/material").get("name") == "LAr"
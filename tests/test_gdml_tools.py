@@ -0,0 +1,309 @@
+import os
+
+import pytest
+
+g4 = pytest.importorskip("pyg4ometry.geant4")
+gd = pytest.importorskip("pyg4ometry.gdml")
+
+from gdml_tools import merge_registries
+
+
+def make_part(x_value):
+    """World with a box Part_s of side 2*x placed at x, x being a constant define."""
+    reg = g4.Registry()
+    gd.Constant("x", x_value, reg)
+    gd.Constant("one", 1, reg)
+    world_s = g4.solid.Box("World_s", 1000, 1000, 1000, reg)
+    world_lv = g4.LogicalVolume(world_s, "G4_Galactic", "World_lv", reg)
+    reg.setWorld(world_lv)
+    part_s = g4.solid.Box("Part_s", "2*x", 10, 10, reg)
+    part_lv = g4.LogicalVolume(part_s, "G4_Fe", "Part_lv", reg)
+    g4.PhysicalVolume([0, 0, 0], ["x", 0, 0], part_lv, "Part_pv", world_lv, reg)
+    return reg
+
+
+def test_same_named_define_with_different_value_is_renamed():
+    target, source = make_part(5), make_part(50)
+    source_lv = source.logicalVolumeDict["Part_lv"]
+
+    report = merge_registries(target, source, suffix="_src", verbose=False)
+
+    assert report["renamed"]["define"]["x"] == "x_src"
+    assert "x" not in report["reused"]["define"]
+    assert report["renamed"]["solid"]["Part_s"] == "Part_s_src"
+    # identical defines are still shared
+    assert report["reused"]["define"] == {}
+    assert "one_src" not in target.defineDict
+
+    assert target.defineDict["x"].eval() == 5
+    assert target.defineDict["x_src"].eval() == 50
+    assert target.solidDict["Part_s"].evaluateParameterWithUnits("pX") == 10
+    # expressions of the merged part refer to (and evaluate in) the merged registry
+    assert source_lv.solid is target.solidDict["Part_s_src"]
+    assert source_lv.solid.evaluateParameterWithUnits("pX") == 100
+    part_pv = target.physicalVolumeDict["Part_pv_src"]
+    assert part_pv.position.x.expressionString == "x_src"
+    assert part_pv.position.eval()[0] == 50
+
+
+def test_identical_part_is_reused():
+    target, source = make_part(5), make_part(5)
+
+    report = merge_registries(target, source, suffix="_src", verbose=False)
+
+    assert report["renamed"]["define"] == {}
+    assert report["reused"]["material"] == {}
+    for kind in ("define", "material", "solid"):
+        assert report["added"][kind] == 0
+    assert target.logicalVolumeDict["Part_lv_src"].solid is target.solidDict["Part_s"]
+    assert target.logicalVolumeDict["Part_lv_src"].material is target.materialDict["G4_Fe"]
+
+
+def test_boolean_solids_differing_in_placement_are_not_reused():
+    target, source = make_part(5), make_part(5)
+    for reg, shift in ((target, 0), (source, 3)):
+        part_s = reg.solidDict["Part_s"]
+        g4.solid.Union("Pair_s", part_s, part_s, [[0, 0, 0], [shift, 0, 0]], reg)
+
+    report = merge_registries(target, source, suffix="_src", verbose=False)
+
+    assert report["renamed"]["solid"] == {"Pair_s": "Pair_s_src"}
+
+
+def test_only_expressions_see_renamed_defines():
+    target, source = make_part(5), make_part(50)
+    for reg, value in ((target, 1), (source, 2)):
+        gd.Constant("liquid", value, reg)
+        gd.Constant("ground", 10 * value, reg)
+        g4.solid.Box("Sized_s", "liquid*x", 10, 10, reg)
+    argon = g4.ElementSimple("Argon", "Ar", 18, 39.95, registry=source)
+    lar = g4.Material(name="LAr", density=1.39, number_of_components=1, state="liquid", registry=source)
+    lar.add_element_natoms(argon, 1)
+    surface = g4.solid.OpticalSurface("Part_surface", "ground", "unified", "dielectric_metal", 0, source)
+    g4.SkinSurface("Part_skin", source.logicalVolumeDict["Part_lv"], surface, source)
+
+    report = merge_registries(target, source, suffix="_src", verbose=False)
+
+    assert report["renamed"]["define"]["liquid"] == "liquid_src"
+    assert report["renamed"]["define"]["ground"] == "ground_src"
+    assert target.solidDict["Sized_s_src"].pX == "liquid_src*x_src"
+    assert target.solidDict["Sized_s_src"].lunit == "mm"
+    assert target.materialDict["LAr"].state == "liquid"
+    assert surface.finish == "ground"
+
+
+def test_merge_parts_merges_only_the_world_daughters():
+    from gdml_tools import merge_parts
+
+    target = make_part(5)
+    parts = [make_part(50), make_part(50)]
+    for reg in parts:
+        surface = g4.solid.OpticalSurface("Part_surface", "ground", "unified", "dielectric_metal", 0, reg)
+        g4.SkinSurface("Part_skin", reg.logicalVolumeDict["Part_lv"], surface, reg)
+        g4.solid.Box("Unused_s", 1, 1, 1, reg)
+
+    first, second = merge_parts(target, ["a.gdml", "b.gdml"], parts)
+
+    assert first.name == "Part_lv_a" and second.name == "Part_lv_b"
+    assert sorted(target.logicalVolumeDict) == ["Part_lv", "Part_lv_a", "Part_lv_b", "World_lv"]
+    assert sorted(target.physicalVolumeDict) == ["Part_pv"]
+    assert "Unused_s" not in target.solidDict and "World_s_a" not in target.solidDict
+    assert sorted(target.surfaceDict) == ["Part_skin", "Part_skin_b"]
+    # the second part is identical to the first, merged through the shared index
+    assert second.solid is first.solid is target.solidDict["Part_s_a"]
+
+
+def test_merge_index_hashes_the_target_once(monkeypatch):
+    import gdml_tools
+
+    calls = []
+    content_hash = gdml_tools.content_hash
+
+    def counting_hash(obj, *args, **kwargs):
+        calls.append(obj)
+        return content_hash(obj, *args, **kwargs)
+
+    monkeypatch.setattr(gdml_tools, "content_hash", counting_hash)
+    target, index = make_part(5), {}
+    gdml_tools.merge_registries(target, make_part(50), suffix="_a", verbose=False, index=index)
+    source = make_part(60)
+    source_objects = [*source.defineDict.values(), *source.materialDict.values(), *source.solidDict.values()]
+    calls.clear()
+    gdml_tools.merge_registries(target, source, suffix="_b", verbose=False, index=index)
+
+    # only the objects of the new source are hashed
+    assert [id(obj) for obj in calls] == [id(obj) for obj in source_objects]
+    assert target.defineDict["x_b"].eval() == 60
+
+
+def make_tessellated_sphere(reg, name="Sphere_s", radius=50.0):
+    """Finely tessellated sphere as a TessellatedSolid."""
+    from gdml_tools import indexed_mesh
+
+    orb = g4.solid.Orb("orb_tmp", radius, g4.Registry(), nslice=32, nstack=32)
+    vertices, facets = indexed_mesh(orb)
+    return g4.solid.TessellatedSolid(
+        name,
+        [vertices.tolist(), facets.tolist()],
+        reg,
+        meshtype=g4.solid.TessellatedSolid.MeshType.Freecad,
+    )
+
+
+def test_decimated_mesh_stays_close_to_the_surface():
+    import numpy as np
+
+    from gdml_tools import cluster_vertices, decimate_mesh, indexed_mesh, mesh_defects
+    from geometry_tools import surface_distance
+
+    vertices, facets = indexed_mesh(make_tessellated_sphere(g4.Registry()))
+    new_vertices, new_facets, report = decimate_mesh(vertices, facets, 0.5, 0.05)
+
+    assert report["facets_after"] < report["facets_before"]
+    assert mesh_defects(new_vertices, new_facets) is None
+    # the reported deviation bounds the exact distance between the surfaces
+    forward = surface_distance(vertices[facets].mean(axis=1), new_vertices[new_facets]).max()
+    backward = surface_distance(new_vertices[new_facets].mean(axis=1), vertices[facets]).max()
+    assert max(forward, backward) <= report["max_deviation_mm"] <= 0.5
+    assert np.abs(np.linalg.norm(new_vertices, axis=1) - 50).max() <= 0.5
+
+    # a coarse clustering is far off the surface
+    _, _, deviation = cluster_vertices(vertices, facets, 60.0)
+    assert deviation > 0.5
+
+
+def test_mesh_defects():
+    import numpy as np
+
+    from gdml_tools import mesh_defects
+
+    vertices = np.array([[0, 0, 0], [1, 0, 0], [0, 1, 0], [0, 0, 1]], dtype=float)
+    tetrahedron = np.array([[0, 2, 1], [0, 1, 3], [1, 2, 3], [0, 3, 2]])
+    assert mesh_defects(vertices, tetrahedron) is None
+    assert "open edges" in mesh_defects(vertices, tetrahedron[:3])
+    flipped = tetrahedron.copy()
+    flipped[0] = flipped[0, ::-1]
+    assert "flipped" in mesh_defects(vertices, flipped)
+    # a second tetrahedron sharing the edge 0-1 makes it non-manifold
+    extra = np.vstack([vertices, [[0, -1, 0], [0, 0, -1]]])
+    assert "more than two" in mesh_defects(extra, np.vstack([tetrahedron, [[0, 1, 4], [0, 5, 1], [1, 5, 4], [0, 4, 5]]]))
+    flat = vertices.copy()
+    flat[3] = [0.5, 0.5, 0]
+    assert "degenerate" in mesh_defects(flat, tetrahedron)
+
+
+def test_solid_used_by_a_boolean_is_not_decimated():
+    from gdml_tools import decimate_tessellated
+
+    reg = g4.Registry()
+    world_s = g4.solid.Box("World_s", 1000, 1000, 1000, reg)
+    world_lv = g4.LogicalVolume(world_s, "G4_Galactic", "World_lv", reg)
+    reg.setWorld(world_lv)
+    sphere_s = make_tessellated_sphere(reg)
+    cut_s = g4.solid.Box("Cut_s", 20, 20, 20, reg)
+    hollow_s = g4.solid.Subtraction("Hollow_s", sphere_s, cut_s, [[0, 0, 0], [0, 0, 0]], reg)
+    sphere_lv = g4.LogicalVolume(sphere_s, "G4_Fe", "Sphere_lv", reg)
+    g4.LogicalVolume(hollow_s, "G4_Fe", "Hollow_lv", reg)
+
+    assert decimate_tessellated(reg, 0.5, 0.05, verbose=False) == {}
+    assert sphere_lv.solid is sphere_s
+    assert reg.solidDict["Sphere_s"] is sphere_s
+
+    del reg.solidDict["Hollow_s"]
+    del reg.logicalVolumeDict["Hollow_lv"]
+    reports = decimate_tessellated(reg, 0.5, 0.05, verbose=False)
+    assert list(reports) == ["Sphere_s"]
+    assert sphere_lv.solid is reg.solidDict["Sphere_s_decimated"]
+    assert "Sphere_s" not in reg.solidDict
+
+
+def write_part_gdml(path, with_sphere=True):
+    """GDML file with a tessellated sphere (or a box) in a world box."""
+    reg = g4.Registry()
+    world_s = g4.solid.Box("World_s", 1000, 1000, 1000, reg)
+    world_lv = g4.LogicalVolume(world_s, "G4_Galactic", "World_lv", reg)
+    reg.setWorld(world_lv)
+    part_s = make_tessellated_sphere(reg) if with_sphere else g4.solid.Box("Part_s", 10, 10, 10, reg)
+    part_lv = g4.LogicalVolume(part_s, "G4_Fe", "Part_lv", reg)
+    g4.PhysicalVolume([0, 0, 0], [0, 0, 0], part_lv, "Part_pv", world_lv, reg)
+    writer = gd.Writer()
+    writer.addDetector(reg)
+    writer.write(str(path))
+    return str(path)
+
+
+def test_read_registries_parses_in_workers_and_caches(tmp_path, monkeypatch):
+    import gdml_tools
+    from gdml_tools import read_registries
+
+    paths = [write_part_gdml(tmp_path / "box.gdml", with_sphere=False), write_part_gdml(tmp_path / "sphere.gdml")]
+    cache_dir = str(tmp_path / "cache")
+
+    box_reg, sphere_reg = read_registries(paths, 2, (0.5, 0.05), cache_dir)
+    assert list(box_reg.solidDict) == ["World_s", "Part_s"]
+    assert "Sphere_s_decimated" in sphere_reg.solidDict
+    assert sphere_reg.logicalVolumeDict["Part_lv"].solid.name == "Sphere_s_decimated"
+    assert box_reg.materialDict["G4_Fe"].type == "nist"
+    assert len(os.listdir(cache_dir)) == 2
+
+    # unchanged files are loaded from the cache without being parsed again
+    def no_parse(*args, **kwargs):
+        raise AssertionError("cached registry parsed again")
+
+    monkeypatch.setattr(gdml_tools, "parse_registry", no_parse)
+    cached_box, cached_sphere = read_registries(paths, 2, (0.5, 0.05), cache_dir)
+    assert sorted(cached_sphere.solidDict) == sorted(sphere_reg.solidDict)
+    assert cached_box.solidDict["Part_s"].evaluateParameterWithUnits("pX") == 10
+    assert len(os.listdir(cache_dir)) == 2
+
+    # a cached registry can be written again
+    writer = gd.Writer()
+    writer.addDetector(cached_sphere)
+    writer.write(str(tmp_path / "rewritten.gdml"))
+    assert "Sphere_s_decimated" in gd.Reader(str(tmp_path / "rewritten.gdml")).getRegistry().solidDict
+
+
+def test_read_registries_without_decimation_or_cache(tmp_path):
+    from gdml_tools import read_registries
+
+    paths = [write_part_gdml(tmp_path / "box.gdml", with_sphere=False), write_part_gdml(tmp_path / "sphere.gdml")]
+    box_reg, sphere_reg = read_registries(paths, 2, None, None)
+    assert box_reg.solidDict["Part_s"].evaluateParameterWithUnits("pX") == 10
+    assert sphere_reg.logicalVolumeDict["Part_lv"].solid.name == "Sphere_s"
+    assert sorted(os.listdir(tmp_path)) == ["box.gdml", "sphere.gdml"]
+
+
+def test_read_stl_shares_vertices(tmp_path):
+    import numpy as np
+
+    from gdml_tools import _unique_rows, indexed_mesh, read_stl, stl_to_logical_volume
+
+    reg = g4.Registry()
+    vertices, facets = indexed_mesh(make_tessellated_sphere(reg, "Source_s"))
+    corners = vertices[facets].astype("<f4")
+    records = np.zeros(len(facets), dtype=[("normal", "<f4", (3,)), ("vertices", "<f4", (3, 3)), ("attribute", "<u2")])
+    records["vertices"] = corners
+    path = tmp_path / "sphere.stl"
+    with open(path, "wb") as f:
+        f.write(b"\0" * 80)
+        f.write(np.uint32(len(facets)).tobytes())
+        f.write(records.tobytes())
+
+    stl_vertices, stl_facets = read_stl(str(path))
+    assert len(stl_facets) == len(facets)
+    assert len(stl_vertices) == len(np.unique(corners.reshape(-1, 3), axis=0))
+    np.testing.assert_array_equal(stl_vertices[stl_facets], corners)
+
+    rows = corners.reshape(-1, 3).astype(np.float64)
+    unique, inverse = _unique_rows(rows)
+    expected, expected_inverse = np.unique(rows, axis=0, return_inverse=True)
+    np.testing.assert_array_equal(unique, expected)
+    np.testing.assert_array_equal(inverse, expected_inverse.reshape(-1))
+
+    lv = stl_to_logical_volume(str(path), reg, "Sphere", "G4_Fe", verbose=False)
+    assert indexed_mesh(lv.solid)[1].shape == (len(facets), 3)
+
+    with pytest.raises(ValueError, match="material 'PNE' not found"):
+        stl_to_logical_volume(str(path), reg, "Typo", "PNE", verbose=False)
+    pen = g4.MaterialSingleElement("PEN", 6, 12.0, 1.3, reg)
+    assert stl_to_logical_volume(str(path), reg, "Pen", "PEN", verbose=False).material is pen
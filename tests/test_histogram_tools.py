@@ -0,0 +1,321 @@
+import os
+import warnings
+
+import numpy as np
+import pytest
+
+ak = pytest.importorskip("awkward")
+h5py = pytest.importorskip("h5py")
+hist = pytest.importorskip("hist")
+pytest.importorskip("lgdo")
+
+with warnings.catch_warnings():
+    warnings.simplefilter("ignore", DeprecationWarning)
+    from lgdo import lh5, types
+
+import histogram_tools as ht
+
+
+def write_stp(path, edep, evtid=None, tables=None):
+    """
+    Small remage-like stp file: a det001 table with a jagged edep and a flat
+    evtid field, plus the __by_uid__ links, detector_origins and vtx entries
+    remage writes next to the detector tables. `tables` adds further
+    detector tables as {detid: {field: values}}; fields given as lists of
+    lists are written jagged.
+    """
+    n_rows = len(edep)
+    evtid = np.arange(n_rows) if evtid is None else np.asarray(evtid)
+    tables = {"det001": {"evtid": evtid, "edep": edep}, **(tables or {})}
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", DeprecationWarning)
+        for i, (detid, fields) in enumerate(tables.items()):
+            table = types.Table(
+                col_dict={
+                    field: types.VectorOfVectors(ak.Array(values))
+                    if isinstance(values, list) and values and isinstance(values[0], list)
+                    else types.Array(np.asarray(values))
+                    for field, values in fields.items()
+                }
+            )
+            lh5.write(table, detid, str(path), group="stp", wo_mode="of" if i == 0 else "a")
+        vtx = types.Table(col_dict={"evtid": types.Array(np.arange(n_rows)), "xloc": types.Array(np.zeros(n_rows))})
+        lh5.write(vtx, "vtx", str(path), group="stp", wo_mode="a")
+        origins = types.Struct({detid: types.Array(np.zeros(3)) for detid in tables})
+        lh5.write(origins, "detector_origins", str(path), group="stp", wo_mode="a")
+    with h5py.File(path, "a") as f:
+        by_uid = f["stp"].create_group("__by_uid__")
+        by_uid.attrs["datatype"] = "struct{" + ",".join(tables) + "}"
+        for detid in tables:
+            by_uid[detid] = h5py.SoftLink(f"/stp/{detid}")
+    return str(path)
+
+
+def test_fill_edep_streaming_over_chunks(tmp_path):
+    path = write_stp(tmp_path / "output.lh5", [[1.5, 2.0], [3.2], [], [10.1, 0.2]])
+    h = ht.fill_edep_streaming(["det001"], path, ht.energy_axis(20, 0, 20), chunk_size=3)
+    np.testing.assert_array_equal(np.nonzero(h.values())[0], [0, 3, 10])
+    assert h.sum() == 4
+
+
+def test_cached_histogram_and_lru_eviction(tmp_path):
+    path = write_stp(tmp_path / "output.lh5", [[1.0, 2.0], [3.0], []])
+    cache_dir = str(tmp_path / "cache")
+    key = ht.histogram_cache_key(path, ["det001"], "edep", ht.energy_axis())
+    assert key != ht.histogram_cache_key(path, ["det001"], "edep", ht.energy_axis(100))
+    assert key != ht.histogram_cache_key(path, ["det002"], "edep", ht.energy_axis())
+
+    calls = []
+
+    def fill():
+        calls.append(1)
+        return hist.Hist(ht.energy_axis()).fill([3.0])
+
+    first = ht.cached_histogram(key, fill, cache_dir)
+    second = ht.cached_histogram(key, fill, cache_dir)
+    assert len(calls) == 1
+    assert first == second
+    assert ht.cache_lookup("missing", cache_dir) is None
+
+    # the least recently used entries go first
+    for i, name in enumerate(["old", "mid", "new"]):
+        entry = os.path.join(cache_dir, f"{name}.pkl")
+        with open(entry, "wb") as f:
+            f.write(b"x" * 100)
+        os.utime(entry, (1000 + i, 1000 + i))
+    os.utime(os.path.join(cache_dir, f"{key}.pkl"), (2000, 2000))
+    size = os.path.getsize(os.path.join(cache_dir, f"{key}.pkl"))
+    ht.evict_histogram_cache(cache_dir, max_bytes=size + 150)
+    assert sorted(os.listdir(cache_dir)) == sorted([f"{key}.pkl", "new.pkl"])
+
+
+def test_merge_partials():
+    axis = ht.energy_axis(10, 0, 10)
+    a = hist.Hist(axis).fill([1, 2])
+    b = hist.Hist(axis).fill([2])
+    merged = ht.merge_partials(
+        [{"h": a, "ids": np.array([1, 2])}, {"h": b, "ids": np.array([7])}]
+    )
+    np.testing.assert_array_equal(merged["h"].values()[:3], [0, 1, 2])
+    np.testing.assert_array_equal(merged["ids"], [1, 2, 7])
+
+
+def test_fill_parallel_uses_cache_before_the_pool(tmp_path):
+    paths = [
+        write_stp(tmp_path / "a.lh5", [[1.5], [2.5]]),
+        write_stp(tmp_path / "b.lh5", [[1.5]]),
+    ]
+    cache_dir = str(tmp_path / "cache")
+    axis = ht.energy_axis(10, 0, 10)
+    total = ht.fill_edep_parallel(paths, ["det001"], max_workers=2, axis=axis, cache_dir=cache_dir)
+    np.testing.assert_array_equal(total.values()[:3], [0, 2, 1])
+
+    class NoPool:
+        def submit(self, *args, **kwargs):
+            raise AssertionError("fully cached run must not submit work")
+
+    cached = ht.fill_edep_parallel(paths, ["det001"], pool=NoPool(), axis=axis, cache_dir=cache_dir)
+    assert cached == total
+
+
+def test_sum_by_event_and_coincident():
+    ids, sums = ht.sum_by_event(np.array([5, 1, 5, 3, 1]), np.array([1.0, 2.0, 3.0, 4.0, 5.0]))
+    np.testing.assert_array_equal(ids, [1, 3, 5])
+    np.testing.assert_array_equal(sums, [7.0, 4.0, 4.0])
+
+    ids, sums = ht.sum_by_event(np.zeros(0, np.int64), np.zeros(0))
+    assert len(ids) == len(sums) == 0
+
+    np.testing.assert_array_equal(ht.coincident(np.array([0, 3, 5, 9]), np.array([3, 9])), [False, True, False, True])
+    assert not ht.coincident(np.array([1, 2]), np.zeros(0, np.int64)).any()
+
+
+def write_veto_stp(path):
+    """HPGe events 0-3 (100-400 keV), PEN hits in events 1 and 2, PMT photons in events 0 and 3."""
+    return write_stp(
+        path,
+        [[100.0], [150.0, 50.0], [300.0], [400.0]],
+        tables={
+            "det003": {"evtid": [1, 2, 2], "edep": [[5.0], [15.0], [10.0]]},
+            "det007": {"evtid": [0, 3, 3], "time": [[1.0], [1.0, 2.0], [3.0]]},
+        },
+    )
+
+
+def test_veto_event_ids_sums_over_rows_and_detectors(tmp_path):
+    path = write_veto_stp(tmp_path / "output.lh5")
+
+    # event 2 only passes the PEN threshold once its two rows are summed
+    np.testing.assert_array_equal(ht.veto_event_ids(["det003"], path, 20.0, chunk_size=2), [2])
+    np.testing.assert_array_equal(ht.veto_event_ids(["det003"], path, 5.0, chunk_size=2), [1, 2])
+    np.testing.assert_array_equal(
+        ht.veto_event_ids(["det003"], path, 20.0, ["det007"], 2, chunk_size=2), [2, 3]
+    )
+    np.testing.assert_array_equal(ht.veto_event_ids(["det003"], path, 1000.0, ["det007"], 4), [])
+
+
+def test_fill_anticoincidence_splits_vetoed_and_rejected(tmp_path):
+    path = write_veto_stp(tmp_path / "output.lh5")
+    veto_ids = ht.veto_event_ids(["det003"], path, 20.0, ["det007"], 2)
+    spectra = ht.fill_anticoincidence(["det001"], veto_ids, path, ht.energy_axis(5, 0, 500), chunk_size=3)
+
+    np.testing.assert_array_equal(spectra["raw"].values(), [0, 1, 1, 1, 1])
+    np.testing.assert_array_equal(spectra["vetoed"].values(), [0, 1, 1, 0, 0])
+    np.testing.assert_array_equal(spectra["rejected"].values(), [0, 0, 0, 1, 1])
+
+
+def test_fill_density_bins_every_step(tmp_path):
+    path = write_stp(
+        tmp_path / "output.lh5",
+        [[1.0]],
+        tables={
+            "det003": {
+                "evtid": [0, 1, 2],
+                "xloc": [[0.1, 0.6], [0.9], [0.2]],
+                "zloc": [[0.1, 0.1], [0.8], [0.7]],
+                "edep": [[1.0, 2.0], [4.0], [8.0]],
+            }
+        },
+    )
+    box = [(0.0, 1.0), (0.0, 1.0)]
+    h = ht.fill_density(["det003"], path, bins=(2, 2), range=box, chunk_size=2)
+    np.testing.assert_array_equal(h.values(), [[1, 1], [1, 1]])
+
+    weighted = ht.fill_density(["det003"], path, bins=(2, 2), range=box, weight="edep", chunk_size=2)
+    np.testing.assert_array_equal(weighted.values(), [[1, 8], [2, 4]])
+
+    # the default range is the bounding box of all steps
+    h = ht.fill_density(["det003"], path, bins=(4, 4), chunk_size=2)
+    assert h.axes[0].edges[0] == pytest.approx(0.1) and h.axes[0].edges[-1] == pytest.approx(0.9)
+    assert h.sum() == 4
+
+
+def test_fill_optical_streaming_counts_photons_per_event(tmp_path):
+    path = write_stp(
+        tmp_path / "output.lh5",
+        [[1.0]],
+        tables={
+            "det007": {
+                "evtid": [0, 1, 1, 4],
+                "wavelength": [[420.0, 430.0], [450.0], [], [600.0]],
+                "time": [[10.0, 20.0], [30.0], [], [900.0]],
+            }
+        },
+    )
+    # event 1 is split over both chunks
+    result = ht.fill_optical_streaming(
+        "det007", path, ht.wavelength_axis(6, 100, 700), ht.time_axis(10, 0, 1000),
+        ht.photon_count_axis(5), chunk_size=2,
+    )
+    np.testing.assert_array_equal(result["wavelength"].values(), [0, 0, 0, 3, 0, 1])
+    np.testing.assert_array_equal(result["time"].values(), [3, 0, 0, 0, 0, 0, 0, 0, 0, 1])
+    np.testing.assert_array_equal(result["evtid"], [0, 1, 4])
+    np.testing.assert_array_equal(result["n_photons"], [2, 1, 1])
+    np.testing.assert_array_equal(result["photons"].values(), [0, 2, 1, 0, 0])
+
+
+def test_response_rng_is_reproducible(tmp_path):
+    path = write_stp(tmp_path / "output.lh5", [[1.0]])
+    draw = ht.response_rng(1, "det001", 0, ht.file_seed(path)).standard_normal(4)
+    np.testing.assert_array_equal(draw, ht.response_rng(1, "det001", 0, ht.file_seed(path)).standard_normal(4))
+    assert not np.array_equal(draw, ht.response_rng(1, "det002", 0, ht.file_seed(path)).standard_normal(4))
+    assert not np.array_equal(draw, ht.response_rng(2, "det001", 0, ht.file_seed(path)).standard_normal(4))
+    assert not np.array_equal(draw, ht.response_rng(1, "det001", 100, ht.file_seed(path)).standard_normal(4))
+
+    response = {"a": 1.0, "threshold": 5.0}
+    smeared = ht.apply_response(np.array([0.0, 100.0, 200.0]), response, ht.response_rng(1, "det001", 0, ht.file_seed(path)))
+    assert len(smeared) == 2
+    assert np.all(np.abs(smeared - [100.0, 200.0]) < 10)
+
+
+def test_response_seed_differs_for_job_outputs_with_the_same_name(tmp_path):
+    os.makedirs(tmp_path / "run1")
+    os.makedirs(tmp_path / "run2")
+    run1 = write_stp(tmp_path / "run1" / "output.lh5", [[1.0]], evtid=[1])
+    run2 = write_stp(tmp_path / "run2" / "output.lh5", [[1.0]], evtid=[2])
+    assert ht.file_seed(run1) != ht.file_seed(run2)
+    draw1 = ht.response_rng(0, "det001", 0, ht.file_seed(run1)).standard_normal(4)
+    draw2 = ht.response_rng(0, "det001", 0, ht.file_seed(run2)).standard_normal(4)
+    assert not np.array_equal(draw1, draw2)
+
+    # the seed follows the content, not the location
+    moved = str(tmp_path / "moved.lh5")
+    os.replace(run1, moved)
+    np.testing.assert_array_equal(draw1, ht.response_rng(0, "det001", 0, ht.file_seed(moved)).standard_normal(4))
+
+
+def test_reduce_edep_applies_the_response_without_streaming(tmp_path, monkeypatch):
+    import Histogram
+
+    path = write_stp(tmp_path / "output.lh5", [[100.0, 50.0], [300.0], [2.0], [1000.0]])
+    monkeypatch.setattr(Histogram, "PARALLEL", False)
+    monkeypatch.setattr(Histogram, "STREAMING", False)
+    monkeypatch.setattr(Histogram, "APPLY_RESPONSE", True)
+
+    h = Histogram.reduce_edep("BEGe", [path])
+    # the 2 keV event is below the BEGe threshold
+    assert h.sum() == 3
+
+    # one chunk over the whole table draws the same noise as the streaming path
+    streamed = ht.fill_edep_streaming(
+        ["det001"], path, response=Histogram.detector_response["BEGe"], seed=Histogram.RESPONSE_SEED
+    )
+    np.testing.assert_array_equal(h.values(), streamed.values())
+
+
+def test_read_flat_slices_the_memory_map(tmp_path):
+    flat_dir = tmp_path / "flat"
+    os.makedirs(flat_dir / "det001")
+    np.save(flat_dir / "det001" / "edep.values.npy", np.array([1.0, 2.0, 3.0, 4.0]))
+    np.save(flat_dir / "det001" / "edep.offsets.npy", np.array([0, 2, 2, 4]))
+    np.save(flat_dir / "det001" / "evtid.values.npy", np.array([7, 8, 9]))
+    (flat_dir / ht.FLAT_META_FILE).write_text('{"fields": {"det001": ["evtid", "edep"]}}')
+    flat_dir = str(flat_dir)
+
+    assert ht.is_flat_cache(flat_dir)
+    assert ht.read_flat(flat_dir, "det001", "edep").tolist() == [[1.0, 2.0], [], [3.0, 4.0]]
+    assert ht.read_flat(flat_dir, "det001", "edep", 1, 3).tolist() == [[], [3.0, 4.0]]
+    assert ht.read_flat(flat_dir, "det001", "evtid", 1).tolist() == [8, 9]
+    assert ht.flat_n_rows(flat_dir, "det001", "edep") == 3
+
+    chunks = list(ht.iter_flat_chunks("stp/det001", flat_dir, chunk_size=2))
+    assert [len(chunk) for chunk in chunks] == [2, 1]
+    assert ak.concatenate(chunks).edep.tolist() == [[1.0, 2.0], [], [3.0, 4.0]]
+
+
+def test_convert_to_flat_round_trip(tmp_path):
+    edep = [[1.5, 2.0], [3.2], [], [10.1, 0.2]]
+    path = write_stp(tmp_path / "output.lh5", edep, evtid=[4, 5, 6, 7])
+    flat_dir = ht.convert_to_flat(path, str(tmp_path / "flat"), chunk_size=3)
+
+    # only the detector table, not the links, the origins or the vertices
+    assert ht.is_flat_cache(flat_dir)
+    assert sorted(os.listdir(flat_dir)) == sorted(["det001", ht.FLAT_META_FILE])
+
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", DeprecationWarning)
+        table = lh5.read("stp/det001", path).view_as("ak")
+    assert ht.read_flat(flat_dir, "det001", "edep").tolist() == table.edep.tolist() == edep
+    assert ht.read_flat(flat_dir, "det001", "evtid").tolist() == table.evtid.tolist()
+    assert ht.read_flat(flat_dir, "det001", "edep", 1, 3).tolist() == edep[1:3]
+
+    chunks = list(ht.iter_flat_chunks("stp/det001", flat_dir, chunk_size=3))
+    assert [len(chunk) for chunk in chunks] == [3, 1]
+    assert ak.concatenate(chunks).tolist() == table.tolist()
+
+
+def test_position_range_of_several_files_is_cached(tmp_path, monkeypatch):
+    steps = {"evtid": [0], "xloc": [[0.1, 0.6]], "zloc": [[0.2, 0.3]]}
+    paths = [
+        write_stp(tmp_path / "a.lh5", [[1.0]], tables={"det003": steps}),
+        write_stp(tmp_path / "b.lh5", [[1.0]], tables={"det003": {**steps, "xloc": [[-0.5]], "zloc": [[0.4]]}}),
+    ]
+    cache_dir = str(tmp_path / "cache")
+    box = ht.position_range(["det003"], paths, cache_dir=cache_dir)
+    assert box[0][0] == -0.5 and box[1][1] == pytest.approx(0.4)
+
+    def no_reads(*args, **kwargs):
+        raise AssertionError("cached range must not read the steps")
+
+    monkeypatch.setattr(ht, "iter_chunks", no_reads)
+    assert ht.position_range(["det003"], paths, cache_dir=cache_dir) == box
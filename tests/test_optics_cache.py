@@ -0,0 +1,41 @@
+import numpy as np
+import pytest
+
+g4 = pytest.importorskip("pyg4ometry.geant4")
+lar_optics = pytest.importorskip("legendoptics.lar")
+
+from geometry_tools import attach_optics
+
+
+def make_lar(reg):
+    ar = g4.ElementSimple("Argon", "Ar", 18, 39.95, registry=reg)
+    lar = g4.Material(name="LAr", density=1.390, number_of_components=1, state="liquid", registry=reg)
+    lar.add_element_natoms(ar, 1)
+    return lar
+
+
+def property_table(mat):
+    """{property: (matrix name, values)} of a material."""
+    return {name: (matrix.name, np.asarray(matrix.eval()).tolist()) for name, matrix in mat.properties.items()}
+
+
+def build(attach_kwargs, use_cache, cache_dir):
+    reg = g4.Registry()
+    lar = make_lar(reg)
+    if use_cache:
+        attach_optics(lar_optics.pyg4_lar_attach_scintillation, lar, reg, cache_dir=cache_dir, **attach_kwargs)
+    else:
+        lar_optics.pyg4_lar_attach_scintillation(lar, reg, **attach_kwargs)
+    return lar
+
+
+def test_cached_lar_scintillation_matches_direct_attach(tmp_path):
+    kwargs = {"flat_top_yield": 1000 / lar_optics.u.MeV}
+    direct = property_table(build(kwargs, False, tmp_path))
+    miss = property_table(build(kwargs, True, tmp_path))
+    hit = property_table(build(kwargs, True, tmp_path))
+
+    # SCINTILLATIONCOMPONENT2 reuses the matrix returned for COMPONENT1
+    assert "SCINTILLATIONCOMPONENT2" in direct
+    assert miss == direct
+    assert hit == direct
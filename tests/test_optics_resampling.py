@@ -0,0 +1,41 @@
+import numpy as np
+
+from geometry_tools import _compress_call, simplify_spectrum
+
+
+def sentinel_spectrum():
+    """Smooth absorption length with a 1e6 "transparent" sentinel on one side."""
+    x = np.linspace(2.0, 4.0, 201)
+    y = np.where(x < 3.0, 1e6, 0.1 + np.exp(-4 * (x - 3.0)))
+    return x, y
+
+
+def resampled(x, y, keep):
+    """Linear interpolation through the kept points, evaluated at every x."""
+    if x[0] > x[-1]:
+        return resampled(x[::-1], y[::-1], len(x) - 1 - keep[::-1])[::-1]
+    return np.interp(x, x[keep], y[keep])
+
+
+def test_simplify_spectrum_bound_is_relative_to_each_sample():
+    x, y = sentinel_spectrum()
+    keep = simplify_spectrum(x, y, 0.01)
+    assert keep[0] == 0 and keep[-1] == len(x) - 1
+    assert len(keep) < len(x) / 2
+    assert np.all(np.abs(resampled(x, y, keep) - y) <= 0.01 * y)
+
+    # decreasing x (e.g. tables in wavelength) keeps the same bound
+    x, y = x[::-1], y[::-1]
+    keep = simplify_spectrum(x, y, 0.01)
+    assert np.all(np.abs(resampled(x, y, keep) - y) <= 0.01 * y)
+
+
+def test_compress_call_resamples_vector_properties_only():
+    x, y = sentinel_spectrum()
+    name, x_kept, y_kept = _compress_call("PEN", "addVecProperty", ("ABSLENGTH", x, y), 0.01)
+    assert name == "ABSLENGTH"
+    assert 2 < len(x_kept) < len(x)
+    np.testing.assert_allclose(np.interp(x, x_kept, y_kept), y, rtol=0.01)
+
+    args = ("RINDEX", x, y)
+    assert _compress_call("PEN", "addConstProperty", args, 0.01) is args
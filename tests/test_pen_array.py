@@ -0,0 +1,44 @@
+import pytest
+
+from geometry_tools import load_positions, write_positions
+
+POSITIONS = [
+    ("A", "bege", (0.0, 0.0, 9.0)),
+    ("B", "coax", (12.0, 0.0, 0.0)),
+    ("C", "bege", (0.0, 12.0, -4.5)),
+]
+
+
+def test_position_table_round_trip(tmp_path):
+    path = tmp_path / "positions.csv"
+    write_positions(POSITIONS, path)
+    assert load_positions(str(path)) == POSITIONS
+    assert load_positions([[" A ", "bege", "0", "0", "9"]]) == POSITIONS[:1]
+
+
+def test_duplicate_position_names_are_rejected():
+    with pytest.raises(ValueError, match="Duplicate position name 'A'"):
+        load_positions([["A", "bege", 0, 0, 0], ["A", "coax", 10, 0, 0]])
+
+
+def test_array_shares_one_unit_per_type_with_consecutive_uids(tmp_path, monkeypatch):
+    pytest.importorskip("pyg4ometry")
+    pytest.importorskip("legendhpges")
+    pytest.importorskip("legendoptics")
+    pytest.importorskip("pygeomtools")
+    from geometry_tools import collect_detectors
+    from PENArray import build_array
+
+    # keeps the optics cache out of the repository
+    monkeypatch.chdir(tmp_path)
+    reg = build_array(POSITIONS)
+    pvs = reg.physicalVolumeDict
+
+    for part in ("hpge", "wall", "bottom", "pmt"):
+        assert pvs[f"A_{part}_pv"].logicalVolume is pvs[f"C_{part}_pv"].logicalVolume
+        assert pvs[f"A_{part}_pv"].logicalVolume is not pvs[f"B_{part}_pv"].logicalVolume
+
+    detectors = collect_detectors(reg)
+    assert [uid for uid, _, _ in detectors] == list(range(1, 4 * len(POSITIONS) + 2))
+    assert [name for _, name, _ in detectors[4:8]] == ["B_hpge_pv", "B_wall_pv", "B_bottom_pv", "B_pmt_pv"]
+    assert detectors[-1][1:] == ("LAr_pv", "scintillator")
@@ -0,0 +1,50 @@
+import json
+import multiprocessing
+import os
+
+import pytest
+
+g4 = pytest.importorskip("pyg4ometry.geant4")
+pytest.importorskip("pygeomtools")
+
+from geometry_tools import run_sweep
+
+FORBID_BUILD_ENV = "SWEEP_TEST_FORBID_BUILD"
+
+
+def build_box(size):
+    """World holding a LAr_lv box of side `size` mm (importable by the sweep workers)."""
+    if os.environ.get(FORBID_BUILD_ENV):
+        raise RuntimeError("variant rebuilt")
+    reg = g4.Registry()
+    world_s = g4.solid.Box("world_s", 1000, 1000, 1000, reg, "mm")
+    world_lv = g4.LogicalVolume(world_s, "G4_Galactic", "world_lv", reg)
+    reg.setWorld(world_lv)
+    lar_s = g4.solid.Box("LAr_s", size, size, size, reg, "mm")
+    lar_lv = g4.LogicalVolume(lar_s, "G4_lAr", "LAr_lv", reg)
+    g4.PhysicalVolume([0, 0, 0], [0, 0, 0], lar_lv, "LAr_pv", world_lv, reg)
+    return reg
+
+
+def test_second_sweep_builds_nothing(tmp_path, monkeypatch, capsys):
+    outdir = tmp_path / "sweep"
+    grid = {"size": [10, 20]}
+    # spawned workers: other tests leave library threads (pyarrow's allocator)
+    # running in this process, and forking it hangs the interpreter at exit
+    spawn = multiprocessing.get_context("spawn")
+    first = run_sweep(build_box, grid, str(outdir), max_workers=2, mp_context=spawn)
+    assert sorted(meta["gdml"] for meta in first) == ["variant_size10.gdml", "variant_size20.gdml"]
+    with open(outdir / "variant_size10.json") as f:
+        assert json.load(f)["gdml"] == "variant_size10.gdml"
+    capsys.readouterr()
+
+    # the recorded paths are relative, so a moved sweep directory is still complete
+    moved = tmp_path / "moved"
+    os.replace(outdir, moved)
+    monkeypatch.setenv(FORBID_BUILD_ENV, "1")
+    second = run_sweep(build_box, grid, str(moved), max_workers=2, mp_context=spawn)
+
+    assert sorted(meta["params"]["size"] for meta in second) == [10, 20]
+    out = capsys.readouterr().out
+    assert out.count("[SKIP]") == 2
+    assert "0 built, 2 skipped" in out and "[FAIL]" not in out